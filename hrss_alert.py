@@ -0,0 +1,720 @@
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def new_alert_id():
+    """Make a new unique alert ID
+
+    Returns:
+        (str): 32 hex digits that identify 1 alert
+    """
+    return uuid.uuid4().hex
+
+
+class AlertQueue:
+    """In-process queue of alerts sent by a pool of sender threads
+
+    The request that ingests a heart rate only puts the alert on the queue
+    and returns, so a slow or unreachable email server never holds up a
+    request. The queue has a bounded depth, so an outage can't grow it
+    without limit, and the senders are started on the first submit.
+
+    Every alert is a payload handed to sender(payload), which returns a
+    (msg, status) tuple like send_email() always did. Its outcome is kept
+    in the results dict keyed by alert ID in the format of {
+    "status": <"queued", "sent" or "failed">, "msg": <str>}
+
+    With an Outbox, every alert is written to disk before it is queued and
+    a retry thread puts the alerts that are due back on the queue, so a
+    full queue or a failed send only delays an alert. The status is then
+    "retrying" between 2 tries and "dead" once the outbox gave up on it
+    """
+
+    def __init__(self, sender, workers=4, max_depth=1000,
+                 max_results=10000, outbox=None, retry_interval=1.0):
+        self.sender = sender
+        self.workers = workers
+        self.max_results = max_results
+        self.outbox = outbox
+        self.retry_interval = retry_interval
+        self.results = {}
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._threads = []
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def start(self):
+        """Open the outbox and start the sender threads if they aren't
+        running yet"""
+        with self._lock:
+            if len(self._threads) != 0:
+                return
+            if self.outbox is not None:
+                self.outbox.open()
+            self._stopped.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, daemon=True,
+                                          name='hrss-alert-{}'.format(i))
+                thread.start()
+                self._threads.append(thread)
+            if self.outbox is not None:
+                self._retry_thread = threading.Thread(
+                    target=self._retry, daemon=True,
+                    name='hrss-alert-retry')
+                self._retry_thread.start()
+
+    def stop(self):
+        """Let the senders finish the queued alerts and then stop them"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        self._stopped.set()
+        if len(threads) != 0 and self.outbox is not None:
+            self._retry_thread.join()
+        for _ in threads:
+            self._queue.put(None)  # 1 stop sign per sender
+        for thread in threads:
+            thread.join()
+
+    def submit(self, alert_id, payload):
+        """Put 1 alert on the queue without waiting
+
+        Args:
+            alert_id (str): the ID of the alert, see new_alert_id()
+            payload (dict): what the sender needs to send the alert
+
+        Returns:
+            (bool): True if the alert was queued, False if the queue was
+            full and the alert was dropped. With an outbox an alert is never
+            dropped, it waits in the outbox for the retry thread instead
+        """
+        self.start()
+        self._set_result(alert_id, 'queued', '')
+        if self.outbox is not None:
+            self.outbox.add(alert_id, payload, in_queue=True)
+        try:
+            self._queue.put_nowait((alert_id, payload))
+        except queue.Full:
+            if self.outbox is not None:
+                self.outbox.release(alert_id)
+                return True
+            self._set_result(alert_id, 'failed', 'The alert queue is full.')
+            logging.error('Alert {} was dropped because the alert queue '
+                          'is full'.format(alert_id))
+            return False
+        return True
+
+    def result(self, alert_id):
+        """The outcome of 1 alert
+
+        Args:
+            alert_id (str): the ID of the alert
+
+        Returns:
+            (dict or None): {"status": <str>, "msg": <str>}, or None if the
+            alert ID is unknown
+        """
+        return self.results.get(alert_id)
+
+    def join(self):
+        """Wait until every queued alert has been handled"""
+        self._queue.join()
+
+    def _set_result(self, alert_id, status, msg):
+        with self._lock:
+            self.results[alert_id] = {'status': status, 'msg': msg}
+            if len(self.results) > self.max_results:  # Forget the oldest
+                del self.results[next(iter(self.results))]
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            alert_id, payload = item
+            try:
+                msg, status = self.sender(payload)
+            except Exception as e:  # A sender must never kill the thread
+                msg, status = str(e), 500
+                logging.error('Alert {} failed: {}'.format(alert_id, e))
+            try:
+                if self.outbox is not None:
+                    outcome = self.outbox.record(alert_id, msg, status)
+                else:
+                    outcome = 'sent' if status == 200 else 'failed'
+                self._set_result(alert_id, outcome, msg)
+            finally:
+                self._queue.task_done()
+
+    def _retry(self):
+        while not self._stopped.wait(self.retry_interval):
+            for alert_id, payload in self.outbox.due():
+                try:
+                    self._queue.put_nowait((alert_id, payload))
+                except queue.Full:
+                    self.outbox.release(alert_id)
+            self.outbox.compact()  # Off the request threads
+
+
+class CircuitBreaker:
+    """Fail fast while a remote server keeps failing
+
+    The breaker is closed while the server works. After failure_threshold
+    failures in a row it opens and every call is refused right away for
+    reset_timeout seconds. Then it lets 1 trial call through (half-open):
+    a success closes it again and a failure opens it for another
+    reset_timeout
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False  # True while the half-open trial call runs
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """The state of the breaker: closed, open or half-open"""
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half-open'
+
+    def allow(self):
+        """Whether a call may go through now
+
+        Returns:
+            (bool): True if closed, or if half-open and no other trial call
+            is running
+        """
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        """Close the breaker after a call that worked"""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        """Count a failed call and open the breaker if it's 1 too many"""
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self._trial = False
+
+
+class EmailClient:
+    """Keep-alive HTTP client of the email server
+
+    All the sender threads share 1 requests.Session, whose connection pool
+    keeps the connections to the email server open between emails. Every
+    post has a connect and a read timeout, and a CircuitBreaker refuses the
+    posts while the server is down, so an outage costs a sender thread
+    nothing instead of a timeout per email. A connection error, a timeout
+    or a 5xx answer counts as a failure of the server
+
+    The counters dict is in the format of {"in_flight": <int>,
+    "sent": <int>, "failed": <int>, "short_circuited": <int>}
+    """
+
+    def __init__(self, url, connect_timeout=3.05, read_timeout=10.0,
+                 pool_size=4, breaker=None):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.counters = {'in_flight': 0, 'sent': 0, 'failed': 0,
+                         'short_circuited': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name, step=1):
+        with self._lock:
+            self.counters[name] += step
+
+    def metrics(self):
+        """A copy of the counters plus the state of the circuit breaker
+
+        Returns:
+            (dict): the counters and "circuit": <"closed", "open" or
+            "half-open">
+        """
+        with self._lock:
+            out = dict(self.counters)
+        out['circuit'] = self.breaker.state
+        return out
+
+    def send(self, payload):
+        """Post 1 email to the email server
+
+        Args:
+            payload (dict): the json of the email
+
+        Returns:
+            msg (str): the answer of the email server or what went wrong
+            status (int): the status code of the email server, or 503 if
+            the server couldn't be reached or the circuit is open
+        """
+        if not self.breaker.allow():
+            self._count('short_circuited')
+            return 'The email server is unavailable, the email was not ' \
+                   'sent.', 503
+        self._count('in_flight')
+        try:
+            r = self.session.post(self.url, json=payload,
+                                  timeout=self.timeout)
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            self._count('failed')
+            return 'The email server could not be reached: {}'.format(e), 503
+        finally:
+            self._count('in_flight', -1)
+        if r.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        self._count('sent' if r.status_code == 200 else 'failed')
+        return r.text, r.status_code
+
+
+class TokenBucket:
+    """Allow bursts of up to capacity calls, refilled at rate per second"""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+
+    def take(self):
+        """Take 1 token if there is one
+
+        Returns:
+            (bool): True if a token was taken, False if the bucket is empty
+        """
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class AlertCoalescer:
+    """Merge the tachycardia alerts of a patient into fewer emails
+
+    The first tachycardic reading of a patient is alerted right away and
+    opens a window of window seconds. The tachycardic readings inside the
+    window are only counted, and when the window ends they are sent as 1
+    summary in the format of {"patient_id": <int>,
+    "attending_username": <str>, "count": <int>, "max_heart_rate": <int>,
+    "first_timestamp": <int>, "last_timestamp": <int>}
+
+    Every email also takes a token from the bucket of the physician, so
+    1 physician never gets more than rate * 3600 emails an hour after a
+    burst of capacity. A reading that finds the bucket empty is merged into
+    the summary instead, and a summary waits for a token, so nothing is lost
+    """
+
+    def __init__(self, window=300.0, rate=10 / 3600, capacity=10,
+                 clock=time.monotonic):
+        self.window = window
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.open = {}  # patient_id: the state of the window of the patient
+        self.buckets = {}  # attending_username: TokenBucket
+        self.counters = {'alerted': 0, 'merged': 0, 'summaries': 0}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _take(self, attending_username):
+        bucket = self.buckets.get(attending_username)
+        if bucket is None:
+            bucket = self.buckets[attending_username] = TokenBucket(
+                self.rate, self.capacity, self.clock)
+        return bucket.take()
+
+    def offer(self, patient_id, attending_username, timestamp, heart_rate):
+        """Decide what to do with 1 tachycardic reading
+
+        Args:
+            patient_id (int): the ID that identifies the patient
+            attending_username (str): the physician to alert
+            timestamp (int): nanoseconds since EPOCH of the reading
+            heart_rate (int): heart rate of the reading in bpm
+
+        Returns:
+            (bool): True if the reading must be alerted now, False if it
+            was merged into the summary of the patient
+        """
+        with self._lock:
+            state = self.open.get(patient_id)
+            if state is None:
+                state = self.open[patient_id] = {
+                    'attending_username': attending_username,
+                    'opened': self.clock(), 'count': 0,
+                    'max_heart_rate': 0, 'first_timestamp': None,
+                    'last_timestamp': None}
+                if self._take(attending_username):
+                    self.counters['alerted'] += 1
+                    return True
+            state['count'] += 1
+            state['max_heart_rate'] = max(state['max_heart_rate'],
+                                          int(heart_rate))
+            timestamp = int(timestamp)
+            if state['first_timestamp'] is None:
+                state['first_timestamp'] = state['last_timestamp'] = \
+                    timestamp
+            else:  # A late reading can be older than the merged ones
+                state['first_timestamp'] = min(state['first_timestamp'],
+                                               timestamp)
+                state['last_timestamp'] = max(state['last_timestamp'],
+                                              timestamp)
+            self.counters['merged'] += 1
+            return False
+
+    def flush(self):
+        """Close the windows that ended and collect their summaries
+
+        Returns:
+            summaries (list of dict): 1 summary per closed window with
+            merged readings, for which a token was available
+        """
+        summaries = []
+        now = self.clock()
+        with self._lock:
+            for patient_id in list(self.open):
+                state = self.open[patient_id]
+                if now - state['opened'] < self.window:
+                    continue
+                if state['count'] != 0:
+                    if not self._take(state['attending_username']):
+                        continue  # The summary waits for the next token
+                    summary = {'patient_id': patient_id}
+                    summary.update(state)
+                    del summary['opened']
+                    summaries.append(summary)
+                    self.counters['summaries'] += 1
+                del self.open[patient_id]
+        return summaries
+
+    def start(self, send_summary, interval=1.0):
+        """Flush every interval seconds from a background thread
+
+        Args:
+            send_summary (callable): called with every summary to send
+            interval (float): seconds between 2 flushes
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, args=(send_summary, interval),
+                daemon=True, name='hrss-alert-coalescer')
+            self._thread.start()
+
+    def _run(self, send_summary, interval):
+        while True:
+            time.sleep(interval)
+            for summary in self.flush():
+                try:
+                    send_summary(summary)
+                except Exception as e:
+                    logging.error('Alert summary of patient {} failed: '
+                                  '{}'.format(summary['patient_id'], e))
+
+
+class Outbox:
+    """Append-only file of the alerts that still have to be sent
+
+    Every change is 1 json line appended to the outbox file, which stays
+    open, and flushed to disk before it is acted on, in the format of
+    {"op": <str>, "alert_id": <str>, ...} where op is "add" (with the
+    "payload"), "retry" (with the "attempts" so far), "done" or "dead".
+    Reading the file back in open() gives the alerts that were pending,
+    so a restart doesn't drop any of them.
+
+    A failed alert is retried after an exponential backoff with full
+    jitter, base_delay * 2 ** attempts seconds at most, capped at
+    max_delay. After max_attempts, or on an answer that retrying won't fix
+    (a 4xx status other than 429), it is moved to the dead-letter file,
+    1 json line per alert in the format of {"alert_id": <str>,
+    "payload": <dict>, "attempts": <int>, "msg": <str>, "status": <int>}
+
+    The lines of the sent and dead alerts are only dropped when the file is
+    rewritten with the pending alerts alone, at start-up and by compact()
+    once they outnumber the pending alerts
+    """
+
+    def __init__(self, path, dead_letter_path, max_attempts=8,
+                 base_delay=1.0, max_delay=300.0, clock=time.monotonic,
+                 rng=random.random):
+        self.path = path
+        self.dead_letter_path = dead_letter_path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.rng = rng
+        self.pending = {}  # alert_id: {"payload": <dict>, "attempts": <int>,
+        # "next_try": <float>, "in_queue": <bool>}
+        self._lock = threading.Lock()
+        self._file = None  # The outbox file open for appending
+        self._finished = 0  # Sent and dead alerts since the last rewrite
+
+    def __len__(self):
+        return len(self.pending)
+
+    def open(self):
+        """Read the pending alerts back and open the file for appending
+
+        Nothing touches the file before, so importing the server leaves no
+        outbox behind. AlertQueue.start() opens its outbox
+        """
+        with self._lock:
+            if self._file is not None:
+                return
+            self._load()
+            if self._file is None:
+                self._file = open(self.path, 'a')
+
+    def close(self):
+        """Close the outbox file"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _load(self):
+        self.pending = {}  # The file has every change, also after close()
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # A line cut short by a crash
+                    continue
+                alert_id = entry['alert_id']
+                if entry['op'] == 'add':
+                    self.pending[alert_id] = {
+                        'payload': entry['payload'], 'attempts': 0,
+                        'next_try': 0.0, 'in_queue': False}
+                elif entry['op'] == 'retry' and alert_id in self.pending:
+                    self.pending[alert_id]['attempts'] = entry['attempts']
+                else:
+                    self.pending.pop(alert_id, None)
+        self._compact()
+
+    def compact(self):
+        """Rewrite the outbox file once it holds more finished alerts
+        than pending ones
+
+        This runs on the retry thread of AlertQueue, so the file of a
+        server that runs for months stays about as long as its pending
+        alerts, while a request only ever appends 1 line
+
+        Returns:
+            (bool): True if the file was rewritten
+        """
+        with self._lock:
+            if self._finished <= len(self.pending):
+                return False
+            self._compact()
+            return True
+
+    def _compact(self):
+        # Rewrite the file with only the pending alerts, so it doesn't grow
+        # forever. Replacing it is atomic, so a crash keeps 1 of the 2 files
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for alert_id, alert in self.pending.items():
+                f.write(json.dumps({'op': 'add', 'alert_id': alert_id,
+                                    'payload': alert['payload']}) + '\n')
+                if alert['attempts'] != 0:
+                    f.write(json.dumps({'op': 'retry', 'alert_id': alert_id,
+                                        'attempts': alert['attempts']}) +
+                            '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if self._file is not None:
+            self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'a')
+        self._finished = 0
+
+    def _write(self, entry):
+        # Append 1 line to the outbox file, which stays open
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _append(self, path, entry):
+        with open(path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add(self, alert_id, payload, in_queue=False):
+        """Keep 1 new alert on disk until it's sent
+
+        Args:
+            alert_id (str): the ID of the alert
+            payload (dict): what the sender needs to send the alert
+            in_queue (bool): True if the caller puts it on a queue itself,
+            so due() doesn't hand it out again
+        """
+        with self._lock:
+            self._write({'op': 'add', 'alert_id': alert_id,
+                         'payload': payload})
+            self.pending[alert_id] = {'payload': payload, 'attempts': 0,
+                                      'next_try': 0.0, 'in_queue': in_queue}
+
+    def due(self):
+        """Take the pending alerts whose next try has come
+
+        Returns:
+            (list of tuple): (alert_id, payload) of every due alert, which
+            are then marked as queued until record() is called on them
+        """
+        now = self.clock()
+        out = []
+        with self._lock:
+            for alert_id, alert in self.pending.items():
+                if not alert['in_queue'] and alert['next_try'] <= now:
+                    alert['in_queue'] = True
+                    out.append((alert_id, alert['payload']))
+        return out
+
+    def release(self, alert_id):
+        """Hand an alert taken by due() back, when it couldn't be queued"""
+        with self._lock:
+            if alert_id in self.pending:
+                self.pending[alert_id]['in_queue'] = False
+
+    def record(self, alert_id, msg, status):
+        """Record the outcome of 1 try to send an alert
+
+        Args:
+            alert_id (str): the ID of the alert
+            msg (str): the answer of the sender
+            status (int): the status code of the sender
+
+        Returns:
+            (str): "sent", "retrying" or "dead"
+        """
+        with self._lock:
+            alert = self.pending.get(alert_id)
+            if alert is None:
+                return 'sent' if status == 200 else 'dead'
+            alert['in_queue'] = False
+            if status == 200:
+                self._write({'op': 'done', 'alert_id': alert_id})
+                del self.pending[alert_id]
+                self._finished += 1
+                return 'sent'
+            alert['attempts'] += 1
+            permanent = 400 <= status < 500 and status != 429
+            if permanent or alert['attempts'] >= self.max_attempts:
+                self._append(self.dead_letter_path, {
+                    'alert_id': alert_id, 'payload': alert['payload'],
+                    'attempts': alert['attempts'], 'msg': msg,
+                    'status': status})
+                self._write({'op': 'dead', 'alert_id': alert_id})
+                del self.pending[alert_id]
+                self._finished += 1
+                return 'dead'
+            self._write({'op': 'retry', 'alert_id': alert_id,
+                         'attempts': alert['attempts']})
+            delay = min(self.max_delay,
+                        self.base_delay * 2 ** alert['attempts'])
+            alert['next_try'] = self.clock() + delay * self.rng()
+            return 'retrying'
+
+    def list_pending(self):
+        """The pending alerts for inspection
+
+        Returns:
+            (list of dict): {"alert_id": <str>, "payload": <dict>,
+            "attempts": <int>} per pending alert
+        """
+        with self._lock:
+            return [{'alert_id': alert_id, 'payload': alert['payload'],
+                     'attempts': alert['attempts']}
+                    for alert_id, alert in self.pending.items()]
+
+    def dead_letters(self):
+        """The alerts in the dead-letter file
+
+        Returns:
+            (list of dict): 1 dict per dead alert, see the class docstring
+        """
+        if not os.path.exists(self.dead_letter_path):
+            return []
+        with open(self.dead_letter_path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def replay(self, alert_ids=None):
+        """Move dead alerts back into the outbox to be sent again
+
+        Args:
+            alert_ids (list of str): the dead alerts to replay, None for all
+
+        Returns:
+            replayed (list of str): the IDs of the replayed alerts
+        """
+        with self._lock:
+            dead = []
+            if os.path.exists(self.dead_letter_path):
+                with open(self.dead_letter_path) as f:
+                    dead = [json.loads(line) for line in f if line.strip()]
+            replayed, kept = [], []
+            for entry in dead:
+                if alert_ids is None or entry['alert_id'] in alert_ids:
+                    replayed.append(entry)
+                else:
+                    kept.append(entry)
+            for entry in replayed:  # Back in the outbox before they leave
+                # the dead-letter file, so a crash can't lose them
+                self._write({'op': 'add', 'alert_id': entry['alert_id'],
+                             'payload': entry['payload']})
+                self.pending[entry['alert_id']] = {
+                    'payload': entry['payload'], 'attempts': 0,
+                    'next_try': 0.0, 'in_queue': False}
+            tmp_path = self.dead_letter_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                for entry in kept:
+                    f.write(json.dumps(entry) + '\n')
+            os.replace(tmp_path, self.dead_letter_path)
+        return [entry['alert_id'] for entry in replayed]
@@ -0,0 +1,188 @@
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from hrss_tachycardia import is_tachycardic, tachycardic_mask
+
+
+def random_readings(n, seed=0):
+    """Make n random (age, heart rate) readings
+
+    Args:
+        n (int): number of readings
+        seed (int): seed of the random generator so runs are comparable
+
+    Returns:
+        ages (np.ndarray of int64): patient ages between 0 and 99
+        heart_rates (np.ndarray of int16): heart rates between 40 and 199
+    """
+    rng = np.random.default_rng(seed)
+    ages = rng.integers(0, 100, size=n)
+    heart_rates = rng.integers(40, 200, size=n).astype(np.int16)
+    return ages, heart_rates
+
+
+def benchmark_tachycardia(n=1000000, seed=0):
+    """Time the per-reading judgement against the vectorized one
+
+    Args:
+        n (int): number of readings to classify
+        seed (int): seed of the random readings
+
+    Returns:
+        result (dict): {"readings": <int>, "loop_seconds": <float>,
+        "vectorized_seconds": <float>, "speedup": <float>}
+    """
+    ages, heart_rates = random_readings(n, seed)
+    age_list, heart_rate_list = ages.tolist(), heart_rates.tolist()
+
+    start = time.perf_counter()
+    loop_flags = [is_tachycardic(a, h)
+                  for a, h in zip(age_list, heart_rate_list)]
+    loop_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    flags = tachycardic_mask(ages, heart_rates)
+    vectorized_seconds = time.perf_counter() - start
+
+    assert flags.tolist() == loop_flags  # Both forms must agree
+
+    return {"readings": n, "loop_seconds": loop_seconds,
+            "vectorized_seconds": vectorized_seconds,
+            "speedup": loop_seconds / max(vectorized_seconds, 1e-9)}
+
+
+def benchmark_snapshot(patients=1000000, readings=10, seed=0):
+    """Time the start-up of a server from a snapshot
+
+    A store of random patients, each with readings heart rates 1 second
+    apart, is written to a snapshot in a temporary directory and loaded
+    back the way recover_database() does it
+
+    Args:
+        patients (int): number of patients
+        readings (int): heart rates per patient
+        seed (int): seed of the random patients
+
+    Returns:
+        result (dict): {"patients": <int>, "readings": <int>,
+        "write_seconds": <float>, "load_seconds": <float>, "bytes": <int>}
+    """
+    from hrss_snapshot import pack_snapshot, read_snapshot, write_snapshot
+    from hrss_store import NS_PER_SECOND, PatientStore, PhysicianStore
+
+    ages, heart_rates = random_readings(patients * readings, seed)
+    starts = np.arange(patients, dtype=np.int64) * NS_PER_SECOND
+    timestamps = (starts[:, None] + np.arange(readings) * NS_PER_SECOND) \
+        .reshape(-1)
+    patient_db = PatientStore.from_arrays({
+        'patient_id': np.arange(patients, dtype=np.int64),
+        'patient_age': ages[:patients],
+        'attending_username': np.array(['Dr.{}'.format(i % 1000)
+                                        for i in range(patients)]),
+        'has_history': np.ones(patients, dtype=bool),
+        'offsets': np.arange(patients + 1, dtype=np.int64) * readings,
+        'timestamps': timestamps, 'heart_rates': heart_rates})
+    admin_db = pd.DataFrame(columns=['admin_username', 'admin_password'])
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'snapshot.npz')
+        start = time.perf_counter()
+        write_snapshot(path, pack_snapshot(patient_db, PhysicianStore(),
+                                           admin_db))
+        write_seconds = time.perf_counter() - start
+        size = os.path.getsize(path)
+        del patient_db  # Only 1 store in memory at a time
+        start = time.perf_counter()
+        loaded = read_snapshot(path)[0]
+        load_seconds = time.perf_counter() - start
+
+    assert len(loaded) == patients
+    return {"patients": patients, "readings": patients * readings,
+            "write_seconds": write_seconds, "load_seconds": load_seconds,
+            "bytes": size}
+
+
+def benchmark_import(patients=2000, readings=5, events=1000000):
+    """Time importing the heart rates of new patients into a busy server
+
+    The tachycardia log already holds events, as on a server that has been
+    running for a while, so the time shows whether the import touches the
+    whole log once per patient
+
+    Args:
+        patients (int): number of new patients
+        readings (int): heart rates per patient
+        events (int): tachycardia events already in the log
+
+    Returns:
+        result (dict): {"patients": <int>, "readings": <int>,
+        "seconds": <float>}
+    """
+    import hrss_server
+    from hrss_store import PatientStore
+
+    store = PatientStore()
+    store.tachycardia_log.extend(0, np.arange(events),
+                                 np.full(events, 150))
+    patient_ids = np.arange(1, patients + 1)
+    for patient_id in patient_ids.tolist():
+        store.add({"patient_id": patient_id,
+                   "attending_username": 'Banks.J', "patient_age": 20})
+    heart_rates = np.resize([90, 150, 160, 80, 170], readings)
+    frame = pd.DataFrame({
+        "patient_id": np.repeat(patient_ids, readings),
+        "heart_rate": np.tile(heart_rates, patients),
+        "timestamp": np.tile(np.arange(events, events + readings),
+                             patients),
+        "msg": ''})
+    patient_db_before = hrss_server.patient_db
+    hrss_server.patient_db = store
+    try:
+        start = time.perf_counter()
+        hrss_server.import_heart_rates(frame)
+        seconds = time.perf_counter() - start
+    finally:
+        hrss_server.patient_db = patient_db_before
+    return {"patients": patients, "readings": patients * readings,
+            "seconds": seconds}
+
+
+def main():
+    """Run the benchmarks from the command line and print the results
+
+    Returns:
+        0 (int): as an indicator to show that the function successfully run
+    """
+    parser = argparse.ArgumentParser(description='HRSS benchmarks')
+    parser.add_argument('-n', type=int, default=1000000,
+                        help='number of readings')
+    parser.add_argument('--patients', type=int, default=0,
+                        help='also time a snapshot of this many patients')
+    parser.add_argument('--imports', type=int, default=0,
+                        help='also time an import of this many new patients')
+    args = parser.parse_args()
+
+    result = benchmark_tachycardia(args.n)
+    print('Tachycardia judgement of {} readings: loop {:.3f} s, '
+          'vectorized {:.4f} s, {:.0f}x faster'.format(
+              result['readings'], result['loop_seconds'],
+              result['vectorized_seconds'], result['speedup']))
+    if args.patients:
+        result = benchmark_snapshot(args.patients)
+        print('Snapshot of {} patients with {} readings: {:.0f} MB, '
+              'written in {:.2f} s, loaded in {:.2f} s'.format(
+                  result['patients'], result['readings'],
+                  result['bytes'] / 1e6, result['write_seconds'],
+                  result['load_seconds']))
+    if args.imports:
+        result = benchmark_import(args.imports)
+        print('Import of {} patients with {} readings: {:.2f} s'.format(
+            result['patients'], result['readings'], result['seconds']))
+    return 0
+
+
+if __name__ == '__main__':
+    main()
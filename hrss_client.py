@@ -1,5 +1,4 @@
 import requests
-import time
 
 # url = 'http://127.0.0.1:5000'  # This is the local url. Change this to the
 # # actual one once the code is deployed in VM server
@@ -42,21 +41,17 @@ r = requests.post(url + "/api/heart_rate",
 print(r.status_code)
 print(r.text)
 
-time.sleep(1)  # Sleep for 1 sec. Sleeping between consecutive post requests
-# is necessary to avoid the server code from using the same datetime stamp to
-# overwrite the previous heart rate record
-
 out_data = {
     "patient_id": 1,
-    "heart_rate": 95  # in bpm
+    "heart_rate": 95,  # in bpm
+    "timestamp": "2018-03-09 11:00:36.250"  # Optional, when the device
+    # measured it
 }
 r = requests.post(url + "/api/heart_rate",
                   json=out_data)
 print(r.status_code)
 print(r.text)
 
-time.sleep(1)
-
 out_data = {
     "patient_id": 1,
     "heart_rate": 140  # in bpm
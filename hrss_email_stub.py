@@ -0,0 +1,49 @@
+import threading
+from flask import Flask, request
+from werkzeug.serving import make_server
+
+app = Flask(__name__)
+sent_emails = []  # Every email the stand-in server received, in order
+
+
+@app.route('/hrss/send_email', methods=['POST'])
+def send_email_handler():
+    """Stand in for the email server at vcm-7631 during local tests
+
+    It accepts the same json as the real server, in the format of {
+    "from_email": <str>, "to_email": <str>, "subject": <str>,
+    "content": <str>}, keeps it in sent_emails and answers with the same
+    text the real server does
+
+    Returns:
+        msg (str): "E-mail sent to <to_email> from <from_email>"
+        status (int): 200 if every field was given, 400 if not
+    """
+    in_data = request.get_json(silent=True)
+    fields = ['from_email', 'to_email', 'subject', 'content']
+    if type(in_data) is not dict or any(f not in in_data for f in fields):
+        return 'Missing field', 400
+    sent_emails.append(in_data)
+    return 'E-mail sent to {} from {}'.format(in_data['to_email'],
+                                              in_data['from_email']), 200
+
+
+def start_stub_server(host='127.0.0.1', port=0):
+    """Serve the stand-in email server from a background thread
+
+    Args:
+        host (str): the interface to listen on
+        port (int): the port to listen on, 0 picks a free one
+
+    Returns:
+        server (BaseWSGIServer): call server.shutdown() to stop it
+        url (str): the url of the send_email route
+    """
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://{}:{}/hrss/send_email'.format(host, server.server_port)
+    return server, url
+
+
+if __name__ == '__main__':
+    app.run(host='127.0.0.1', port=5007)
@@ -0,0 +1,285 @@
+import collections
+import csv
+import json
+import logging
+import threading
+import time
+import numpy as np
+
+
+def iter_lines(stream, max_line=65536):
+    """Read the non-empty lines of a stream as they arrive
+
+    The stream is read 1 line at a time, so every line is handed on as soon
+    as it came in and a feed that never ends is read in constant memory
+
+    Args:
+        stream (file-like): a binary stream with a readline(size) method,
+        e.g. request.stream
+        max_line (int): longest line accepted in bytes, a longer line is
+        skipped as an error
+
+    Returns:
+        (generator of tuple): (line, error) of every non-empty line, where
+        line is the bytes and error is None, or line is None and error says
+        why the line was rejected
+    """
+    too_long = False  # True while skipping the rest of a too long line
+    while True:
+        line = stream.readline(max_line + 1)
+        if len(line) == 0:  # The end of the stream
+            return
+        if too_long:
+            too_long = not line.endswith(b'\n')
+            continue
+        if len(line.strip()) == 0:
+            continue
+        if len(line) > max_line and not line.endswith(b'\n'):
+            too_long = True
+            yield None, 'The line is longer than {} bytes.'.format(max_line)
+            continue
+        yield line, None
+
+
+def iter_ndjson(stream, max_line=65536):
+    """Parse newline-delimited JSON from a stream as it arrives
+
+    Every line is parsed as soon as iter_lines() read it. Empty lines are
+    skipped and every other line gets the next sequence number, starting
+    from 1
+
+    Args:
+        stream (file-like): a binary stream with a readline(size) method,
+        e.g. request.stream
+        max_line (int): longest line accepted in bytes, a longer line is
+        skipped as an error
+
+    Returns:
+        (generator of tuple): (seq, record, error) of every line, where
+        record is the parsed JSON and error is None, or record is None and
+        error says why the line was rejected
+    """
+    for seq, (line, error) in enumerate(iter_lines(stream, max_line), 1):
+        if error is not None:
+            yield seq, None, error
+            continue
+        try:
+            yield seq, json.loads(line), None
+        except ValueError:
+            yield seq, None, 'The line is not valid JSON.'
+
+
+def iter_csv(stream, max_line=65536):
+    """Parse CSV rows from a stream as they arrive
+
+    The first non-empty line is the header with the field names, and every
+    other line is 1 row that gets the next sequence number, starting from
+    1. A row becomes a dict of the field names to the str values, without
+    the empty values, so it looks like a line of iter_ndjson()
+
+    Args:
+        stream (file-like): a binary stream with a readline(size) method,
+        e.g. request.stream
+        max_line (int): longest line accepted in bytes, a longer line is
+        skipped as an error
+
+    Returns:
+        (generator of tuple): (seq, record, error) of every row, where
+        record is the dict and error is None, or record is None and error
+        says why the row was rejected
+    """
+    header = None
+    seq = 0
+    for line, error in iter_lines(stream, max_line):
+        if header is None and error is None:
+            header = [name.strip() for name in
+                      next(csv.reader([line.decode(errors='replace')]))]
+            continue
+        seq += 1
+        if error is not None:
+            yield seq, None, error
+            continue
+        values = next(csv.reader([line.decode(errors='replace')]))
+        if len(values) != len(header):
+            yield seq, None, 'The row has {} fields, the header has {}.' \
+                .format(len(values), len(header))
+            continue
+        yield seq, {name: value for name, value in
+                    zip(header, [v.strip() for v in values]) if value}, None
+
+
+class IngestTicket:
+    """The answer to 1 reading handed to an IngestRing
+
+    The request thread waits on it while the writer thread commits the
+    batch the reading is in
+    """
+
+    def __init__(self):
+        self.result = None
+        self._done = threading.Event()
+
+    def set(self, result):
+        """Answer the reading and wake up the request thread"""
+        self.result = result
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """Wait for the reading to be committed
+
+        Args:
+            timeout (float or None): seconds to wait, None waits forever
+
+        Returns:
+            result (any): what apply_batch returned for the reading, or None
+            if the timeout passed first
+        """
+        self._done.wait(timeout)
+        return self.result
+
+
+class IngestRing:
+    """Bounded ring buffer of readings committed by 1 writer thread
+
+    Request threads only put their validated readings into the ring. A
+    single writer thread drains it in micro-batches and hands every batch to
+    apply_batch(items), which returns 1 result per item in the same order.
+    A batch is committed as soon as it has max_batch items, or once the
+    oldest item in it waited max_delay seconds, so a bigger max_batch buys
+    throughput and a smaller max_delay keeps the acknowledgements quick.
+
+    The ring has a fixed number of slots, so a writer that falls behind
+    makes submit() refuse readings instead of growing without limit
+    """
+
+    def __init__(self, apply_batch, capacity=4096, max_batch=256,
+                 max_delay=0.002, clock=time.monotonic, max_samples=1024):
+        self.apply_batch = apply_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.clock = clock
+        self._slots = [None] * capacity
+        self._head = 0  # Slot of the oldest item
+        self._size = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self.counters = {'readings': 0, 'batches': 0, 'rejected': 0,
+                         'max_batch_size': 0}
+        self._latencies = collections.deque(maxlen=max_samples)  # Seconds
+        # from submit() to commit of the latest readings
+
+    def __len__(self):
+        return self._size
+
+    def start(self):
+        """Start the writer thread if it isn't running yet"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name='hrss-ingest-writer')
+            self._thread.start()
+
+    def stop(self):
+        """Let the writer commit what is in the ring and then stop it"""
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._stopped = True
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join()
+
+    def submit(self, item):
+        """Put 1 reading into the ring without waiting
+
+        Args:
+            item (any): what apply_batch needs to commit the reading
+
+        Returns:
+            ticket (IngestTicket or None): wait on it for the result, or
+            None if the ring was full and the reading was refused
+        """
+        self.start()
+        ticket = IngestTicket()
+        with self._cond:
+            if self._size == len(self._slots):
+                self.counters['rejected'] += 1
+                return None
+            tail = (self._head + self._size) % len(self._slots)
+            self._slots[tail] = (item, ticket, self.clock())
+            self._size += 1
+            if self._size == 1 or self._size >= self.max_batch:
+                self._cond.notify()
+        return ticket
+
+    def metrics(self):
+        """The counters of the ring and the latency of its readings
+
+        Returns:
+            metrics (dict): {"depth": <int>, "readings": <int>,
+            "batches": <int>, "rejected": <int>, "max_batch_size": <int>,
+            "mean_batch_size": <float>, "latency_p50": <float>,
+            "latency_p99": <float>} where the latencies are the seconds from
+            submit() to commit of the latest readings
+        """
+        with self._cond:
+            metrics = dict(self.counters, depth=self._size)
+            latencies = np.array(self._latencies)
+        metrics['mean_batch_size'] = \
+            metrics['readings'] / max(metrics['batches'], 1)
+        if len(latencies) == 0:
+            metrics['latency_p50'] = metrics['latency_p99'] = 0.0
+        else:
+            p50, p99 = np.percentile(latencies, [50, 99])
+            metrics['latency_p50'] = float(p50)
+            metrics['latency_p99'] = float(p99)
+        return metrics
+
+    def _take(self):
+        # Wait for a full batch or for the oldest item to be max_delay old
+        with self._cond:
+            while True:
+                if self._size >= self.max_batch:
+                    break
+                if self._size != 0:
+                    wait = self._slots[self._head][2] + self.max_delay - \
+                        self.clock()
+                    if wait <= 0 or self._stopped:
+                        break
+                elif self._stopped:
+                    return []
+                else:
+                    wait = None
+                self._cond.wait(wait)
+            n = min(self._size, self.max_batch)
+            batch = []
+            for _ in range(n):
+                batch.append(self._slots[self._head])
+                self._slots[self._head] = None
+                self._head = (self._head + 1) % len(self._slots)
+            self._size -= n
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if len(batch) == 0:
+                return
+            try:
+                results = self.apply_batch([item for item, _, _ in batch])
+            except Exception as e:  # The writer must never die
+                logging.error('Ingest batch of {} failed: {}'
+                              .format(len(batch), e))
+                results = [('The reading could not be committed.', 500)] * \
+                    len(batch)
+            now = self.clock()
+            with self._cond:
+                self.counters['readings'] += len(batch)
+                self.counters['batches'] += 1
+                self.counters['max_batch_size'] = max(
+                    self.counters['max_batch_size'], len(batch))
+                self._latencies.extend(now - queued for _, _, queued in batch)
+            for (_, ticket, _), result in zip(batch, results):
+                ticket.set(result)
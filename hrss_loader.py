@@ -0,0 +1,307 @@
+import argparse
+import itertools
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from hrss_store import PatientStore, PhysicianStore, MAX_HEART_RATE, \
+    TIME_PATTERN, TIMESTAMP_DTYPE, HEART_RATE_DTYPE
+
+INT_PATTERN = '[0-9]{1,18}'  # An int or a str of an int, the same as the
+# routes accept
+USERNAME_PATTERN = '[A-Z][a-z]*.[A-Z]'  # LastName.FirstInitial
+ENTRY = r"""\s*'[^']*'\s*:\s*(?:'[^']*'|"[^"]*"|[^,{}'"]*)\s*"""
+HISTORY_PATTERN = r'\{(?:' + ENTRY + '(?:,' + ENTRY + r')*,?)?\s*\}'  # A
+# dict literal of str keys and int or str values
+PAIR_PATTERN = r"""'([^']*)'\s*:\s*('[^']*'|"[^"]*"|[^,{}'"]*)"""
+QUARANTINE_COLUMNS = ['row', 'reason'] + PatientStore.columns
+
+
+def parse_patient_chunk(chunk):
+    """Validate and parse 1 chunk of a patient CSV file
+
+    Every check is vectorized over the whole chunk: the patient_id,
+    attending_username and patient_age follow the rules of
+    '/api/new_patient', and the heart_rate_history must be a dict literal
+    of 'yyyy-mm-dd hh:mm:ss' str keys and heart rates that are ints or strs
+    of ints. The pairs of all the histories are pulled out with 1 regex
+    pass instead of 1 literal_eval per row. This function runs in the
+    worker processes of load_patients(), so it only gets and returns
+    plain data
+
+    Args:
+        chunk (df): rows of the CSV file as strs, with the columns
+        patient_id, attending_username, patient_age and heart_rate_history
+
+    Returns:
+        parsed (dict): "reasons" (list of str, why each row is malformed or
+        '' for a good row), "patient_id" and "patient_age" (np.ndarray of
+        int64, 0 for a malformed value), "has_history" (np.ndarray of
+        bool), "counts" (np.ndarray of int64, the readings of every good
+        row), "timestamps" (np.ndarray of int64) and "heart_rates"
+        (np.ndarray of int16) with the readings of the good rows, in time
+        order within every row
+    """
+    n = len(chunk)
+    reasons = pd.Series('', index=chunk.index)
+
+    def reject(mask, reason):
+        nonlocal reasons
+        mask = pd.Series(mask, index=chunk.index)
+        reasons = reasons.where(~mask, reasons + reason + '; ')
+
+    values = {}
+    for column in ['patient_id', 'patient_age']:
+        text = chunk[column].str.strip()
+        good = text.str.fullmatch(INT_PATTERN)
+        reject(~good, '{} must be an int'.format(column))
+        values[column] = pd.to_numeric(text.where(good, '0')).to_numpy(
+            np.int64)
+    reject(chunk['patient_age'].str.fullmatch(INT_PATTERN) &
+           (values['patient_age'] < 1), 'patient_age must be at least 1')
+    reject(~chunk['attending_username'].str.strip().str.fullmatch(
+        USERNAME_PATTERN), 'attending_username must be LastName.FirstInitial')
+
+    history = chunk['heart_rate_history'].str.strip()
+    has_history = (history != '').to_numpy()  # An empty cell is no history
+    well_formed = history.str.fullmatch(HISTORY_PATTERN)
+    reject(has_history & ~well_formed,
+           'heart_rate_history must be a dict of time strs to heart rates')
+
+    pairs = history[well_formed].str.extractall(PAIR_PATTERN)
+    rows = chunk.index.get_indexer(pairs.index.get_level_values(0))
+    keys = pairs[0].str.strip()
+    parsed = pd.to_datetime(keys.where(keys.str.match(TIME_PATTERN)),
+                            format='ISO8601', errors='coerce')
+    bad_time = parsed.isna().to_numpy()
+    heart_rate_text = pairs[1].str.strip().str.strip('\'"').str.strip()
+    good_heart_rate = heart_rate_text.str.fullmatch(INT_PATTERN).to_numpy()
+    heart_rates = pd.to_numeric(heart_rate_text.where(good_heart_rate, '0')) \
+        .to_numpy(np.int64)
+    out_of_range = good_heart_rate & (heart_rates > MAX_HEART_RATE)
+    for bad, reason in [(bad_time, 'a time str that is not '
+                                   'yyyy-mm-dd hh:mm:ss'),
+                        (~good_heart_rate, 'a heart rate that is not an int'),
+                        (out_of_range, 'a heart rate out of range')]:
+        mask = np.zeros(n, dtype=bool)
+        mask[rows[bad]] = True
+        reject(mask, 'heart_rate_history has ' + reason)
+
+    good_rows = (reasons == '').to_numpy()
+    keep = good_rows[rows]
+    rows = rows[keep]
+    timestamps = parsed.to_numpy(dtype='datetime64[ns]', na_value=0) \
+        .astype(TIMESTAMP_DTYPE)[keep]
+    heart_rates = heart_rates[keep].astype(HEART_RATE_DTYPE)
+    order = np.lexsort((timestamps, rows))  # Stable, so a repeated time
+    # str keeps the order of the file
+    rows, timestamps, heart_rates = \
+        rows[order], timestamps[order], heart_rates[order]
+    last = np.append((rows[1:] != rows[:-1]) |
+                     (timestamps[1:] != timestamps[:-1]), True)[:len(rows)]
+    # The last of a repeated time str wins, as in a dict literal
+    rows, timestamps, heart_rates = rows[last], timestamps[last], \
+        heart_rates[last]
+    return {'reasons': reasons.str.rstrip('; ').tolist(),
+            'patient_id': values['patient_id'],
+            'patient_age': values['patient_age'],
+            'has_history': has_history,
+            'counts': np.bincount(rows, minlength=n).astype(np.int64),
+            'timestamps': timestamps, 'heart_rates': heart_rates}
+
+
+def load_patients(path, physicians=None, quarantine_path=None, workers=None,
+                  chunksize=10000, segments=None):
+    """Load a patient CSV file into a new PatientStore in parallel
+
+    The file is read in chunks of chunksize rows and every chunk is
+    validated and parsed by parse_patient_chunk() in a pool of worker
+    processes, at most 2 chunks per worker at a time so a large file never
+    sits in memory whole; a file of 1 chunk is parsed in this process.
+    Back in this process, a row is also malformed if its attending_username
+    is not one of physicians or its patient_id was already loaded. The
+    malformed rows go into the quarantine file with their row number and
+    the reasons, and the good rows are built into the store with
+    PatientStore.from_arrays(), so the store and its indexes are made in 1
+    vectorized pass
+
+    Args:
+        path (str): the CSV file with the columns patient_id,
+        attending_username, patient_age and heart_rate_history
+        physicians (PhysicianStore): the registered physicians, or None to
+        accept any attending_username
+        quarantine_path (str): the CSV file for the malformed rows, made
+        when the first one is found, or None to drop them
+        workers (int): the number of worker processes, None for 1 per CPU,
+        1 to parse in this process
+        chunksize (int): rows per chunk
+        segments (SegmentDirectory): where the long histories go, or None
+        to keep every history in memory
+
+    Returns:
+        store (PatientStore): the patients of the good rows
+        report (dict): {"rows": <int>, "loaded": <int>, "quarantined":
+        <int>, "readings": <int>, "seconds": <float>}
+    """
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    parts = {key: [] for key in ['patient_id', 'patient_age',
+                                 'attending_username', 'has_history',
+                                 'counts', 'timestamps', 'heart_rates']}
+    seen = set()  # The patient_ids loaded so far
+    report = {'rows': 0, 'loaded': 0, 'quarantined': 0, 'readings': 0}
+    quarantine = None
+
+    def collect(chunk, parsed):
+        nonlocal quarantine
+        reasons = np.array(parsed['reasons'], dtype=object)
+        usernames = chunk['attending_username'].str.strip()
+        if physicians is not None:
+            known = np.array([u in physicians for u in usernames.tolist()],
+                             dtype=bool)
+            unknown = (reasons == '') & ~known
+            reasons[unknown] = 'attending_username does not exist'
+        good = reasons == ''
+        ids = parsed['patient_id']
+        repeated = np.zeros(len(ids), dtype=bool)
+        repeated[good] = pd.Series(ids[good]).duplicated().to_numpy() | \
+            np.array([i in seen for i in ids[good].tolist()], dtype=bool)
+        reasons[repeated] = 'patient_id is already in use'
+        good &= ~repeated
+        seen.update(ids[good].tolist())
+
+        counts = parsed['counts']
+        readings = np.repeat(good, counts)  # Drop the readings of the rows
+        # rejected here
+        for key, value in [('patient_id', ids[good]),
+                           ('patient_age', parsed['patient_age'][good]),
+                           ('attending_username',
+                            usernames.to_numpy(dtype=str)[good]),
+                           ('has_history', parsed['has_history'][good]),
+                           ('counts', counts[good]),
+                           ('timestamps', parsed['timestamps'][readings]),
+                           ('heart_rates', parsed['heart_rates'][readings])]:
+            parts[key].append(value)
+        report['rows'] += len(chunk)
+        report['loaded'] += int(good.sum())
+        report['quarantined'] += int((~good).sum())
+        if quarantine_path is not None and not good.all():
+            if quarantine is None:
+                quarantine = open(quarantine_path, 'w', newline='')
+            bad = chunk[~good].assign(row=chunk.index[~good] + 1,
+                                      reason=reasons[~good])
+            bad[QUARANTINE_COLUMNS].to_csv(quarantine, index=False,
+                                           header=quarantine.tell() == 0)
+
+    reader = pd.read_csv(path, dtype=str, keep_default_na=False,
+                         chunksize=chunksize)
+    try:
+        first = list(itertools.islice(reader, 2))
+        chunks = itertools.chain(first, reader)
+        if workers == 1 or len(first) < 2:
+            for chunk in chunks:
+                collect(chunk, parse_patient_chunk(chunk))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append((chunk,
+                                    pool.submit(parse_patient_chunk, chunk)))
+                    if len(pending) >= 2 * workers:
+                        chunk, future = pending.popleft()
+                        collect(chunk, future.result())
+                while pending:
+                    chunk, future = pending.popleft()
+                    collect(chunk, future.result())
+    finally:
+        reader.close()
+        if quarantine is not None:
+            quarantine.close()
+
+    arrays = {key: np.concatenate(value) if value else np.array([])
+              for key, value in parts.items()}
+    counts = arrays.pop('counts').astype(np.int64)
+    arrays['offsets'] = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=arrays['offsets'][1:])
+    store = PatientStore.from_arrays(arrays, segments=segments)
+    report['readings'] = int(arrays['offsets'][-1])
+    report['seconds'] = time.perf_counter() - start
+    return store, report
+
+
+def main(argv=None):
+    """Import a patient CSV file offline into a snapshot of the server
+
+    The patients are loaded with load_patients() and written, with the
+    physicians and administrators of their own CSV files, into a snapshot
+    that hrss_server.py loads at its next start. A server that already has
+    data, a snapshot or a write-ahead log that isn't empty, is left alone
+    unless --replace is given. Then the server must be stopped: its log is
+    deleted before the snapshot is written over the old one, and the
+    physicians and administrators of the old snapshot are kept unless
+    their CSV file is given
+
+    Args:
+        argv (list of str): the arguments, None for those of the command
+        line
+
+    Returns:
+        0 (int): as an indicator to show that the function successfully run
+    """
+    from hrss_snapshot import pack_snapshot, read_accounts, write_snapshot
+
+    parser = argparse.ArgumentParser(
+        description='Import patients into a HRSS snapshot')
+    parser.add_argument('patients', help='patient CSV file')
+    parser.add_argument('--physicians', help='physician CSV file, the '
+                        'attending_username of every patient must be in it')
+    parser.add_argument('--admins', help='administrator CSV file')
+    parser.add_argument('--quarantine', default='quarantine.csv',
+                        help='CSV file for the malformed rows')
+    parser.add_argument('--snapshot', default=os.environ.get(
+        'HRSS_SNAPSHOT', 'hrss_snapshot.npz'), help='snapshot to write')
+    parser.add_argument('--wal', default=os.environ.get(
+        'HRSS_WAL', 'hrss_wal.log'), help='write-ahead log of the server')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes, 1 per CPU by default')
+    parser.add_argument('--chunksize', type=int, default=10000,
+                        help='rows per chunk')
+    parser.add_argument('--replace', action='store_true',
+                        help='replace the patients of the snapshot and drop '
+                        'the write-ahead log, with the server stopped')
+    args = parser.parse_args(argv)
+
+    has_snapshot = os.path.exists(args.snapshot)
+    has_wal = os.path.exists(args.wal) and os.path.getsize(args.wal) > 0
+    if (has_snapshot or has_wal) and not args.replace:
+        parser.error('{} already holds data, use --replace to replace it'
+                     .format(args.snapshot if has_snapshot else args.wal))
+    physician_db, admin_db = read_accounts(args.snapshot) if has_snapshot \
+        else (PhysicianStore(), pd.DataFrame(
+            columns=['admin_username', 'admin_password']))
+    if args.physicians:
+        physician_db = PhysicianStore.from_frame(pd.read_csv(args.physicians))
+    if args.admins:
+        admin_db = pd.read_csv(args.admins)
+    patient_db, report = load_patients(
+        args.patients, physicians=physician_db if args.physicians else None,
+        quarantine_path=args.quarantine, workers=args.workers,
+        chunksize=args.chunksize)
+    if has_wal:  # Deleted first, so a crash never replays the old log on
+        # top of the new snapshot
+        os.remove(args.wal)
+    write_snapshot(args.snapshot,
+                   pack_snapshot(patient_db, physician_db, admin_db),
+                   patient_db=patient_db)
+    print('Loaded {} of {} rows ({} readings) in {:.2f} s, quarantined {} '
+          'into {}, wrote {}'.format(report['loaded'], report['rows'],
+                                     report['readings'], report['seconds'],
+                                     report['quarantined'], args.quarantine,
+                                     args.snapshot))
+    return 0
+
+
+if __name__ == '__main__':
+    main()
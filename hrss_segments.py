@@ -0,0 +1,218 @@
+import os
+import shutil
+import numpy as np
+from hrss_store import HeartRateSeries, TIMESTAMP_DTYPE, HEART_RATE_DTYPE
+
+SEGMENT_FILES = [('.ts', TIMESTAMP_DTYPE, 0), ('.bpm', HEART_RATE_DTYPE, 0),
+                 ('.sum', np.int64, 1)]  # The suffix, the dtype and the
+# extra length of the 3 files of a segment
+CHUNK_READINGS = 1 << 20  # Readings summed up at a time when a segment is
+# opened, so opening one never copies the whole history into memory
+
+
+class MappedHeartRateSeries(HeartRateSeries):
+    """HeartRateSeries whose arrays live in a memory-mapped segment
+
+    A segment is 3 append-only files of fixed-width little-endian values:
+    path + ".ts" holds the int64 timestamps, path + ".bpm" the int16
+    heart rates and path + ".sum" the int64 prefix sums, 1 more than the
+    readings. The arrays of the series are NumPy memmaps of the files, so
+    every method of HeartRateSeries works on the files as they are:
+    timestamps() and since() return views over the files and window_mean()
+    is 2 binary searches and 2 prefix sums, all without copying the
+    history. The kernel pages the files in and out as they are read, so
+    the memory of the process stays bounded however long the history grows.
+    The timestamps are kept in a file of their own rather than next to
+    their heart rates, because a binary search needs them contiguous.
+
+    Growing the series makes the files longer and maps them again, so the
+    readings already written stay where they are. The segment is a cache of
+    the history, rebuilt from the snapshot and the write-ahead log at
+    start-up, so it is never synced
+    """
+
+    def __init__(self, path, capacity=1024):
+        self.path = path
+        for suffix, _, _ in SEGMENT_FILES:  # A new series starts from empty
+            # files
+            open(path + suffix, 'wb').close()
+        super().__init__(capacity)
+
+    def _allocate(self, capacity):
+        # Make the files hold capacity readings and map them. The new part
+        # of a file reads as zeros, and the old part keeps its readings
+        arrays = []
+        for suffix, dtype, extra in SEGMENT_FILES:
+            length = capacity + extra
+            with open(self.path + suffix, 'r+b') as f:
+                f.truncate(length * np.dtype(dtype).itemsize)
+            arrays.append(np.memmap(self.path + suffix, dtype=dtype,
+                                    mode='r+', shape=(length,)))
+        return tuple(arrays)
+
+    @classmethod
+    def open(cls, path):
+        """Map the files that save() wrote, without copying them
+
+        The running aggregates are summed up a chunk at a time over the
+        mapped files
+
+        Args:
+            path (str): the segment, without the suffixes
+
+        Returns:
+            series (MappedHeartRateSeries): the readings of the files, with
+            room for as many again
+        """
+        size = os.path.getsize(path + '.ts') // np.dtype(
+            TIMESTAMP_DTYPE).itemsize
+        series = cls.__new__(cls)
+        series.path = path
+        series._timestamps, series._heart_rates, series._prefix = \
+            series._allocate(max(2 * size, 16))
+        series._size = size
+        series._sum = int(series._prefix[size])
+        series._sum_sq = 0
+        series._min = series._max = None
+        for start in range(0, size, CHUNK_READINGS):
+            chunk = series._heart_rates[
+                start:min(start + CHUNK_READINGS, size)].astype(np.int64)
+            series._sum_sq += int((chunk * chunk).sum())
+            low, high = int(chunk.min()), int(chunk.max())
+            series._min = low if series._min is None else min(series._min,
+                                                              low)
+            series._max = high if series._max is None else max(series._max,
+                                                               high)
+        return series
+
+    def save(self, path):
+        """Write the readings of the segment into new files, synced
+
+        Only the readings are written, not the unused capacity. The files
+        are written straight from the mappings, so the history is never
+        copied into memory
+
+        Args:
+            path (str): the new files, without the suffixes
+        """
+        for (suffix, _, extra), array in zip(
+                SEGMENT_FILES,
+                [self._timestamps, self._heart_rates, self._prefix]):
+            with open(path + suffix, 'wb') as f:
+                array[:self._size + extra].tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def rename(self, path):
+        """Move the files of the segment, which stay mapped
+
+        Args:
+            path (str): the new path of the segment, without the suffixes
+        """
+        for suffix, _, _ in SEGMENT_FILES:
+            os.replace(self.path + suffix, path + suffix)
+        self.path = path
+
+    def _grow(self):
+        self._timestamps, self._heart_rates, self._prefix = self._allocate(
+            max(2 * len(self._timestamps), 16))
+
+    @property
+    def nbytes(self):
+        """Size of the segment files, including the unused capacity"""
+        return (self._timestamps.nbytes + self._heart_rates.nbytes
+                + self._prefix.nbytes)
+
+
+class SegmentDirectory:
+    """Directory of the segments of the long heart rate histories
+
+    A history stays in memory as a HeartRateSeries while it is short, which
+    is the case for most patients. Once it has more than max_readings
+    readings, spill() moves it into its own segment, the files
+    "<patient_id>.ts", ".bpm" and ".sum", as a MappedHeartRateSeries, so
+    only the long-stay patients get files and mappings
+
+    Args:
+        path (str): the directory, made when the first history is moved
+        max_readings (int): the longest history kept in memory
+    """
+
+    def __init__(self, path, max_readings=100000):
+        self.path = path
+        self.max_readings = max_readings
+
+    def create(self, patient_id, timestamps, heart_rates):
+        """Write the readings of a patient into a new segment
+
+        The files are filled under a temporary name and then renamed over
+        the segment of the patient, so a series still mapping the old files
+        keeps reading them
+
+        Args:
+            patient_id (int): the ID that identifies a patient
+            timestamps (array-like of int): nanoseconds since EPOCH
+            heart_rates (array-like of int): heart rates in bpm
+
+        Returns:
+            series (MappedHeartRateSeries): the readings in time order, with
+            room for as many again
+        """
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, str(patient_id))
+        series = MappedHeartRateSeries(path + '.tmp',
+                                       capacity=max(2 * len(timestamps), 16))
+        series._load(np.asarray(timestamps, dtype=TIMESTAMP_DTYPE),
+                     np.asarray(heart_rates, dtype=HEART_RATE_DTYPE))
+        series.rename(path)
+        return series
+
+    def adopt(self, patient_id, path):
+        """Copy the files that save() wrote into the segment of a patient
+
+        Args:
+            patient_id (int): the ID that identifies a patient
+            path (str): the saved files, without the suffixes
+
+        Returns:
+            series (MappedHeartRateSeries): the readings of the files
+        """
+        os.makedirs(self.path, exist_ok=True)
+        target = os.path.join(self.path, str(patient_id))
+        for suffix, _, _ in SEGMENT_FILES:
+            shutil.copyfile(path + suffix, target + '.tmp' + suffix)
+        series = MappedHeartRateSeries.open(target + '.tmp')
+        series.rename(target)
+        return series
+
+    def spill(self, patient_id, history):
+        """Move a history into a segment once it is too long
+
+        Args:
+            patient_id (int): the ID that identifies a patient
+            history (HeartRateSeries): the history of the patient
+
+        Returns:
+            (HeartRateSeries): history itself while it is short enough or
+            already in a segment, otherwise a MappedHeartRateSeries
+            with the same readings
+        """
+        if type(history) is not HeartRateSeries or \
+                len(history) <= self.max_readings:
+            return history
+        return self.create(patient_id, history.timestamps(),
+                           history.heart_rates())
+
+
+def read_segment(path):
+    """Load the files that MappedHeartRateSeries.save() wrote into memory
+
+    Args:
+        path (str): the saved files, without the suffixes
+
+    Returns:
+        (HeartRateSeries): the readings of the files
+    """
+    return HeartRateSeries.from_arrays(
+        np.fromfile(path + '.ts', dtype=TIMESTAMP_DTYPE),
+        np.fromfile(path + '.bpm', dtype=HEART_RATE_DTYPE))
@@ -1,21 +1,131 @@
+import numpy as np
 import pandas as pd
-from ast import literal_eval  # To convert a string of dict into a real dict
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from datetime import datetime
+import itertools
+import json
 import logging
 from cerberus import Validator
-import requests
+import os
+import threading
+import time
+from hrss_alert import AlertQueue, AlertCoalescer, CircuitBreaker, \
+    EmailClient, Outbox, new_alert_id
+from hrss_ingest import IngestRing, iter_csv, iter_ndjson
+from hrss_loader import load_patients
+from hrss_tachycardia import is_tachycardic, tachycardic_mask
+from hrss_segments import SegmentDirectory
+from hrss_snapshot import pack_snapshot, read_snapshot, write_snapshot
+from hrss_wal import WriteAheadLog
+from hrss_store import PatientStore, PhysicianStore, HeartRateSeries, \
+    datetime_to_epoch, epoch_to_time_str, time_str_to_epoch, \
+    MAX_HEART_RATE, NS_PER_SECOND, TIME_FORMAT, TIME_PATTERN, \
+    TimestampClock
 
 app = Flask(__name__)
 # Initialize the global databases with corresponding columns but no data yet,
 # so all of their len() will be 0. They're ready to store data. Done this in
 # case some functions below need this info
-physician_db = pd.DataFrame(
-    columns=['attending_username', 'attending_email', 'attending_phone'])
-patient_db = pd.DataFrame(
-    columns=['patient_id', 'attending_username', 'patient_age',
-             'heart_rate_history'])
+physician_db = PhysicianStore()  # Keyed by attending_username
+patient_db = PatientStore()  # Keyed by patient_id so every route finds a
+# patient with a hash lookup instead of scanning all the patients
 admin_db = pd.DataFrame(columns=['admin_username', 'admin_password'])
+admin_lock = threading.Lock()  # The stores have their own locks, admin_db
+# only needs the registrations to go 1 at a time
+reading_clock = TimestampClock()  # Stamps the heart rates that come without
+# the time they were measured, never twice with the same nanosecond
+# Lock order when a request needs several: physician_db.registry_lock, then
+# patient_db.registry_lock, then a stripe of patient_db.patient_locks
+
+EMAIL_SERVER_URL = os.environ.get(
+    'HRSS_EMAIL_URL', 'http://vcm-7631.vm.duke.edu:5007/hrss/send_email')
+# Point it at hrss_email_stub.py to test without the real email server
+ALERT_WORKERS = int(os.environ.get('HRSS_ALERT_WORKERS', 4))  # Number of
+# threads sending the tachycardia emails
+ALERT_QUEUE_SIZE = int(os.environ.get('HRSS_ALERT_QUEUE_SIZE', 1000))  # Max
+# number of emails waiting to be sent
+EMAIL_CONNECT_TIMEOUT = float(os.environ.get('HRSS_EMAIL_CONNECT_TIMEOUT',
+                                             3.05))  # Seconds
+EMAIL_READ_TIMEOUT = float(os.environ.get('HRSS_EMAIL_READ_TIMEOUT', 10))
+EMAIL_FAILURE_THRESHOLD = 5  # Failures in a row that open the circuit
+EMAIL_RESET_TIMEOUT = 30.0  # Seconds the circuit stays open
+ALERT_WINDOW = float(os.environ.get('HRSS_ALERT_WINDOW', 300))  # Seconds
+# the tachycardic readings of a patient are merged into 1 summary email
+ALERT_BUCKET_SIZE = int(os.environ.get('HRSS_ALERT_BUCKET_SIZE', 10))  # Max
+# burst of emails to 1 physician
+ALERT_BUCKET_RATE = float(os.environ.get('HRSS_ALERT_BUCKET_RATE', 10)) / \
+    3600  # Emails per hour to 1 physician, turned into per second
+ALERT_OUTBOX = os.environ.get('HRSS_ALERT_OUTBOX', 'alert_outbox.jsonl')
+# Emails waiting to be sent, kept on disk so a restart doesn't drop them
+ALERT_DEAD_LETTER = os.environ.get('HRSS_ALERT_DEAD_LETTER',
+                                   'alert_dead_letter.jsonl')  # Emails that
+# failed for good, until an administrator replays them
+ALERT_MAX_ATTEMPTS = 8  # Tries before an email goes to ALERT_DEAD_LETTER
+INGEST_MODE = os.environ.get('HRSS_INGEST_MODE', 'direct')  # 'buffered'
+# hands the heart rates to the single writer thread of ingest_ring
+INGEST_RING_SIZE = int(os.environ.get('HRSS_INGEST_RING_SIZE', 4096))  # Max
+# number of heart rates waiting to be committed
+INGEST_BATCH_SIZE = int(os.environ.get('HRSS_INGEST_BATCH_SIZE', 256))
+INGEST_BATCH_DELAY = float(os.environ.get('HRSS_INGEST_BATCH_DELAY',
+                                          0.002))  # Max seconds a heart rate
+# waits for its batch to fill up
+INGEST_ACK_TIMEOUT = 10.0  # Max seconds a request waits for the commit
+BATCH_MAX_READINGS = int(os.environ.get('HRSS_BATCH_MAX_READINGS', 50000))
+# Max number of heart rates in 1 request to /api/heart_rate/batch
+IMPORT_CHUNK_ROWS = int(os.environ.get('HRSS_IMPORT_CHUNK_ROWS', 50000))
+# Heart rates validated and added together by /api/admin/import/heart_rates
+STREAM_ACK_EVERY = int(os.environ.get('HRSS_STREAM_ACK_EVERY', 100))  # Heart
+# rates between 2 acknowledgements of /api/heart_rate/stream
+STREAM_ACK_INTERVAL = float(os.environ.get('HRSS_STREAM_ACK_INTERVAL', 1.0))
+# Max seconds between 2 acknowledgements while heart rates keep coming
+MAX_LATENESS = float(os.environ.get('HRSS_MAX_LATENESS', 3600))  # Max
+# seconds a device timestamp may be older than the latest heart rate of its
+# patient and still be merged into the history
+MAX_CLOCK_SKEW = float(os.environ.get('HRSS_MAX_CLOCK_SKEW', 5))  # Max
+# seconds a device timestamp may be ahead of the server clock
+WAL_PATH = os.environ.get('HRSS_WAL', 'hrss_wal.log')  # Every change to
+# the databases, replayed at start-up
+WAL_SYNC_INTERVAL = float(os.environ.get('HRSS_WAL_SYNC_INTERVAL', 0.002))
+# Seconds the WAL waits for more changes to share 1 fsync
+SNAPSHOT_PATH = os.environ.get('HRSS_SNAPSHOT', 'hrss_snapshot.npz')  # All
+# the databases at the last checkpoint, loaded before the WAL is replayed
+SNAPSHOT_INTERVAL = float(os.environ.get('HRSS_SNAPSHOT_INTERVAL', 3600))
+# Seconds between 2 checkpoints of a running server
+SEGMENT_DIR = os.environ.get('HRSS_SEGMENT_DIR', 'hrss_segments')  # The
+# memory-mapped files of the histories too long to keep in memory
+SEGMENT_READINGS = int(os.environ.get('HRSS_SEGMENT_READINGS', 100000))
+# Readings a history may have before it moves into a segment file
+QUARANTINE_PATH = os.environ.get('HRSS_QUARANTINE', 'quarantine.csv')  # The
+# malformed rows of a patient CSV file, with the reasons
+LATE_MSG = 'This heart rate is more than {:g} seconds older than the ' \
+           'latest heart rate of the patient.'.format(MAX_LATENESS)
+WAL_FAILED_MSG = 'The change could not be written to disk. Please request ' \
+                 'again later.'
+FUTURE_MSG = 'This timestamp is more than {:g} seconds ahead of the ' \
+             'server clock.'.format(MAX_CLOCK_SKEW)
+wal = WriteAheadLog(WAL_PATH, sync_interval=WAL_SYNC_INTERVAL)  # Opened
+# by recover_database(), so the unit tests never write to it
+segments = SegmentDirectory(SEGMENT_DIR, max_readings=SEGMENT_READINGS)
+patient_db.segments = segments
+
+
+def lock_key(patient_id):
+    """Turn the patient_id of a request into the key of its patient lock
+
+    The lock is taken before the patient_id is validated, so a patient_id
+    that isn't an int (or a str of an int) gets key 0. The validation
+    rejects it anyway, so which stripe it waits on doesn't matter
+
+    Args:
+        patient_id (any): the patient_id as it came in the request
+
+    Returns:
+        key (int): the key for patient_db.locked()
+    """
+    try:
+        return int(patient_id)
+    except (TypeError, ValueError):
+        return 0
 
 
 # **************************Junqi Lu starts**************************
@@ -26,9 +136,9 @@ def init_database():
     This function reads the corresponding csv files to initialize the 3
     dummy databases for each of the team members to work individually.
     physician_db and admin_db are generated by a simple read in csv
-    files from pd package. patient_db, however, requires some data type
-    conversions so the data type in each cell is as expected rather than a
-    string of the corresponding data type
+    files from pd package. patient_db, however, is built by load_patients(),
+    which validates and parses the csv file in chunks across a process pool
+    and puts the malformed rows into QUARANTINE_PATH instead
 
     Returns:
         0 (int): this is the value to indicate that the function
@@ -41,22 +151,140 @@ def init_database():
     global patient_db
     global admin_db
 
-    physician_db = pd.read_csv('dummy_data/physicians_data.csv')
+    physician_db = PhysicianStore.from_frame(
+        pd.read_csv('dummy_data/physicians_data.csv'))
 
-    patient_db = pd.read_csv('dummy_data/patients_clean_data.csv')
-    patient_db = patient_db.astype(
-        {'patient_id': int,
-         'attending_username': str,
-         'patient_age': int}).astype(object)  # Convert the data types in
-    # these 3 columns accordingly
-    patient_db['heart_rate_history'] = patient_db['heart_rate_history'].apply(
-        literal_eval)  # Convert that column's values into dict
+    patient_db, report = load_patients(
+        'dummy_data/patients_clean_data.csv', physicians=physician_db,
+        quarantine_path=QUARANTINE_PATH, segments=segments)  # The records
+    # come with their latest reading cached
+    if report['quarantined'] != 0:
+        logging.warning('{} malformed patients were put into {}'.format(
+            report['quarantined'], QUARANTINE_PATH))
 
     admin_db = pd.read_csv('dummy_data/admin_data.csv')
 
     return 0
 
 
+def apply_wal_entry(entry):
+    """Apply 1 change from the write-ahead log to the databases
+
+    The change was validated when it was first made, so it goes straight
+    into the stores without any check, lock or alert
+
+    Args:
+        entry (dict): 1 entry written by wal.append(), whose "op" is
+        "patient", "attending", "admin", "heart_rate" or "heart_rates"
+    """
+    global admin_db
+
+    op = entry['op']
+    if op == 'patient':
+        patient_db.add(entry)
+    elif op == 'attending':
+        physician_db.add(entry)
+    elif op == 'admin':
+        admin_db.loc[len(admin_db.index)] = [entry['admin_username'],
+                                             entry['admin_password']]
+    elif op == 'heart_rate':
+        record = patient_db.get(entry['patient_id'])
+        patient_db.add_reading(record, entry['timestamp'],
+                               entry['heart_rate'],
+                               tachycardic_judge(record['patient_age'],
+                                                 entry['heart_rate']))
+    elif op == 'heart_rates':
+        patient_db.add_readings(patient_db.get(entry['patient_id']),
+                                entry['timestamps'], entry['heart_rates'])
+    elif op == 'checkpoint':  # Marks the snapshot the log continues
+        pass
+    else:
+        logging.warning('Unknown write-ahead log entry {}'.format(op))
+
+
+def recover_database():
+    """Load the last snapshot, replay the write-ahead log and open it
+
+    The databases are loaded from SNAPSHOT_PATH if there is one, and every
+    registration and heart rate accepted after it, up to the last shutdown
+    or crash, is applied again in order. Then wal is opened so the new
+    changes are appended after them
+
+    Returns:
+        count (int): the number of changes replayed
+    """
+    global physician_db
+    global patient_db
+    global admin_db
+
+    start = time.perf_counter()
+    offset = 0
+    if os.path.exists(SNAPSHOT_PATH):
+        patient_db, physician_db, admin_db, snapshot_id, wal_offset = \
+            read_snapshot(SNAPSHOT_PATH, segments=segments)
+        if wal.checkpoint_id() != snapshot_id:  # The server stopped after
+            # writing the snapshot but before the checkpoint of the WAL, so
+            # the WAL still has the changes in the snapshot
+            offset = wal_offset
+    loaded = time.perf_counter()
+    count = wal.replay(apply_wal_entry, offset)
+    wal.open()
+    logging.info('Loaded {} patients from {} in {:.3f} s, replayed {} '
+                 'changes from {} in {:.3f} s'.format(
+                     len(patient_db), SNAPSHOT_PATH, loaded - start, count,
+                     WAL_PATH, time.perf_counter() - loaded))
+    return count
+
+
+def checkpoint_database():
+    """Write a snapshot of the databases and truncate the write-ahead log
+
+    The databases are packed into arrays under the write side of all their
+    locks, so the snapshot is 1 consistent state and matches the size of
+    wal at that moment. The requests wait only while the arrays are
+    copied; the snapshot file is written afterwards, and only then are the
+    changes it holds dropped from wal. The histories in segment files are
+    not in the arrays: write_snapshot() copies their files afterwards,
+    holding the lock of 1 patient at a time
+
+    Returns:
+        snapshot_id (str): the ID of the new snapshot
+    """
+    with physician_db.registry_lock.write(), \
+            patient_db.registry_lock.write(), admin_lock:
+        arrays = pack_snapshot(patient_db, physician_db, admin_db)
+        offset = wal.tell()
+    snapshot_id = write_snapshot(SNAPSHOT_PATH, arrays, offset,
+                                 patient_db=patient_db)
+    wal.checkpoint(offset, snapshot_id)
+    logging.info('Checkpoint {} of {} patients at WAL offset {}'.format(
+        snapshot_id, len(patient_db), offset))
+    return snapshot_id
+
+
+def start_checkpoints(interval=SNAPSHOT_INTERVAL):
+    """Call checkpoint_database() every interval seconds in the background
+
+    Args:
+        interval (float): seconds between 2 checkpoints
+
+    Returns:
+        thread (threading.Thread): the daemon thread writing the snapshots
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                checkpoint_database()
+            except Exception as e:  # Try again at the next interval
+                logging.error('Checkpoint failed: {}'.format(e))
+
+    thread = threading.Thread(target=run, daemon=True,
+                              name='hrss-checkpoint')
+    thread.start()
+    return thread
+
+
 @app.route('/api/new_patient', methods=['POST'])
 def post_new_patient_handler():
     """Receive data from route request, add new patient data into the
@@ -77,24 +305,30 @@ def post_new_patient_handler():
 
         status (int): 200 if the patient data was successfully added into
         patient_db; 400 if the input patient data has some issues that need
-        to be fixed and request again
+        to be fixed and request again; 503 if wal could not write it to disk
     """
     # You do not have to test the Flask handler functions directly
 
     # Receive data from the route request
     in_data = request.get_json()
 
-    # Validate inputs
-    # type_judgement, type_msg_str = new_patient_type_validate(in_data)
-    value_judgement, value_msg_list = new_patient_value_validate(in_data)
-    # Commented out new_patient_type_validate(in_data) because
-    # new_patient_value_validate(in_data) already has that function
-
-    # Complete tasks
-    out_msg, status = post_new_patient_worker(value_msg_list,
-                                              value_judgement, in_data)
+    # Registering changes the patient dicts, so no other request may touch
+    # patient_db until it's done
+    with physician_db.registry_lock.read(), \
+            patient_db.registry_lock.write():
+        # Validate inputs
+        # type_judgement, type_msg_str = new_patient_type_validate(in_data)
+        value_judgement, value_msg_list = new_patient_value_validate(in_data)
+        # Commented out new_patient_type_validate(in_data) because
+        # new_patient_value_validate(in_data) already has that function
+
+        # Complete tasks
+        out_msg, status = post_new_patient_worker(value_msg_list,
+                                                  value_judgement, in_data)
     # Based on value_judgement, it decides whether to add the in_data to the
     # database and also what message it should send out
+    if not wal.sync():  # Answer only once the new patient is on disk
+        return WAL_FAILED_MSG, 503
 
     return out_msg, status
 
@@ -154,11 +388,9 @@ def post_new_patient_worker(value_msg_list, value_judgement, in_data,
             # physician_db, and patient_age is valid
             add_new_patient(in_data)  # Add the new patient data into the
             if test_mode is True:  # For testing the post_new_patient_worker()
-                global patient_db
-                patient_db.drop(patient_db.tail(1).index,
-                                inplace=True)  # Drop the last
-                # row, aka the newly added row so this test function doesn't
-                # modify the patient_db when it's finished
+                patient_db.remove(in_data['patient_id'])  # Drop the newly
+                # added patient so this test function doesn't modify the
+                # patient_db when it's finished
 
             # global patient_db
             logging.info('Patient with id {} was successfully '
@@ -322,16 +554,14 @@ def new_patient_value_validate(in_data):
         # checked for whether the value makes sense
         judgment = True
         try:
-            if int(in_data['patient_id']) in \
-                    patient_db['patient_id'].to_list():
+            if int(in_data['patient_id']) in patient_db:
                 value_msg_list.append('This patient_id is already in use.')
                 judgment = False
         except (ValueError, Exception):
             raise
 
         try:
-            if in_data['attending_username'] not in \
-                    list(physician_db['attending_username']):
+            if in_data['attending_username'] not in physician_db:
                 value_msg_list.append(
                     'No matching attending physician from physician '
                     'database.')
@@ -348,11 +578,11 @@ def new_patient_value_validate(in_data):
 def add_new_patient(in_data):
     """Add the new patient in_data into patient_db
 
-    This function converts the in_data (now has data in correct data types
-    and values) into a df and concatenate that df with the original
-    patient_db. If the patient_id or patient_age is in the format of a str
-    of an int, it also converts those into int to ensure the data types
-    inside patient_db are correct
+    This function adds the in_data (now has data in correct data types
+    and values) as a new record of patient_db keyed by its patient_id. If
+    the patient_id or patient_age is in the format of a str of an int, it
+    also converts those into int to ensure the data types inside patient_db
+    are correct
 
     Args:
         in_data (dict): the input patient data in the format of {
@@ -361,8 +591,8 @@ def add_new_patient(in_data):
             "patient_age": <int or str of int>}
 
     Returns:
-        patient_db (df): the global pandas dataframe (df) that contains all
-        the patient data
+        patient_db (PatientStore): the global store that contains all the
+        patient data
     """
     # The in_data will be in good formats and values before it reaches to
     # this function, so this function simply adds the in_data to the patient
@@ -374,16 +604,12 @@ def add_new_patient(in_data):
     in_data['patient_id'] = int(in_data['patient_id'])
     in_data['patient_age'] = int(in_data['patient_age'])
 
-    in_data_df = pd.DataFrame(in_data, index=[0])  # Without index =[0],
-    # you'll have ValueError: If using all scalar values, you must pass an
-    # index
-    patient_db = pd.concat([patient_db, in_data_df], ignore_index=True)
-    # concat() is used to replace append() which will be deprecated. You
-    # made a new df object here
+    patient_db.add(in_data)  # A new patient has no heart_rate_history yet
+    wal.append({"op": 'patient', "patient_id": in_data['patient_id'],
+                "attending_username": in_data['attending_username'],
+                "patient_age": in_data['patient_age']})
 
-    return patient_db  # Somehow I need to return patient_db; otherwise the
-    # pd.concat() won't work and the patient_db remains unchanged in testing
-    # function
+    return patient_db
 
 
 @app.route('/api/heart_rate', methods=['POST'])
@@ -411,28 +637,76 @@ def post_heart_rate_handler():
 
         status (int): 200 if the heart_rate data was successfully added into
         patient_db; 400 if the input heart_rate data has some issues that need
-        to be fixed and request again
+        to be fixed and request again; 503 if it is not on disk
     """
     # Receive data from the route request
     in_data = request.get_json()
 
-    # Validate inputs
-    # type_judgement, type_msg_str = new_patient_type_validate(in_data)
-    value_judgement, value_msg_list = new_heart_rate_value_validate(in_data)
-    # Commented out new_patient_type_validate(in_data) because
-    # new_patient_value_validate(in_data) already has that function
+    out_msg, status = ingest_heart_rate(in_data)
+    if not wal.sync():  # Answer only once the heart rate is on disk
+        return WAL_FAILED_MSG, 503
 
-    # Complete tasks
-    out_msg, status = post_heart_rate_worker(value_msg_list,
-                                             value_judgement, in_data)
+    return out_msg, status
+
+
+def ingest_heart_rate(in_data, test_mode=False):
+    """Validate and add 1 heart rate under the locks it needs
+
+    This is the ingest path shared by '/api/heart_rate' and
+    '/api/heart_rate/stream'. It validates in_data and adds it with
+    post_heart_rate_worker(), or in the buffered INGEST_MODE hands it to
+    ingest_ring with enqueue_heart_rate_worker()
+
+    Args:
+        in_data (dict): the input patient data in the format of {
+        "patient_id": <patient_id>,
+        "heart_rate": <heart_rate>
+        } where both <patient_id> and <heart_rate> can be an int or a string
+        of int
+
+        test_mode (bool): default to be False. Passed on to
+        post_heart_rate_worker() for unit testing
+
+    Returns:
+        out_msg (str): the message of post_heart_rate_worker()
+
+        status (int): the status code of post_heart_rate_worker()
+    """
+    patient_id = in_data.get('patient_id') if type(in_data) is dict \
+        else None
+    if INGEST_MODE == 'buffered':  # Only validate here and let the writer
+        # thread of ingest_ring commit the heart rate
+        with patient_db.registry_lock.read():
+            value_judgement, value_msg_list = \
+                new_heart_rate_value_validate(in_data)
+        return enqueue_heart_rate_worker(value_msg_list, value_judgement,
+                                         in_data)
+
+    # Only the requests of patients on the same lock stripe wait for each
+    # other, the other patients are served in parallel
+    deferred = []  # The alert is queued after the locks
+    with physician_db.registry_lock.read(), \
+            patient_db.locked(lock_key(patient_id)):
+        # Validate inputs
+        # type_judgement, type_msg_str = new_patient_type_validate(in_data)
+        value_judgement, value_msg_list = \
+            new_heart_rate_value_validate(in_data)
+        # Commented out new_patient_type_validate(in_data) because
+        # new_patient_value_validate(in_data) already has that function
+
+        # Complete tasks
+        out_msg, status = post_heart_rate_worker(value_msg_list,
+                                                 value_judgement, in_data,
+                                                 test_mode, deferred)
     # Based on value_judgement, it decides whether to add the in_data to the
     # database and also what message it should send out
+    submit_alerts(deferred)
 
     return out_msg, status
 
 
 def post_heart_rate_worker(value_msg_list, value_judgement, in_data,
-                           test_mode=False):
+                           test_mode=False, deferred=None):
     """The real working function that add the heart_rate to the patient_db
     heart_rate_history column based on the value_judgement
 
@@ -464,6 +738,9 @@ def post_heart_rate_worker(value_msg_list, value_judgement, in_data,
         test_mode if you're sure that some previous steps has added in 1
         heart_rate measurement for testing
 
+        deferred (list or None): passed on to raise_alert(), so the caller
+        queues the email after its locks
+
     Returns:
         out_msg (str): concatenated all the str inside out_msg_list
 
@@ -487,54 +764,46 @@ def post_heart_rate_worker(value_msg_list, value_judgement, in_data,
         if value_judgement:  # If the data type and data value
             # follow the rules and make sense
             patient_id = int(in_data['patient_id'])
-            heart_rate_history_before_cell_value = \
-                patient_db[patient_db['patient_id'] == patient_id][
-                    'heart_rate_history'].values[0]
+            record = patient_db.get(patient_id)  # 1 hash lookup serves
+            # the whole request
 
-            if type(heart_rate_history_before_cell_value) == dict:  # This if
+            latest_before = record['latest']
+            if record['heart_rate_history'] is not None:  # This if
                 # statement is necessary since a patient might exist but has
-                # no heart_rate_history. In that case,
-                # type(heart_rate_history_before_cell_value) is a float (nan)
-                heart_rate_history_before = \
-                    heart_rate_history_before_cell_value.copy()
+                # no heart_rate_history. In that case, the history is None
+                heart_rate_history_before = None  # Only a unit test
+                # takes the reading back, so a real request never copies
+                # the whole history
+                if test_mode is True:
+                    heart_rate_history_before = \
+                        record['heart_rate_history'].copy()
                 history_dict_exist = True  # history_dict_exist will be used
                 # to determine different ways of incorporating the new heart
                 # rate into the history
-            else:  # Most likely the type will be a float for nan
-                heart_rate_history_before = \
-                    heart_rate_history_before_cell_value
+            else:
+                heart_rate_history_before = None
                 history_dict_exist = False
 
+            age = record['patient_age']
+            tachycardic = tachycardic_judge(age, int(in_data['heart_rate']))
+            # Tachycardia is decided based on age and heart_rate, once for
+            # both the event index and the email
+
             add_new_heart_rate(in_data,
-                               history_dict_exist)  # Add the new patient
+                               history_dict_exist,
+                               tachycardic)  # Add the new patient
             # data into the
 
             if test_mode is True:  # This allows the worker to delete the
                 # additional heart rate from the history after unit testing
-
-                row_index = \
-                    patient_db.index[
-                        patient_db['patient_id'] == patient_id].values[
-                        0]  # Obtain the row_index to use df.loc[] to properly
-                # change values
-
-                # A less elegant way of restore the value in that cell
-                patient_db.loc[row_index, 'heart_rate_history'] = [
-                    heart_rate_history_before]  # Add in a list of dict
-
-                patient_db['heart_rate_history'] = patient_db[
-                    'heart_rate_history'].apply(lambda x: x[0] if type(
-                        x) == list else x)  # For cells in column
-                # "heart_rate_history", if the value of a cell is a list,
-                # convert it into a dict; otherwise, keep it as it is
-
-            age = \
-                patient_db[patient_db['patient_id'] == in_data['patient_id']][
-                    'patient_age'].values[0]
-
-            if tachycardic_judge(age, in_data['heart_rate']):  # Tachycardia
-                # is decided based on age and heart_rate
-                email_msg, email_status = send_email(in_data)
+                record['heart_rate_history'] = heart_rate_history_before
+                record['latest'] = latest_before
+                patient_db.index_tachycardia(record)  # Also takes the
+                # reading back out of the tachycardia log
+
+            if tachycardic:
+                email_msg = raise_alert(in_data, record, test_mode,
+                                        deferred)
                 out_msg_list.append(email_msg)
 
             # Return information to requestor
@@ -555,12 +824,479 @@ def post_heart_rate_worker(value_msg_list, value_judgement, in_data,
     return out_msg, status
 
 
+@app.route('/api/heart_rate/stream', methods=['POST'])
+def post_heart_rate_stream_handler():
+    """Receive a continuous feed of heart rates as newline-delimited JSON
+
+    This function is the handler of the route '/api/heart_rate/stream'. The
+    request body, usually sent with chunked transfer encoding, has 1
+    in_data of '/api/heart_rate' per line. The body is parsed line by line
+    as it arrives, every heart rate goes through the same ingest path as
+    '/api/heart_rate', and the answer is streamed back as
+    newline-delimited JSON while the feed goes on
+
+    Returns:
+        (Response): the streamed lines of heart_rate_stream_worker()
+    """
+    records = iter_ndjson(request.stream)
+    return Response(stream_with_context(heart_rate_stream_worker(records)),
+                    mimetype='application/x-ndjson')
+
+
+def heart_rate_stream_worker(records, ack_every=STREAM_ACK_EVERY,
+                             ack_interval=STREAM_ACK_INTERVAL,
+                             test_mode=False, clock=time.monotonic):
+    """Ingest a feed of heart rates and write back acknowledgements
+
+    Every heart rate is added with ingest_heart_rate() in the order of the
+    feed, so once it returns, every heart rate up to its sequence number is
+    committed. After every ack_every heart rates, or ack_interval seconds,
+    the last committed sequence number is written back once the heart
+    rates are on disk, so they share 1 fsync of wal, and a rejected heart
+    rate is reported right away
+
+    Args:
+        records (iterable of tuple): (seq, in_data, error) of every line,
+        see iter_ndjson()
+
+        ack_every (int): heart rates between 2 acknowledgements
+
+        ack_interval (float): max seconds between 2 acknowledgements
+
+        test_mode (bool): default to be False. Passed on to
+        ingest_heart_rate() for unit testing
+
+        clock (callable): returns the time in seconds
+
+    Returns:
+        (generator of str): JSON lines, either {"ack": <seq>} when every
+        heart rate up to seq is committed, {"seq": <seq>, "status": 400,
+        "msg": <str>} for a rejected heart rate, or at the end of the feed
+        {"ack": <seq>, "added": <int>, "rejected": <int>, "done": true}. If
+        wal fails, the last line is {"status": 503, "msg": <str>, "done":
+        true} instead and nothing after the last ack is acknowledged
+    """
+    added = rejected = 0
+    last_seq = acked_seq = 0
+    acked_at = clock()
+    for seq, in_data, error in records:
+        if error is None:
+            out_msg, status = ingest_heart_rate(in_data, test_mode)
+        else:
+            out_msg, status = error + '\nFix and request again.', 400
+        last_seq = seq
+        if status == 200:
+            added += 1
+        else:
+            rejected += 1
+            yield json.dumps({"seq": seq, "status": status,
+                              "msg": out_msg}) + '\n'
+        if seq - acked_seq >= ack_every or \
+                clock() - acked_at >= ack_interval:
+            if not wal.sync():  # Only acknowledge heart rates that are on
+                # disk
+                yield json.dumps({"status": 503, "msg": WAL_FAILED_MSG,
+                                  "done": True}) + '\n'
+                return
+            yield json.dumps({"ack": seq}) + '\n'
+            acked_seq, acked_at = seq, clock()
+    if not wal.sync():
+        yield json.dumps({"status": 503, "msg": WAL_FAILED_MSG,
+                          "done": True}) + '\n'
+        return
+    yield json.dumps({"ack": last_seq, "added": added, "rejected": rejected,
+                      "done": True}) + '\n'
+
+
+def enqueue_heart_rate_worker(value_msg_list, value_judgement, in_data):
+    """Hand a validated heart rate to ingest_ring and wait for its commit
+
+    This is the buffered form of post_heart_rate_worker(). The request
+    thread doesn't touch the patient record, it puts the heart_rate and
+    its timestamp into ingest_ring and waits until the writer thread
+    committed it with commit_heart_rates()
+
+    Args:
+        value_msg_list (list of str): a list collecting all the problems from
+        the previous checks, if there's any
+
+        value_judgement (bool): whether the in_data has passed the previous
+        checks and is ready to be added into the patient_db
+
+        in_data (dict): the input patient data in the format of {
+        "patient_id": <patient_id>,
+        "heart_rate": <heart_rate>
+        } where both <patient_id> and <heart_rate> can be an int or a string
+        of int
+
+    Returns:
+        out_msg (str): the same message as post_heart_rate_worker()
+
+        status (int): 200 if the heart_rate was committed; 400 if the input
+        patient data has some issues that need to be fixed and request
+        again; 503 if ingest_ring is full or the commit took too long
+    """
+    out_msg_list = value_msg_list
+
+    if not value_judgement:
+        out_msg_list.append("Fix and request "
+                            "again.")
+        return '\n'.join(out_msg_list), 400
+
+    ticket = ingest_ring.submit((int(in_data['patient_id']),
+                                 int(in_data['heart_rate']),
+                                 reading_timestamp(in_data),
+                                 'timestamp' in in_data))
+    if ticket is None:
+        return 'The heart rate queue is full. Please request again ' \
+               'later.', 503
+    result = ticket.wait(INGEST_ACK_TIMEOUT)
+    if result is None:
+        return 'The heart rate was not committed in time. Please check ' \
+               'the heart rate history before requesting again.', 503
+    return result
+
+
+def commit_heart_rates(readings):
+    """Commit a micro-batch of heart rates in 1 pass
+
+    This function is the apply_batch of ingest_ring and only runs on its
+    writer thread. The whole batch is judged for tachycardia at once, then
+    every heart rate is added to its patient's history with its timestamp,
+    and the tachycardic ones raise their alert. Only a timestamp sent by
+    the device is checked against the reorder window, the server stamped
+    the others on arrival
+
+    Args:
+        readings (list of tuple): (patient_id, heart_rate, timestamp,
+        device) of every heart rate, see reading_timestamp(), where device
+        (bool) is True if the timestamp came from the device
+
+    Returns:
+        results (list of tuple): (out_msg, status) of every heart rate in
+        the same order, like post_heart_rate_worker() returns, with 503
+        for the added ones if wal could not write them to disk
+    """
+    results = []
+    deferred = []  # The alerts are queued after the locks
+    with physician_db.registry_lock.read(), \
+            patient_db.registry_lock.read():
+        records = [patient_db.get(patient_id)
+                   for patient_id, _, _, _ in readings]
+        ages = [-1 if record is None else record['patient_age']
+                for record in records]
+        flags = tachycardic_mask(ages, [hr for _, hr, _, _ in readings])
+        for (patient_id, heart_rate, timestamp, device), record, \
+                tachycardic in zip(readings, records, flags.tolist()):
+            if record is None:  # Can't happen while patients are never
+                # removed, but the writer must not die on it
+                results.append(('This patient_id does not exist.', 400))
+                continue
+            with patient_db.patient_locks.for_key(patient_id):
+                late = device and is_late(record, timestamp)  # Judged
+                # again at the commit, newer heart rates may have been
+                # committed since the request was validated
+                if not late:
+                    patient_db.add_reading(record, timestamp, heart_rate,
+                                           tachycardic)
+                    wal.append({"op": 'heart_rate', "patient_id": patient_id,
+                                "heart_rate": heart_rate,
+                                "timestamp": timestamp})
+            if late:
+                results.append((LATE_MSG + '\nFix and request again.', 400))
+                continue
+            out_msg_list = []
+            if tachycardic:
+                out_msg_list.append(raise_alert({"patient_id": patient_id,
+                                                 "heart_rate": heart_rate,
+                                                 "timestamp": timestamp},
+                                                record, deferred=deferred))
+            out_msg_list.append('Patient with id {} had a new heart rate '
+                                'measurement successfully added into the '
+                                'heart rate history.'.format(patient_id))
+            results.append(('\n'.join(out_msg_list), 200))
+    submit_alerts(deferred)
+    if not wal.sync():  # The whole batch shares 1 fsync before it is
+        # acknowledged
+        results = [(WAL_FAILED_MSG, 503) if status == 200 else (msg, status)
+                   for msg, status in results]
+    return results
+
+
+ingest_ring = IngestRing(commit_heart_rates, capacity=INGEST_RING_SIZE,
+                         max_batch=INGEST_BATCH_SIZE,
+                         max_delay=INGEST_BATCH_DELAY)
+
+
+@app.route("/api/ingest/metrics", methods=["GET"])
+def get_ingest_metrics():
+    """Returns the counters of the buffered heart rate ingest
+
+    Returns:
+        jsonify(metrics) (json str): {"depth": <int>, "readings": <int>,
+        "batches": <int>, "rejected": <int>, "max_batch_size": <int>,
+        "mean_batch_size": <float>, "latency_p50": <float>,
+        "latency_p99": <float>} where "depth" is the number of heart rates
+        waiting in ingest_ring and the latencies are the seconds from
+        queueing to commit of the latest heart rates
+    """
+    return jsonify(ingest_ring.metrics())
+
+
+@app.route('/api/heart_rate/batch', methods=['POST'])
+def post_heart_rate_batch_handler():
+    """Receive a list of heart rates from route request and add them all
+
+    This function is the handler of the route '/api/heart_rate/batch'. It
+    receives a list of heart rate records from bedside gateways, validates
+    all of them together, adds the good ones into the heart_rate_history of
+    their patients in 1 pass and raises at most 1 alert per patient
+
+    Returns:
+        jsonify(out) (JSON str): the status of every record as described in
+        post_heart_rate_batch_worker(), or a message saying the request has
+        some issues
+
+        status (int): 200 if the list was processed, even if some records
+        were rejected; 400 if the request itself is not a list of records;
+        503 if wal could not write the records to disk
+    """
+    in_data = request.get_json()
+
+    with physician_db.registry_lock.read(), \
+            patient_db.registry_lock.read():
+        value_judgement, value_msg_list, readings = \
+            heart_rate_batch_validate(in_data)
+
+        deferred = []  # The alerts are queued after the locks
+        out, status = post_heart_rate_batch_worker(value_msg_list,
+                                                   value_judgement, readings,
+                                                   deferred=deferred)
+    submit_alerts(deferred)
+    if not wal.sync():  # 1 fsync for the whole batch
+        return WAL_FAILED_MSG, 503
+
+    return jsonify(out), status
+
+
+def heart_rate_batch_validate(in_data):
+    """Check the data types and values of a batch of heart rates at once
+
+    Every record must follow the same rules as the in_data of
+    /api/heart_rate, plus a "timestamp" of when the heart rate was measured.
+    The fields are checked column by column over the whole batch instead
+    of running a Cerberus Validator per record, and a bad record doesn't
+    stop the good ones
+
+    Args:
+        in_data (list of dict): the heart rate records in the format of [{
+        "patient_id": <patient_id>,
+        "heart_rate": <heart_rate>,
+        "timestamp": <'%Y-%m-%d %H:%M:%S' str>}, ...] where both
+        <patient_id> and <heart_rate> can be an int or a string of int and
+        <timestamp> may end with a fraction of a second
+
+    Returns:
+        judgement (bool): True if in_data is a list of at most
+        BATCH_MAX_READINGS records, whatever the records hold
+
+        value_msg_list (list of str): the problems of in_data as a whole
+
+        readings (pd.DataFrame or None): 1 row per record with the
+        "patient_id", "heart_rate" and "timestamp" (nanoseconds since EPOCH)
+        as int64 and "msg", the problems of the record or '' if it is good
+    """
+    if type(in_data) is not list or len(in_data) == 0:
+        return False, ['The batch must be a non-empty list of heart rate '
+                       'records.'], None
+    if len(in_data) > BATCH_MAX_READINGS:
+        return False, ['The batch has more than {} heart rate records.'
+                       .format(BATCH_MAX_READINGS)], None
+    return True, [], heart_rate_records_validate(in_data)
+
+
+def heart_rate_records_validate(in_data):
+    """Check the fields of many heart rate records column by column
+
+    This is the part of heart_rate_batch_validate() that checks every
+    record, shared with the bulk import of heart_rate_import_worker()
+
+    Args:
+        in_data (list): the heart rate records, see
+        heart_rate_batch_validate()
+
+    Returns:
+        readings (pd.DataFrame): 1 row per record with the "patient_id",
+        "heart_rate" and "timestamp" (nanoseconds since EPOCH) as int64 and
+        "msg", the problems of the record or '' if it is good
+    """
+    is_dict = np.array([type(r) is dict for r in in_data])
+    records = [r if d else {} for r, d in zip(in_data, is_dict)]
+    fields = ['patient_id', 'heart_rate', 'timestamp']
+    columns = {f: pd.Series([r.get(f) for r in records], dtype=object)
+               for f in fields}  # object keeps the ints from becoming
+    # floats next to a missing field
+    msgs = [[] if d else ['The heart rate record must be a dict.']
+            for d in is_dict]
+
+    def reject(mask, msg):
+        for i in np.flatnonzero(mask):
+            msgs[i].append(msg)
+
+    values = {}
+    for field in ['patient_id', 'heart_rate']:
+        column = columns[field]
+        missing = is_dict & column.isna().to_numpy()
+        good = (column.map(type).isin([int, str]) &
+                column.astype(str).str.fullmatch('[0-9]{1,18}')).to_numpy()
+        reject(missing, 'Field "{}" is missing.'.format(field))
+        reject(is_dict & ~missing & ~good, 'Field "{}" must be an int or '
+                                           'a str of an int.'.format(field))
+        values[field] = pd.to_numeric(
+            column.astype(str).where(good, '0')).to_numpy(np.int64)
+        values[field + '_good'] = good
+
+    column = columns['timestamp']
+    text = column.where(column.map(type) == str)
+    text = text.where(text.str.fullmatch(TIME_PATTERN).fillna(False)
+                      .astype(bool))
+    parsed = pd.to_datetime(text, format='ISO8601', errors='coerce')
+    good = parsed.notna().to_numpy()
+    reject(is_dict & column.isna().to_numpy(), 'Field "timestamp" is '
+                                               'missing.')
+    reject(is_dict & column.notna().to_numpy() & ~good,
+           'Field "timestamp" must be a str in the format of '
+           '"yyyy-mm-dd hh:mm:ss".')
+    timestamps = parsed.to_numpy(dtype='datetime64[ns]', na_value=0) \
+        .astype(np.int64)
+    reject(good & is_future(timestamps), FUTURE_MSG)
+
+    known = np.array([patient_id in patient_db
+                      for patient_id in values['patient_id'].tolist()])
+    reject(values['patient_id_good'] & ~known,
+           'This patient_id does not exist.')
+    reject(values['heart_rate_good'] &
+           (values['heart_rate'] > MAX_HEART_RATE),
+           'This heart_rate is out of range.')
+
+    readings = pd.DataFrame({'patient_id': values['patient_id'],
+                             'heart_rate': values['heart_rate'],
+                             'timestamp': timestamps,
+                             'msg': ['\n'.join(m) for m in msgs]})
+    return readings
+
+
+def post_heart_rate_batch_worker(value_msg_list, value_judgement, readings,
+                                 test_mode=False, deferred=None):
+    """The real working function that adds a batch of heart rates
+
+    The good readings are grouped by patient and every patient gets all of
+    its readings in 1 call of PatientStore.add_readings(), which merges
+    them into the history and judges them for tachycardia at once. A
+    patient with tachycardic readings gets 1 alert for the highest of them
+    instead of 1 per reading. Readings more than MAX_LATENESS seconds older
+    than the latest heart rate of their patient are rejected
+
+    Args:
+        value_msg_list (list of str): the problems of the batch as a whole
+
+        value_judgement (bool): whether the batch passed the previous checks
+
+        readings (pd.DataFrame): the records from heart_rate_batch_validate()
+
+        test_mode (bool): default to be False. True only when used for unit
+        testing, so the readings are taken back out of the histories and no
+        email is queued
+
+        deferred (list or None): passed on to raise_alert(), so the caller
+        queues the emails after its locks
+
+    Returns:
+        out (dict or str): {"added": <int>, "rejected": <int>, "results":
+        [{"status": <int>, "msg": <str>}, ...]} with 1 result per record in
+        the order of the request, where the status is 200 for an added
+        heart rate and 400 for a rejected one; or the message of a bad batch
+
+        status (int): 200 if the batch was processed; 400 if not
+    """
+    out_msg_list = value_msg_list
+
+    if not value_judgement:
+        out_msg_list.append("Fix and request "
+                            "again.")
+        return '\n'.join(out_msg_list), 400
+
+    results = [{"status": 400, "msg": msg + '\nFix and request again.'}
+               for msg in readings['msg']]
+    index = np.flatnonzero((readings['msg'] == '').to_numpy())
+    patient_ids = readings['patient_id'].to_numpy()[index]
+    heart_rates = readings['heart_rate'].to_numpy()[index]
+    timestamps = readings['timestamp'].to_numpy()[index]
+
+    order = np.argsort(patient_ids, kind='stable')  # Stable keeps the order
+    # of the request inside every patient, so the last of 2 readings with
+    # the same timestamp wins
+    firsts = np.flatnonzero(np.diff(patient_ids[order])) + 1
+    for rows in np.split(order, firsts):
+        if len(rows) == 0:
+            continue
+        patient_id = int(patient_ids[rows[0]])
+        record = patient_db.get(patient_id)
+        with patient_db.patient_locks.for_key(patient_id):
+            late = PatientStore.late_mask(record, timestamps[rows],
+                                          int(MAX_LATENESS * NS_PER_SECOND),
+                                          now=reading_clock())
+            for i in index[rows[late]]:
+                results[i] = {"status": 400,
+                              "msg": LATE_MSG + '\nFix and request again.'}
+            rows = rows[~late]
+            if len(rows) == 0:
+                continue
+            if test_mode is True:
+                history_before = record['heart_rate_history']
+                if history_before is not None:
+                    history_before = history_before.copy()
+                latest_before = record['latest']
+            flags = patient_db.add_readings(record, timestamps[rows],
+                                            heart_rates[rows])
+            if test_mode is False:
+                wal.append({"op": 'heart_rates', "patient_id": patient_id,
+                            "heart_rates": heart_rates[rows].tolist(),
+                            "timestamps": timestamps[rows].tolist()})
+            if test_mode is True:  # Take the readings back out after unit
+                # testing
+                record['heart_rate_history'] = history_before
+                record['latest'] = latest_before
+                patient_db.index_tachycardia(record)
+        for i in index[rows]:
+            results[i] = {"status": 200,
+                          "msg": 'Patient with id {} had a new heart rate '
+                                 'measurement successfully added into the '
+                                 'heart rate history.'.format(patient_id)}
+        if flags.any():  # 1 alert for the highest tachycardic heart rate
+            tachycardic_rows = rows[flags]
+            j = tachycardic_rows[np.argmax(heart_rates[tachycardic_rows])]
+            email_msg = raise_alert({"patient_id": patient_id,
+                                     "heart_rate": int(heart_rates[j]),
+                                     "timestamp": int(timestamps[j])},
+                                    record, test_mode, deferred)
+            results[index[j]]['msg'] = email_msg + '\n' + \
+                results[index[j]]['msg']
+
+    added = sum(result['status'] == 200 for result in results)
+    out = {"added": added, "rejected": len(results) - added,
+           "results": results}
+    return out, 200
+
+
 def tachycardic_judge(age, heart_rate):
     """Judge whether a heart_rate is tachycardic based on the age
 
     This function judges whether a heart_rate is tachycardic with the given
     age of the patient. The relationship can be found here:
     https://www.wikiwand.com/en/Tachycardic#Diagnosis
+    The threshold is 1 lookup in the age-indexed table of hrss_tachycardia,
+    which is shared with is_tachycardia().
 
     Args:
         age (int): patient age
@@ -570,30 +1306,135 @@ def tachycardic_judge(age, heart_rate):
         True or False (bool): the judgement made on whether heart_rate is
         tachycardic based on the given age
     """
-    # All patients are older than 1-yr-old
-    age_heart_rate_dict = {  # A dict for tachycardia diagnosis for patients
-        # younger than 15-yr-old
-        range(1, 3): 151,  # Inclusive range [1,2] for age in years. Belows
-        # are the same
-        range(3, 5): 137,  # Range [3, 4]
-        range(5, 8): 133,  # Range [5,6,7]
-        range(8, 12): 130,  # Range [8,9,10,11]
-        range(12, 16): 119  # Range [12,13,14,15]
-        # Older than 15-yr-old, the threshold is 100 bpm
-    }
+    return is_tachycardic(age, heart_rate)
 
-    if age > 15:  # Older than 15-yr-old, the threshold is 100 bpm
-        if heart_rate > 100:
-            return True
-        else:
-            return False
+
+def raise_alert(in_data, record, test_mode=False, deferred=None):
+    """Alert the attending physician of a tachycardic heart rate
+
+    The reading goes through alert_coalescer first. The first tachycardic
+    reading of a patient is emailed right away by queue_email(), and the
+    next ones within ALERT_WINDOW seconds are merged into 1 summary email
+    that queue_summary() sends when the window ends.
+    A caller holding the store locks passes a deferred list, so the email is
+    only built here and submit_alerts() queues it once the locks are
+    released, because putting it into the outbox waits for an fsync
+
+    Args:
+        in_data (dict): the input patient data in the format of {
+        "patient_id": <patient_id>,
+        "heart_rate": <heart_rate>
+        } where both <patient_id> and <heart_rate> can be an int or a string
+        of int
+
+        record (dict): the record of the patient inside patient_db
+
+        test_mode (bool): default to be False. True only when used for unit
+        testing, so the coalescer is skipped and the email is not queued
+
+        deferred (list or None): where the email is kept for
+        submit_alerts(), None to queue it right away
+
+    Returns:
+        msg (str): what happened to the alert, for the requestor
+    """
+    if test_mode is False:
+        alert_coalescer.start(queue_summary)
+        if not alert_coalescer.offer(record['patient_id'],
+                                     record['attending_username'],
+                                     in_data['timestamp'],
+                                     int(in_data['heart_rate'])):
+            return 'Tachycardic heart rate merged into the next alert ' \
+                   'summary of patient {}.'.format(record['patient_id'])
+    msg, alert_id = queue_email(in_data, test_mode, deferred)
+    return msg
+
+
+def submit_alerts(deferred):
+    """Queue the emails raise_alert() kept aside for after the locks
+
+    Args:
+        deferred (list of tuple): (alert_id, out_data) of every email
+    """
+    for alert_id, out_data in deferred:
+        alert_queue.submit(alert_id, out_data)  # With the outbox an alert
+        # is never dropped, so the message given for it holds
+
+
+def queue_summary(summary):
+    """Queue the summary email of the merged tachycardic heart rates
+
+    Args:
+        summary (dict): a summary from alert_coalescer in the format of {
+        "patient_id": <int>, "attending_username": <str>, "count": <int>,
+        "max_heart_rate": <int>, "first_timestamp": <int>,
+        "last_timestamp": <int>}
+
+    Returns:
+        alert_id (str): the ID of the alert, or None if the alert queue was
+        full
+    """
+    attending_email = physician_db.get(summary['attending_username'])[
+        'attending_email']
+    out_data = {"from_email": 'tachycardic_heart_rate@BLH_hospital.com',
+                "to_email": attending_email,
+                "subject": 'Patient with id {} is still '
+                           'tachycardic'.format(summary['patient_id']),
+                "content": 'Dear Dr. {},\nYour patient with id {} had {} '
+                           'more tachycardic heart rates between {} and {}, '
+                           'up to {} bpm.'.format(
+                            summary['attending_username'],
+                            summary['patient_id'],
+                            summary['count'],
+                            epoch_to_time_str(summary['first_timestamp']),
+                            epoch_to_time_str(summary['last_timestamp']),
+                            summary['max_heart_rate'])}
+    alert_id = new_alert_id()
+    if alert_queue.submit(alert_id, out_data):
+        return alert_id
+    return None
+
+
+def queue_email(in_data, test_mode=False, deferred=None):
+    """Queue an email to the attending physician of a tachycardic patient
+
+    This function builds the email right away, since it needs the time of
+    the heart rate, and puts it on alert_queue, where a pool of sender
+    threads sends it through deliver_email(). The request ingesting the
+    heart rate is answered without waiting for the email server
+
+    Args:
+        in_data (dict): the input patient data in the format of {
+        "patient_id": <patient_id>,
+        "heart_rate": <heart_rate>
+        } where both <patient_id> and <heart_rate> can be an int or a string
+        of int
+
+        test_mode (bool): default to be False. True only when used for unit
+        testing, so the email is built but not actually queued
+
+        deferred (list or None): where the email is kept for
+        submit_alerts(), None to queue it right away
+
+    Returns:
+        msg (str): a string similar to "Alert <alert_id> queued to e-mail
+        DrBanksJohn@BLH_hospital.com." where <alert_id> can be looked up at
+        '/api/alerts/<alert_id>'
+
+        alert_id (str): the ID of the alert
+    """
+    out_data = email_content(in_data)
+    alert_id = new_alert_id()
+    if deferred is not None and not test_mode:
+        deferred.append((alert_id, out_data))
+    if test_mode or deferred is not None or \
+            alert_queue.submit(alert_id, out_data):
+        msg = 'Alert {} queued to e-mail {}.'.format(alert_id,
+                                                     out_data['to_email'])
     else:
-        for age_range, heart_rate_threshold in age_heart_rate_dict.items():
-            if age in age_range:
-                if heart_rate > heart_rate_threshold:
-                    return True
-                else:
-                    return False
+        msg = 'Alert {} could not be queued, the alert queue is ' \
+              'full.'.format(alert_id)
+    return msg, alert_id
 
 
 def send_email(in_data):
@@ -602,7 +1443,8 @@ def send_email(in_data):
     This function makes a post request to the email server to simulate the
     process of sending an email with the info provided and return a msg and
     a status code to
-    indicate whether the email was successfully sent
+    indicate whether the email was successfully sent. It waits for the
+    email server, so the routes use queue_email() instead
 
     Args:
         in_data (dict): the input patient data in the format of {
@@ -619,28 +1461,38 @@ def send_email(in_data):
         status (int): code to indicate whether the post request was
         successful (200) or failed (400)
     """
-    # If you have the code to call the e-mail server in its own modular
-    # function, you do not need to have a unit test for that function.
+    return deliver_email(email_content(in_data))
+
+
+def email_content(in_data):
+    """Build the email to the attending physician of a tachycardic patient
+
+    Args:
+        in_data (dict): the input patient data in the format of {
+        "patient_id": <patient_id>,
+        "heart_rate": <heart_rate>,
+        "timestamp": <int>
+        } where both <patient_id> and <heart_rate> can be an int or a string
+        of int and <timestamp> is nanoseconds since EPOCH, as
+        add_new_heart_rate() left it
+
+    Returns:
+        out_data (dict): the json for the email server in the format of {
+        "from_email": <str>, "to_email": <str>, "subject": <str>,
+        "content": <str>}
+    """
     patient_id = int(in_data['patient_id'])  # Already passed the data type
     # check
     heart_rate = int(in_data['heart_rate'])
 
-    attending_physician_username = patient_db[patient_db[
-                                                  'patient_id'] ==
-                                              patient_id][
-        'attending_username'].values[
-        0]  # 1 patient_id has only 1 attending
-    # physician so using [0] is fine
-    attending_email = \
-        physician_db[physician_db['attending_username']
-                     == attending_physician_username][
-            'attending_email'].values[
-            0]  # 1
-    # physician has only 1 email address so using [0] is fine
+    attending_physician_username = patient_db.get(patient_id)[
+        'attending_username']  # 1 patient_id has only 1 attending physician
+    attending_email = physician_db.get(attending_physician_username)[
+        'attending_email']  # 1 physician has only 1 email address
 
     logging.warning(
         'Patient with id {} has a tachycardic heart rate as '
-        '{} bpm. An email has been sent to corresponding '
+        '{} bpm. An email has been queued to corresponding '
         'physician at {}'.format(patient_id,
                                  heart_rate,
                                  attending_email))
@@ -658,15 +1510,77 @@ def send_email(in_data):
                             attending_physician_username,
                             patient_id,
                             heart_rate,
-                            current_time_str)}
+                            epoch_to_time_str(in_data['timestamp']))}
+    return out_data
+
+
+def deliver_email(out_data):
+    """Post 1 email to the email server
 
-    r = requests.post("http://vcm-7631.vm.duke.edu:5007/hrss/send_email",
-                      json=out_data)
-    status = r.status_code
-    msg = r.text
+    Args:
+        out_data (dict): the json built by email_content()
+
+    Returns:
+        msg (str): the answer of the email server
+        status (int): the status code of the email server, 503 if it
+        couldn't be reached or its circuit is open
+    """
+    # If you have the code to call the e-mail server in its own modular
+    # function, you do not need to have a unit test for that function.
+    msg, status = email_client.send(out_data)  # Pooled keep-alive
+    # connections with timeouts and a circuit breaker
     return msg, status
 
 
+email_client = EmailClient(EMAIL_SERVER_URL,
+                           connect_timeout=EMAIL_CONNECT_TIMEOUT,
+                           read_timeout=EMAIL_READ_TIMEOUT,
+                           pool_size=ALERT_WORKERS,
+                           breaker=CircuitBreaker(EMAIL_FAILURE_THRESHOLD,
+                                                  EMAIL_RESET_TIMEOUT))
+alert_outbox = Outbox(ALERT_OUTBOX, ALERT_DEAD_LETTER,
+                      max_attempts=ALERT_MAX_ATTEMPTS)
+alert_queue = AlertQueue(deliver_email, workers=ALERT_WORKERS,
+                         max_depth=ALERT_QUEUE_SIZE, outbox=alert_outbox)
+alert_coalescer = AlertCoalescer(window=ALERT_WINDOW,
+                                 rate=ALERT_BUCKET_RATE,
+                                 capacity=ALERT_BUCKET_SIZE)
+
+
+@app.route("/api/alerts/metrics", methods=["GET"])
+def get_alert_metrics():
+    """Returns the counters of the email sending
+
+    Returns:
+        jsonify(metrics) (json str): {"in_flight": <int>, "sent": <int>,
+        "failed": <int>, "short_circuited": <int>, "circuit": <str>,
+        "queued": <int>, "alerted": <int>, "merged": <int>,
+        "summaries": <int>} where "circuit" is "closed", "open" or
+        "half-open", "queued" is the number of emails waiting in
+        alert_queue and the last 3 count the readings alerted right away,
+        the readings merged and the summaries sent by alert_coalescer
+    """
+    metrics = email_client.metrics()
+    metrics['queued'] = len(alert_queue)
+    metrics.update(alert_coalescer.counters)
+    return jsonify(metrics)
+
+
+@app.route("/api/alerts/<alert_id>", methods=["GET"])
+def get_alert_status(alert_id):
+    """Receives an alert ID and returns whether its email was sent
+
+    Returns:
+        jsonify(result) (json str): {"status": <"queued", "sent",
+        "retrying" or "dead">, "msg": <str>} and 200, or an error message
+        and 400 if the alert ID is unknown
+    """
+    result = alert_queue.result(alert_id)
+    if result is None:
+        return 'This alert_id does not exist.', 400
+    return jsonify(result)
+
+
 def new_heart_rate_type_validate(in_data):
     """Check whether the data type of in_data follows the requirements for
     new heart_rate posting
@@ -705,7 +1619,13 @@ def new_heart_rate_type_validate(in_data):
                        # If type is string, regex matches a string of
                        # number starting with any digit but zero. Also, the
                        # heart_rate can't be a decimal
-                       }
+                       },
+        "timestamp": {'required': False,
+                      'type': 'string',
+                      'regex': TIME_PATTERN,
+                      # When the device measured the heart rate, down to
+                      # the nanosecond
+                      }
     }
 
     judgement, type_msg_list = in_data_type_validate(in_data, scheme)
@@ -719,8 +1639,11 @@ def new_heart_rate_value_validate(in_data):
 
     This function ensures that the values inside in_data make sense.
     In other words, whether the patient_id is already existing in
-    patient_db. It outputs a judgement on whether the in_data is okay to be
-    added into the patient_db heart_rate_history dict and also
+    patient_db and whether a device timestamp is neither ahead of the
+    server clock, see is_future(), nor out of the reorder window of the
+    patient, see is_late(). It outputs a judgement on
+    whether the in_data is okay to be added into the patient_db
+    heart_rate_history dict and also
     value_msg_list that collects all the previous messages so the
     later functions can keep adding in to this list
 
@@ -750,123 +1673,152 @@ def new_heart_rate_value_validate(in_data):
         # checked for whether the value makes sense
         judgment = True
         try:
-            if int(in_data['patient_id']) not in \
-                    patient_db['patient_id'].to_list():
+            if int(in_data['patient_id']) not in patient_db:
                 value_msg_list.append('This patient_id does not exist.')
                 judgment = False
         except (ValueError, Exception):
             raise
 
-        # No need to check on the content of the heart_rate, since patients
-        # can have the same heart_rate.
+        # Patients can have the same heart_rate, but it has to fit in the
+        # small int array that stores the heart_rate_history
+        if int(in_data['heart_rate']) > MAX_HEART_RATE:
+            value_msg_list.append('This heart_rate is out of range.')
+            judgment = False
+
+        if 'timestamp' in in_data:  # The regex let e.g. a 13th month pass
+            try:
+                timestamp = time_str_to_epoch(in_data['timestamp'])
+            except ValueError:
+                value_msg_list.append('This timestamp is not a valid '
+                                      'time.')
+                judgment = False
+            else:  # A device with a wrong clock would become the latest
+                # heart rate and make every later one late, and a device
+                # that retried for too long is out of the reorder window
+                record = patient_db.get(int(in_data['patient_id']))
+                if is_future(timestamp):
+                    value_msg_list.append(FUTURE_MSG)
+                    judgment = False
+                elif record is not None and is_late(record, timestamp):
+                    value_msg_list.append(LATE_MSG)
+                    judgment = False
 
     return judgment, value_msg_list
 
 
-current_time_str = ''  # This global current_time_str will be updated by
-
-
-# add_new_heart_rate() and shared with send_email()
-
+def add_new_heart_rate(in_data, history_dict_exist, tachycardic=None):
+    """Add the new heart rate in_data into patient_db heart_rate_history
 
-def add_new_heart_rate(in_data, history_dict_exist):
-    """Add the new heart rate in_data into patient_db heart_rate_history dict
-
-    This function obtains the current datetime and convert that into a str,
-    which will be used as the key to store the heart_rate. Based on the
-    patient_id, it finds out the row_index of the corresponding patient's
-    row in patient_db, and add the datetime_str:heart_rate pair into the
-    dict stored in the field of heart_rate_history column. If the patient_id
-    or heart_rate is in the format of a str of an int, it also converts
-    those into int to ensure the data types inside patient_db are correct
+    This function timestamps the heart_rate with the "timestamp" of
+    in_data, the time the device measured it, or with reading_clock when
+    there is none, and keeps the timestamp in in_data for the email. Based
+    on the patient_id, it looks up the corresponding patient's record in
+    patient_db, and appends the timestamp and heart_rate into the
+    HeartRateSeries stored in the heart_rate_history field of that record.
+    If the patient_id or heart_rate is in the format of a str of an int, it
+    also converts those into int to ensure the data types inside patient_db
+    are correct.
+    The tachycardia verdict on the heart_rate is recorded in the
+    tachycardia_events index of the record and in the tachycardia_log of
+    patient_db, so the admin report never judges the history again
 
     Args:
         in_data (dict): the input patient data in the format of {
         "patient_id": <patient_id>,
-        "heart_rate": <heart_rate>
+        "heart_rate": <heart_rate>,
+        "timestamp": <timestamp>
         } where both <patient_id> and <heart_rate> can be an int or a string
-        of int
+        of int and the optional <timestamp> is a '%Y-%m-%d %H:%M:%S' str
+        with an optional fraction of a second
 
         history_dict_exist (bool): True if the patient already has a
         previous heart rate record; False if the patient has no previous
         history
 
+        tachycardic (bool): the verdict on the heart_rate if the caller
+        already judged it, otherwise it is judged here
+
     Returns:
-        patient_db (df): the global pandas dataframe (df) that contains all
-        the patient data
+        patient_db (PatientStore): the global store that contains all the
+        patient data
     """
     # Only in_data with the right data types and formats can reach this
     # function so this function simply adds in_data into the patient_db
     global patient_db
-    global current_time_str
 
     # If necessary, convert in_data is a string of int, convert it into int
     # before adding to df
     in_data['patient_id'] = int(in_data['patient_id'])  # Already passed data
     # type check
     in_data['heart_rate'] = int(in_data['heart_rate'])
-
-    current_time_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    row_index = \
-        patient_db.index[
-            patient_db['patient_id'] == in_data['patient_id']].values[
-            0]  # Can use this method because all patient_id are unique
-    if history_dict_exist:
-        patient_db.loc[row_index, 'heart_rate_history'][
-            current_time_str] = in_data[
-            'heart_rate']  # df.loc[] is the correct
-        # method to change the value of a cell in a df
-    else:  # New patient has no previous heart rate history, so this creates
-        # a new dict with the first heart_rate record in that cell
-
-        # A less elegant way of adding a dict in that cell since pd will
-        # complain if directly adding in a dict into a cell
-        patient_db.loc[row_index, 'heart_rate_history'] = [{
-            current_time_str: in_data['heart_rate']}]  # Add in a list of dict
-
-        patient_db['heart_rate_history'] = patient_db[
-            'heart_rate_history'].apply(
-            lambda x: x[0] if type(
-                x) == list else x)  # For cells in column
-        # "heart_rate_history", if the value of a cell is a list,
-        # convert it into a dict; otherwise, keep it as it is
+    in_data['timestamp'] = reading_timestamp(in_data)
+
+    record = patient_db.get(in_data['patient_id'])  # Can use this method
+    # because all patient_id are unique
+    if not history_dict_exist:  # New patient has no previous heart rate
+        # history, so this creates a new series for the first heart_rate
+        record['heart_rate_history'] = HeartRateSeries()
+    if tachycardic is None:
+        tachycardic = tachycardic_judge(record['patient_age'],
+                                        in_data['heart_rate'])
+    patient_db.add_reading(record, in_data['timestamp'],
+                           in_data['heart_rate'], tachycardic)  # Also
+    # records the tachycardia event and refreshes the cached latest reading
+    wal.append({"op": 'heart_rate', "patient_id": in_data['patient_id'],
+                "heart_rate": in_data['heart_rate'],
+                "timestamp": in_data['timestamp']})
 
     return patient_db
 
 
-def sort_heart_rate_history_dict(heart_rate_history_dict):
-    """Sort a dictionary based on the key
+def reading_timestamp(in_data):
+    """The timestamp of the heart rate inside in_data
+
+    Args:
+        in_data (dict): the input patient data, which may have a
+        "timestamp" of when the device measured the heart rate, either as
+        a '%Y-%m-%d %H:%M:%S' str with an optional fraction of a second or
+        already as int nanoseconds since EPOCH
+
+    Returns:
+        (int): nanoseconds since EPOCH of the "timestamp", or a new one from
+        reading_clock if in_data has none
+    """
+    timestamp = in_data.get('timestamp')
+    if timestamp is None:  # Stamped on arrival
+        return reading_clock()
+    if type(timestamp) is str:  # Measured by the device
+        return time_str_to_epoch(timestamp)
+    return int(timestamp)
+
 
-    This function will sort the heart_rate_history_dict by the datetime key
-    such that the latest heart rate record will be the last one of the dict
+def is_late(record, timestamp):
+    """Whether a heart rate came too late to be merged into the history
 
     Args:
-        heart_rate_history_dict (dict): it stores all the
-        datetime_str:heart_rate_int data pairs under the heart_rate_history
-        column inside patient_db
+        record (dict): the record of the patient inside patient_db
+        timestamp (int): nanoseconds since EPOCH of the heart rate
 
     Returns:
-        sorted_date_time_dict (dict): simply a sorted version of the
-        heart_rate_history_dict with the most recent heart rate record as
-        the last data pair in the dict
+        (bool): True if the heart rate is more than MAX_LATENESS seconds
+        older than the latest heart rate of the patient
     """
-    date_time_dict = {}
-    for date_time_str, heart_rate in heart_rate_history_dict.items():
-        date_time_dict[datetime.strptime(date_time_str, '%Y-%m-%d '
-                                                        '%H:%M:%S')] = \
-            heart_rate
+    return bool(PatientStore.late_mask(
+        record, [timestamp], int(MAX_LATENESS * NS_PER_SECOND),
+        now=reading_clock())[0])
 
-    sorted_date_time_dict = dict(sorted(date_time_dict.items()))  # All the
-    # keys in this dict will be datetime object
 
-    sorted_date_time_dict_out = {}
-    for date_time_obj, heart_rate in sorted_date_time_dict.items():
-        sorted_date_time_dict_out[date_time_obj.strftime('%Y-%m-%d '
-                                                         '%H:%M:%S')] = \
-            heart_rate
-    # Now all the keys in sorted_date_time_dict_out are str from the
-    # corresponding datetime object following the format of "%Y-%m-%d %H:%M:%S"
-    return sorted_date_time_dict_out
+def is_future(timestamps):
+    """Whether device timestamps are ahead of the server clock
+
+    Args:
+        timestamps (int or np.ndarray of int64): nanoseconds since EPOCH
+
+    Returns:
+        (bool or np.ndarray of bool): True where the timestamp is more than
+        MAX_CLOCK_SKEW seconds later than reading_clock
+    """
+    return timestamps > reading_clock() + int(MAX_CLOCK_SKEW * NS_PER_SECOND)
 
 
 @app.route('/api/status/<patient_id>', methods=['GET'])
@@ -906,12 +1858,14 @@ def get_patient_status_handler(patient_id):
     # Receive data from the route request
     # patient_id was passed in by parameter
 
-    # Validate inputs
-    value_judgement, value_msg_list = patient_id_value_validate(patient_id)
+    with patient_db.locked(lock_key(patient_id)):
+        # Validate inputs
+        value_judgement, value_msg_list = \
+            patient_id_value_validate(patient_id)
 
-    # Complete tasks
-    out, status = get_patient_status_worker(value_msg_list, value_judgement,
-                                            patient_id)
+        # Complete tasks
+        out, status = get_patient_status_worker(value_msg_list,
+                                                value_judgement, patient_id)
 
     # Return the JSON str and status code back to requestor
     return jsonify(out), status
@@ -963,8 +1917,8 @@ def get_patient_status_worker(value_msg_list, value_judgement, patient_id):
 
         # Whether the patient has at least 1 heart rate measurement in the
         # heart_rate_history dict will be checked inside the next if block
-        # by the line "if type(heart_rate_history) == dict: ". type(
-        # heart_rate_history) won't be dict if that patient has no history
+        # by the line "if heart_rate_history is not None: ". It is None if
+        # that patient has no history
 
         if value_judgement:  # If the patient_id follows the correct data
             # type and exists in the patient_db
@@ -972,43 +1926,27 @@ def get_patient_status_worker(value_msg_list, value_judgement, patient_id):
                 patient_id)  # It's safe to directly do the convert
             # here since both the data type and the content of patient_id has
             # been checked before this line
-            heart_rate_history = patient_db[patient_db['patient_id'] ==
-                                            patient_id][
-                'heart_rate_history'].values[
-                0]  # Using [0] is fine here since each
-            # patient_id has only 1 dict that records all the heart rates or 1
-            # nan for a new patient that has no heart_rate_history yet
-
-            if type(heart_rate_history) == dict:  # This means the patient
-                # has at least 1 heart_rate_history dict already
-
-                # Codes below obtain latest_heart_rate
-                sorted_heart_rate_history = sort_heart_rate_history_dict(
-                    heart_rate_history)
-                sorted_heart_rate_history_list = list(
-                    sorted_heart_rate_history)
-                latest_date_time = sorted_heart_rate_history_list[-1]
-                latest_heart_rate = sorted_heart_rate_history[latest_date_time]
-
-                age = patient_db[patient_db['patient_id'] == patient_id][
-                    'patient_age'].values[0]
-
-                if tachycardic_judge(age, latest_heart_rate):
+            latest = patient_db.get(patient_id)['latest']  # The latest
+            # reading was cached when it was added, or None for a new
+            # patient that has no heart_rate_history yet
+
+            if latest is not None:  # This means the patient
+                # has at least 1 heart rate in the heart_rate_history already
+                if latest['tachycardic']:
                     tachycardic_status = 'tachycardic'
                 else:
                     tachycardic_status = 'not tachycardic'
 
                 out_dict = {
-                    "heart_rate": latest_heart_rate,
+                    "heart_rate": latest['heart_rate'],
                     "status": tachycardic_status,
-                    "timestamp": latest_date_time
+                    "timestamp": epoch_to_time_str(latest['timestamp'])
                 }
 
                 status = 200
 
                 return out_dict, status
-            else:  # This means the patient has no heart_rate_history dict.
-                # Usually the type here is float, because the value is nan
+            else:  # This means the patient has no heart_rate_history dict
                 out_msg_list.append(
                     'This patient has no heart rate history yet.')
 
@@ -1076,8 +2014,7 @@ def patient_id_value_validate(patient_id):
     else:
         judgment = True
         try:
-            if int(patient_id) not in \
-                    patient_db['patient_id'].to_list():
+            if int(patient_id) not in patient_db:
                 value_msg_list.append(
                     'This patient_id does not exist.')
                 judgment = False
@@ -1124,13 +2061,15 @@ def get_heart_rate_list_handler(patient_id):
     # Receive data from the route request
     # patient_id was passed in by parameter
 
-    # Validate inputs
-    value_judgement, value_msg_list = patient_id_value_validate(patient_id)
+    with patient_db.locked(lock_key(patient_id)):
+        # Validate inputs
+        value_judgement, value_msg_list = \
+            patient_id_value_validate(patient_id)
 
-    # Complete tasks
-    out, status = get_heart_rate_list_worker(value_msg_list,
-                                             value_judgement,
-                                             patient_id)
+        # Complete tasks
+        out, status = get_heart_rate_list_worker(value_msg_list,
+                                                 value_judgement,
+                                                 patient_id)
 
     # Return the JSON str and status code back to requestor
     return jsonify(out), status
@@ -1181,8 +2120,8 @@ def get_heart_rate_list_worker(value_msg_list, value_judgement,
 
         # Whether the patient has at least 1 heart rate measurement in the
         # heart_rate_history dict will be checked inside the next if block
-        # by the line "if type(heart_rate_history) == dict: ". type(
-        # heart_rate_history) won't be dict if that patient has no history
+        # by the line "if heart_rate_history is not None: ". It is None if
+        # that patient has no history
 
         if value_judgement:  # If the patient_id follows the correct data
             # type and exists in the patient_db
@@ -1190,27 +2129,20 @@ def get_heart_rate_list_worker(value_msg_list, value_judgement,
                 patient_id)  # It's safe to directly do the convert
             # here since both the data type and the content of patient_id has
             # been checked before this line
-            heart_rate_history = patient_db[patient_db['patient_id'] ==
-                                            patient_id][
-                'heart_rate_history'].values[
-                0]  # Using [0] is fine here since each
-            # patient_id has only 1 dict that records all the heart rates or 1
-            # nan for a new patient that has no heart_rate_history yet
-
-            if type(heart_rate_history) == dict:  # This means the patient
-                # has a heart_rate_history dict already
-                sorted_heart_rate_history = sort_heart_rate_history_dict(
-                    heart_rate_history)
-
-                out_list = list(
-                    sorted_heart_rate_history.values())  # Convert the dict's
-                # values into a list
+            heart_rate_history = patient_db.get(patient_id)[
+                'heart_rate_history']  # Each patient_id has only 1 series
+            # that records all the heart rates or None for a new patient
+            # that has no heart_rate_history yet
+
+            if heart_rate_history is not None:  # This means the patient
+                # has a heart_rate_history series already
+                out_list = heart_rate_history.heart_rates().tolist()  #
+                # tolist() gives int rather than np.int16 for jsonify
 
                 status = 200
 
                 return out_list, status
-            else:  # This means the patient has no heart_rate_history dict.
-                # Usually the type here is float, because the value is nan
+            else:  # This means the patient has no heart_rate_history dict
                 out_msg_list.append(
                     'This patient has no heart rate history yet.')
 
@@ -1245,14 +2177,18 @@ def post_new_attending():
 
         status (int): 200 if the attending data was successfully added into
         patient_db; 400 if the input physician data has some issues that need
-        to be fixed and request again
+        to be fixed and request again; 503 if wal could not write it to disk
     """
     in_data = request.get_json()
 
-    value_judgement, value_msg_list = new_attending_value_validate(in_data)
+    with physician_db.registry_lock.write():
+        value_judgement, value_msg_list = \
+            new_attending_value_validate(in_data)
 
-    out_msg, status = post_new_attending_worker(value_msg_list,
-                                                value_judgement, in_data)
+        out_msg, status = post_new_attending_worker(value_msg_list,
+                                                    value_judgement, in_data)
+    if not wal.sync():  # Answer only once the new physician is on disk
+        return WAL_FAILED_MSG, 503
 
     return out_msg, status
 
@@ -1399,8 +2335,7 @@ def new_attending_value_validate(in_data):
         # checked for whether the value makes sense
         judgment = True
         try:
-            if in_data['attending_username'] in \
-                    list(physician_db['attending_username']):
+            if in_data['attending_username'] in physician_db:
                 value_msg_list.append(
                     'Physician already exists in physician '
                     'database.')
@@ -1414,9 +2349,9 @@ def new_attending_value_validate(in_data):
 def add_new_attending(in_data):
     """Add the new attending in_data into attending_db
 
-    This function converts the in_data (now has data in correct data types
-    and values) into a df and concatenate that df with the original
-    physician_db.
+    This function adds the in_data (now has data in correct data types
+    and values) as a new record of physician_db keyed by its
+    attending_username.
 
     Args:
         in_data (dict): the input patient data in the format of {
@@ -1425,13 +2360,16 @@ def add_new_attending(in_data):
             "attending_email": <str>}
 
     Returns:
-        physician_db (df): the global pandas dataframe (df) that contains all
+        physician_db (PhysicianStore): the global store that contains all
         the attending data
     """
     global physician_db
 
-    in_data_df = pd.DataFrame(in_data, index=[0])
-    physician_db = pd.concat([physician_db, in_data_df], ignore_index=True)
+    physician_db.add(in_data)
+    wal.append({"op": 'attending',
+                "attending_username": in_data['attending_username'],
+                "attending_email": in_data['attending_email'],
+                "attending_phone": in_data['attending_phone']})
 
     return physician_db
 
@@ -1447,16 +2385,31 @@ def get_avg_heart_rate(patient_id):
     it validates whether the input data is valid in data types and formats
     and if so, it then checks if the patient_id exists on the patient_db. If
     it exists, it retrieves the heart rate history of the patient from the
-    patient_db and calculates the average heart rate.
+    patient_db and calculates the average heart rate. With the query string
+    '?stats=true', it returns the mean, std, min and max heart rate instead.
 
     Returns:
         jsonify(hr_avg) (json str): a json string with the average heart rate
+        or with the dictionary of statistics
     """
+    stats = request.args.get('stats', '').lower() in ('1', 'true', 'yes')
 
-    value_judgement, value_msg_list = pat_id_value_validate(patient_id)
+    with patient_db.locked(lock_key(patient_id)):
+        value_judgement, value_msg_list = pat_id_value_validate(patient_id)
 
-    hr_avg, out_msg, status = avg_hr_worker(value_msg_list,
-                                            value_judgement, patient_id)
+        if stats:
+            hr_stats, out_msg, status = stats_hr_worker(value_msg_list,
+                                                        value_judgement,
+                                                        patient_id)
+        else:
+            hr_avg, out_msg, status = avg_hr_worker(value_msg_list,
+                                                    value_judgement,
+                                                    patient_id)
+
+    if stats:
+        if status == 400:
+            return out_msg, status
+        return jsonify(hr_stats)
 
     if hr_avg == 0:
         return out_msg, status
@@ -1508,6 +2461,55 @@ def avg_hr_worker(value_msg_list, value_judgement, patient_id):
     return int(hr_avg), out_msg, status
 
 
+def stats_hr_worker(value_msg_list, value_judgement, patient_id):
+    """The real working function that gets the heart rate statistics for
+    requested patient, if information exists on the patient_db.
+
+    Based on the value_judgement, this function decides whether to get the
+    statistics. If judgement is true, it retrieves the heart rate history
+    series from the patient_db for the corresponding patient_id and reads
+    the statistics from its running aggregates without a scan.
+
+    Args:
+        value_msg_list (list of str): a list collecting all the problems from
+        the previous checks, if there's any
+
+        value_judgement (bool): whether the in_data has passed the previous
+        checks
+
+        patient_id (<int> or <str>): input patient_id
+
+    Returns:
+        hr_stats (dict): {"count": <int>, "mean": <float>, "std": <float>,
+        "min": <int>, "max": <int>}, or an empty dict if the checks failed
+
+        out_msg (str): concatenated all the str inside out_msg_list
+
+        status (int): 200 if the validations were successful, and 400
+        if not
+    """
+    out_msg_list = value_msg_list
+    hr_stats = {}
+
+    if value_judgement:
+        hr_dict = hr_dict_retriever(patient_id)
+        if hr_dict is None:
+            out_msg_list.append('This patient has no heart rate history '
+                                'yet.')
+            status = 400
+        else:
+            hr_stats = hr_dict.stats()
+            status = 200
+    else:
+        out_msg_list.append("Fix and request "
+                            "again.")
+        status = 400
+
+    out_msg = '\n'.join(out_msg_list)
+
+    return hr_stats, out_msg, status
+
+
 def pat_id_type_validate(patient_id):
     """Check whether the data type of patient_id follows the requirements
 
@@ -1573,8 +2575,7 @@ def pat_id_value_validate(patient_id):
     else:
         judgment = True
         try:
-            if int(patient_id) not in \
-                    patient_db['patient_id'].to_list():
+            if int(patient_id) not in patient_db:
                 value_msg_list.append('This patient_id is not present.')
                 judgment = False
         except (ValueError, Exception):
@@ -1584,9 +2585,9 @@ def pat_id_value_validate(patient_id):
 
 
 def hr_dict_retriever(patient_id):
-    """Retrieves the heart rate history dictionary from patient_db
+    """Retrieves the heart rate history series from patient_db
 
-    This function retrieves the heart rate history dictionary for the
+    This function retrieves the heart rate history series for the
     patient_id that is provided as input.
 
     Args:
@@ -1594,38 +2595,32 @@ def hr_dict_retriever(patient_id):
         in patient_db
 
     Returns:
-        hr_dict (dict): Dictionary containing heart rate history of the patient
-        corresponding to the input patient_id
+        hr_dict (HeartRateSeries): Series containing heart rate history of
+        the patient corresponding to the input patient_id
     """
     global patient_db
 
     patient_id = int(patient_id)
-    pat = patient_db.loc[patient_db['patient_id'] == patient_id]
-    ind = pat.index
-    hr_dict = pat.loc[ind[0], 'heart_rate_history']
+    hr_dict = patient_db.get(patient_id)['heart_rate_history']
 
     return hr_dict
 
 
 def avg_hr(hr_dict):
     """Calculates the average heart rate given the heart rate history
-    dictionary
+    series
 
-    Retrieves the values from the input heart rate history dictionary which
-    contains the heart rates, and calculates the average.
+    Reads the average from the running sum that the input heart rate
+    history series keeps up to date, so no heart rate is summed again.
 
     Args:
-        hr_dict (dict): Dictionary containing heart rate history of the patient
-        corresponding to the input patient_id
+        hr_dict (HeartRateSeries): Series containing heart rate history of
+        the patient corresponding to the input patient_id
 
     Returns:
-        avg (float): average heart rate from the dictionary
+        avg (float): average heart rate from the series
     """
-    res = 0
-    for val in hr_dict.values():
-        res += val
-
-    avg = res / len(hr_dict)
+    avg = hr_dict.mean()
 
     return avg
 
@@ -1639,15 +2634,21 @@ def post_hr_interval_avg():
     '/api/heart_rate/interval_average' It receives a dictionary
     containing the patient_id and the time since when the
     average heart rate is requested, which is input as a datetime object.
+    An optional "heart_rate_average_until" closes the window, so only the
+    heart rates measured before it are averaged.
 
     Returns:
         jsonify(hr_avg1): json string containing the average heart rate value
     """
     in_data = request.get_json()
+    patient_id = in_data.get('patient_id') if type(in_data) is dict \
+        else None
 
-    judgement, msg_list = hr_pat_id_value_validate(in_data)
+    with patient_db.locked(lock_key(patient_id)):
+        judgement, msg_list = hr_pat_id_value_validate(in_data)
 
-    hr_avg, out_msg, status = hr_interval_worker(judgement, msg_list, in_data)
+        hr_avg, out_msg, status = hr_interval_worker(judgement, msg_list,
+                                                     in_data)
 
     if status == 400:
         return out_msg, status
@@ -1664,9 +2665,9 @@ def hr_interval_worker(judgement, msg_list, in_data):
     Based on the value_judgement, this function decides whether to calculate
     the average heart rate. If the judgement is True, it retrieves
     the heart rate history of the patient corresponding to the
-    patient_id. It then compares the datetime stamps in the
-    dictionary to retrieve the heart rates of days since the
-    given time input. It then calculates the average heart rate.
+    patient_id. It then binary searches the time window in the sorted
+    timestamps of the series and calculates the average heart rate from
+    its prefix sums, so the cost is O(log n) for any window.
 
     Args:
         value_msg_list (list of str): a list collecting all the problems from
@@ -1677,29 +2678,33 @@ def hr_interval_worker(judgement, msg_list, in_data):
 
         in_data (dict): the input patient data in the format of {
         "patient_id": <patient_id>,
-        "heart_rate_average_since": <heart_rate_average_since>
+        "heart_rate_average_since": <heart_rate_average_since>,
+        "heart_rate_average_until": <heart_rate_average_until>
         } where <patient_id> is an int or str and <heart_rate_avg_since>
-        is a datetime object.
+        is a datetime object. <heart_rate_average_until> is optional.
 
     Returns:
+        hr_avg (float): the average heart rate inside the window, 0 if
+        there is no heart rate inside it
+
         out_msg (str): concatenated all the str inside out_msg_list
 
         status (int): 200 if heart rate dictionary was retrieved, and
         400 if not
     """
     out_msg_list = msg_list
+    hr_avg = 0
 
     if judgement:
         patient_id = in_data['patient_id']
         hr_dict = hr_dict_retriever(patient_id)
-        hr_list = hr_list_since_retriever(hr_dict, in_data)
-        if len(hr_list) == 0:
+        since, until = hr_interval_retriever(in_data)
+        if hr_dict is not None:
+            hr_avg = hr_dict.window_mean(since, until)
+        if hr_dict is None or hr_avg is None:
             out_msg_list.append("No heart rates since given time")
-            status = 200
             hr_avg = 0
-        else:
-            hr_avg = avg_hr_since(hr_list)
-            status = 200
+        status = 200
     else:
         out_msg_list.append("Fix and request "
                             "again.")
@@ -1710,60 +2715,32 @@ def hr_interval_worker(judgement, msg_list, in_data):
     return hr_avg, out_msg, status
 
 
-def avg_hr_since(hr_list):
-    """Calculates the average heart rate given the heart rate since
+def hr_interval_retriever(in_data):
+    """Retrieves the time window that the average is requested for
 
-    Takes the heart rates in the input list and calculates the average.
+    Only the input times are parsed, the series already keeps every
+    timestamp as epoch seconds in time order.
 
     Args:
-        hr_dict (list): List containing the heart rates since the time input
-
-    Returns:
-        avg (float): average heart rate from the list
-    """
-    res = 0
-    for val in hr_list:
-        res += val
-
-    avg = res / len(hr_list)
-
-    return avg
-
-
-def hr_list_since_retriever(dct, in_data):
-    """Retrieves heart rate in a list that fit the requirement
-
-    Receives the heart rate history dictionary and retrieves the heart rates
-    as a list that occur after the datetime input.
-
-    Args:
-        dct (dict): Dictionary containing heart rate history of the patient
-
         in_data (dict): the input patient data in the format of {
         "patient_id": <patient_id>,
-        "heart_rate_average_since": <heart_rate_average_since>
+        "heart_rate_average_since": <heart_rate_average_since>,
+        "heart_rate_average_until": <heart_rate_average_until>
         } where <patient_id> is an int or str and <heart_rate_avg_since>
-        is a datetime object.
+        is a datetime object. <heart_rate_average_until> is optional.
 
     Returns:
-        hr_list (list): heart rates list that occur after the input time
-    """
-    sorted_dict = sort_heart_rate_history_dict(dct)
-    time_stamps = list(sorted_dict.keys())
-    hrs = list(sorted_dict.values())
-
-    date_string = in_data['heart_rate_average_since']
-    date_format = '%Y-%m-%d %H:%M:%S'
-    a = datetime.strptime(date_string, date_format)
-    hr_list = []
+        since (int): nanoseconds since EPOCH, the heart rates must be later
 
-    for (i, j) in zip(time_stamps, hrs):
-        i_obj = datetime.strptime(i, date_format)
-        c = a - i_obj
-        if c.days < 0:
-            hr_list.append(j)
+        until (int): nanoseconds since EPOCH, the heart rates must be earlier,
+        or None if there's no upper bound
+    """
+    since = time_str_to_epoch(in_data['heart_rate_average_since'])
+    until = in_data.get('heart_rate_average_until')
+    if until is not None:
+        until = time_str_to_epoch(until)
 
-    return hr_list
+    return since, until
 
 
 def hr_pat_id_value_validate(in_data):
@@ -1793,8 +2770,7 @@ def hr_pat_id_value_validate(in_data):
     else:
         judgment = True
         try:
-            if int(in_data['patient_id']) not in \
-                    patient_db['patient_id'].to_list():
+            if int(in_data['patient_id']) not in patient_db:
                 value_msg_list.append('This patient_id is not present.')
                 judgment = False
         except (ValueError, Exception):
@@ -1808,7 +2784,8 @@ def hr_interval_type_validate(in_data):
 
     This function, by using the cerberus package, ensures that in_data is a
     dict that has "patient_id" as an int or a str of an int,
-    and "heart_rate_average_since" as datetime object.
+    and "heart_rate_average_since" as datetime object, and the optional
+    "heart_rate_average_until" as datetime object too.
     If a field didn't follow the correct, it adds the error msg into the
     type_msg_list and outputs it so later functions can keep adding msg on
     this list
@@ -1837,6 +2814,10 @@ def hr_interval_type_validate(in_data):
                        'regex': '^[0-9][0-9]*$',
                        },
         "heart_rate_average_since": {'required': True,
+                                     'type': 'datetime',
+                                     'coerce': to_date,
+                                     },
+        "heart_rate_average_until": {'required': False,
                                      'type': 'datetime',
                                      'coerce': to_date,
                                      }
@@ -1874,11 +2855,13 @@ def get_pat_list(attending_username):
         containing information of the corresponding patients.
     """
     usr_name = attending_username
-    judgement, msg_list = att_usr_value_validate(usr_name)
+    with physician_db.registry_lock.read(), \
+            patient_db.registry_lock.read():
+        judgement, msg_list = att_usr_value_validate(usr_name)
 
-    pat_data, out_msg, status = pat_list_att_worker(msg_list,
-                                                    judgement,
-                                                    usr_name)
+        pat_data, out_msg, status = pat_list_att_worker(msg_list,
+                                                        judgement,
+                                                        usr_name)
 
     if status == 400:
         return out_msg, status
@@ -1890,10 +2873,12 @@ def pat_list_att_worker(msg_list, judgement, usr_name):
     """The real working function that returns the list of dictionaries
     containing patient info.
 
-    Based on the value_judgement, proceeds to first find the indices of
-    the patients matching the attending_username. It then puts each
-    patient's id, last heart rate recording, the time stamp of the last
-    recording, and whether this latest heart rate is tachycardic
+    Based on the value_judgement, proceeds to first find the records of
+    the patients of the attending_username from the attending index. It
+    then puts each patient's id, last heart rate recording, the time stamp
+    of the last recording, and whether this latest heart rate is
+    tachycardic from the cached latest reading. Patients without any heart
+    rate yet are left out
 
     Args:
         value_msg_list (list of str): a list collecting all the problems from
@@ -1916,33 +2901,27 @@ def pat_list_att_worker(msg_list, judgement, usr_name):
     pat_data = []
 
     if judgement:
-        pat = patient_db.loc[patient_db['attending_username'] == usr_name]
-        ind = pat.index
-        if len(ind) == 0:
+        pat = patient_db.patients_of(usr_name)  # Only this attending's
+        # patients from the attending index
+        if len(pat) == 0:
             pat_data = []
             status = 200
         else:
-            for i in ind:
+            for record in pat:
+                latest = record['latest']
+                if latest is None:  # No heart rate to report yet
+                    continue
                 dct = {}
-                hr_dict = pat.loc[i, 'heart_rate_history']
-                sorted_dict = sort_heart_rate_history_dict(hr_dict)
-                hrs = list(sorted_dict.values())
-                times = list(sorted_dict.keys())
-                latest_time = times[-1]
-                latest_hr = hrs[-1]
-                age = pat.loc[i, 'patient_age']
-                id = pat.loc[i, 'patient_id']
-                a = tachycardic_judge(age, latest_hr)
-                if a:
+                if latest['tachycardic']:
                     b = "tachycardic"
                 else:
                     b = "not tachycardic"
-                dct['patient_id'] = id
-                dct['last_heart_rate'] = latest_hr
-                dct['last_time'] = latest_time
+                dct['patient_id'] = record['patient_id']
+                dct['last_heart_rate'] = latest['heart_rate']
+                dct['last_time'] = epoch_to_time_str(latest['timestamp'])
                 dct['status'] = b
                 pat_data.append(dct)
-                status = 200
+            status = 200
     else:
         out_msg_list.append("Fix and request "
                             "again.")
@@ -2019,8 +2998,7 @@ def att_usr_value_validate(usr_name):
         # checked for whether the value makes sense
         judgment = True
         try:
-            if usr_name not in \
-                    list(physician_db['attending_username']):
+            if usr_name not in physician_db:
                 value_msg_list.append(
                     'No matching attending physician from physician '
                     'database.')
@@ -2049,11 +3027,15 @@ def admin_register_handler():
 
         status (interger):
         Status code of the processing result. The code for Successful
-        process is 200 and failed process is 400
+        process is 200 and failed process is 400. It is 503 when the new
+        administrator could not be written to disk
     '''
     global admin_db
     in_data = request.get_json()
-    message, status, admin_db = check_admin_register(in_data, admin_db)
+    with admin_lock:
+        message, status, admin_db = check_admin_register(in_data, admin_db)
+    if not wal.sync():  # Answer only once the new administrator is on disk
+        return WAL_FAILED_MSG, 503
     return message, status
 
 
@@ -2129,6 +3111,8 @@ def check_admin_register(in_data, admin):
             message = check_pwd(pwd)
             if message == 'pass':
                 admin.loc[len(admin.index)] = [usr, pwd]
+                wal.append({"op": 'admin', "admin_username": usr,
+                            "admin_password": pwd})
                 message = "Successfully added new administrator information"
                 status = 200
             else:
@@ -2194,7 +3178,9 @@ def attending_handler():
 
     '''
     in_admin = request.get_json()
-    info, status = attending_process(in_admin, physician_db, admin_db)
+    with physician_db.registry_lock.read():
+        physician = physician_db.to_frame()
+    info, status = attending_process(in_admin, physician, admin_db)
     return jsonify(info), status
 
 
@@ -2337,7 +3323,9 @@ def admin_patients_handler():
 
     '''
     in_admin = request.get_json()
-    info, status = patient_process(in_admin, admin_db, patient_db)
+    with patient_db.registry_lock.read():
+        patient = patient_db.to_frame()
+    info, status = patient_process(in_admin, admin_db, patient)
     return jsonify(info), status
 
 
@@ -2428,11 +3416,403 @@ def admin_tachycardia_handler():
 
     '''
     in_admin = request.get_json()
-    info, status = tachycardia_process(in_admin, patient_db, physician_db,
-                                       admin_db)
+    with physician_db.registry_lock.read(), \
+            patient_db.registry_lock.read():
+        info, status = tachycardia_process(in_admin, patient_db,
+                                           physician_db, admin_db)
     return jsonify(info), status
 
 
+@app.route("/api/admin/alerts", methods=["POST"])
+def admin_alerts_handler():
+    '''Handler function for inspecting the tachycardia alerts
+
+    This function takes the administrator information and returns the
+    alerts still waiting in the outbox and the alerts in the dead-letter
+    file, or error messages
+
+    Returns:
+    info (string or dictionary):
+    Error messages or the alerts in the format of
+    {"pending": [{"alert_id": <str>, "payload": <dict>, "attempts": <int>}],
+     "dead": [{"alert_id": <str>, "payload": <dict>, "attempts": <int>,
+               "msg": <str>, "status": <int>}]}
+
+    status (integer):
+    Status code. The value is 200 for correct administrator information,
+    401 for incorrect administrator information, and 400 for other errors
+    '''
+    in_admin = request.get_json()
+    info, status = alerts_process(in_admin, alert_outbox, admin_db)
+    return jsonify(info), status
+
+
+def alerts_process(in_admin, outbox, adminP):
+    '''List the pending and dead tachycardia alerts
+
+    Args:
+    in_admin (dictionary):
+    Administrator information provided by the user in the format of
+    {"admin_username": <admin_username_as_str>,
+     "admin_password:": <password_as_str>}
+
+    outbox (Outbox):
+    The outbox of the tachycardia alerts
+
+    adminP (DataFrame):
+    Dataframe with administrator information with the format of
+    admin_username, admin_password
+    <usr string>, <pwd string>
+    ...
+
+    Returns:
+    info (string or dictionary):
+    Error messages or the pending and dead alerts
+
+    status (integer):
+    Status code. The value is 200 for correct administrator information,
+    401 for incorrect administrator information, and 400 for other errors
+    '''
+    if type(in_admin) is not dict:
+        info = "Wrong input data type"
+        status = 400
+        return info, status
+    if len(in_admin) != 2:
+        info = "Wrong input dictionary"
+        status = 400
+        return info, status
+    flag = check_admin(in_admin, adminP)
+    if flag != 'pass':
+        if flag in ["Wrong password", "Invalid username"]:
+            status = 401
+        else:
+            status = 400
+        info = flag
+    else:
+        info = {'pending': outbox.list_pending(),
+                'dead': outbox.dead_letters()}
+        status = 200
+    return info, status
+
+
+@app.route("/api/admin/alerts/replay", methods=["POST"])
+def admin_alerts_replay_handler():
+    '''Handler function for replaying the dead tachycardia alerts
+
+    This function takes the administrator information and an optional list
+    of alert IDs, and moves those dead alerts (or all of them) back into
+    the outbox to be sent again
+
+    Returns:
+    info (string or list):
+    Error messages or the IDs of the replayed alerts
+
+    status (integer):
+    Status code. The value is 200 for correct administrator information,
+    401 for incorrect administrator information, and 400 for other errors
+    '''
+    in_admin = request.get_json()
+    info, status = alerts_replay_process(in_admin, alert_outbox, admin_db)
+    if status == 200 and len(info) != 0:
+        alert_queue.start()  # The retry thread sends them
+    return jsonify(info), status
+
+
+def alerts_replay_process(in_admin, outbox, adminP):
+    '''Replay the dead tachycardia alerts
+
+    Args:
+    in_admin (dictionary):
+    Administrator information provided by the user in the format of
+    {"admin_username": <admin_username_as_str>,
+     "admin_password:": <password_as_str>,
+     "alert_ids": <list of str>}
+    where "alert_ids" is optional and all the dead alerts are replayed
+    without it
+
+    outbox (Outbox):
+    The outbox of the tachycardia alerts
+
+    adminP (DataFrame):
+    Dataframe with administrator information with the format of
+    admin_username, admin_password
+    <usr string>, <pwd string>
+    ...
+
+    Returns:
+    info (string or list):
+    Error messages or the IDs of the replayed alerts
+
+    status (integer):
+    Status code. The value is 200 for correct administrator information,
+    401 for incorrect administrator information, and 400 for other errors
+    '''
+    if type(in_admin) is not dict:
+        info = "Wrong input data type"
+        status = 400
+        return info, status
+    alert_ids = in_admin.get('alert_ids')
+    if len(in_admin) != (2 if alert_ids is None else 3):
+        info = "Wrong input dictionary"
+        status = 400
+        return info, status
+    if alert_ids is not None and (
+            type(alert_ids) is not list or
+            any(type(a) is not str for a in alert_ids)):
+        info = "alert_ids must be a list of strings"
+        status = 400
+        return info, status
+    flag = check_admin(in_admin, adminP)
+    if flag != 'pass':
+        if flag in ["Wrong password", "Invalid username"]:
+            status = 401
+        else:
+            status = 400
+        info = flag
+    else:
+        info = outbox.replay(alert_ids)
+        status = 200
+    return info, status
+
+
+@app.route("/api/admin/import/heart_rates", methods=["POST"])
+def admin_import_handler():
+    '''Handler function for the bulk import of historical heart rates
+
+    The body is the data itself, a CSV file with a "patient_id",
+    "heart_rate", "timestamp" header (Content-Type text/csv) or
+    newline-delimited JSON records (application/x-ndjson) in the format of
+    '/api/heart_rate/batch', usually sent with chunked transfer encoding.
+    So the administrator signs in with HTTP basic auth instead of the JSON
+    body of the other admin routes. The body is parsed as it arrives and
+    the progress of heart_rate_import_worker() is streamed back
+
+    Returns:
+    info (Response or string):
+    The streamed lines of heart_rate_import_worker(), or an error message
+
+    status (integer):
+    Status code. The value is 200 for correct administrator information,
+    401 for incorrect or missing administrator information, and 400 for
+    other errors
+    '''
+    info, status = import_admin_process(request.authorization, admin_db)
+    if status != 200:
+        return jsonify(info), status
+    if request.mimetype == 'text/csv':
+        records = iter_csv(request.stream)
+    elif request.mimetype == 'application/x-ndjson':
+        records = iter_ndjson(request.stream)
+    else:
+        return jsonify('The body must be text/csv or '
+                       'application/x-ndjson'), 400
+    return Response(stream_with_context(heart_rate_import_worker(records)),
+                    mimetype='application/x-ndjson')
+
+
+def import_admin_process(auth, adminP):
+    '''Check the administrator of a bulk import
+
+    Args:
+    auth (Authorization or None):
+    The HTTP basic auth of the request, None if it has none
+
+    adminP (DataFrame):
+    Dataframe with administrator information with the format of
+    admin_username, admin_password
+    <usr string>, <pwd string>
+    ...
+
+    Returns:
+    info (string):
+    "pass" or the error message
+
+    status (integer):
+    Status code. The value is 200 for correct administrator information,
+    401 for incorrect or missing administrator information, and 400 for
+    other errors
+    '''
+    if auth is None or auth.username is None:
+        info = "Sign in as an administrator with HTTP basic auth"
+        status = 401
+        return info, status
+    flag = check_admin({"admin_username": auth.username,
+                        "admin_password": auth.password or ''}, adminP)
+    if flag in ["Wrong password", "Invalid username"]:
+        status = 401
+    elif flag != 'pass':
+        status = 400
+    else:
+        status = 200
+    return flag, status
+
+
+def heart_rate_import_worker(records, chunk_rows=IMPORT_CHUNK_ROWS,
+                             test_mode=False, clock=time.perf_counter):
+    """Import a feed of historical heart rates in chunks
+
+    The feed is cut into chunks of chunk_rows heart rates. Every chunk is
+    validated column by column by heart_rate_records_validate() and its
+    good heart rates are added by import_heart_rates(), patient by patient
+    in bulk, with 1 fsync of wal per chunk. Historical heart rates are
+    backfilled however old they are, so MAX_LATENESS doesn't apply, and
+    no alert is raised while the chunks go in. At the end, every patient
+    whose latest heart rate came from the import and is tachycardic and no
+    older than MAX_LATENESS gets 1 alert for it, so months of history never
+    flood the physicians with emails
+
+    Args:
+        records (iterable of tuple): (seq, in_data, error) of every row,
+        see iter_ndjson() and iter_csv()
+
+        chunk_rows (int): heart rates per chunk
+
+        test_mode (bool): default to be False. True only when used for unit
+        testing, so the heart rates are taken back out after every chunk
+        and no email is queued
+
+        clock (callable): returns the time in seconds
+
+    Returns:
+        (generator of str): JSON lines, {"seq": <seq>, "status": 400, "msg":
+        <str>} for a rejected heart rate, {"rows": <int>, "added": <int>,
+        "rejected": <int>, "rows_per_second": <float>} after every chunk and
+        at the end the same fields with "alerts": <int>, "seconds": <float>
+        and "done": true. If wal fails, the import stops with {"status":
+        503, "msg": <str>, "done": true}
+    """
+    start = clock()
+    rows = added = 0
+    updated = set()  # The patients whose latest heart rate was imported
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, chunk_rows))
+        if len(chunk) == 0:
+            break
+        rows += len(chunk)
+        good = [(seq, in_data) for seq, in_data, error in chunk
+                if error is None]
+        for seq, _, error in chunk:
+            if error is not None:
+                yield json.dumps({"seq": seq, "status": 400,
+                                  "msg": error + '\nFix and request '
+                                                 'again.'}) + '\n'
+        if len(good) != 0:
+            with physician_db.registry_lock.read(), \
+                    patient_db.registry_lock.read():
+                readings = heart_rate_records_validate(
+                    [in_data for _, in_data in good])
+                updated.update(import_heart_rates(readings, test_mode))
+            if not wal.sync():  # 1 fsync for the whole chunk
+                yield json.dumps({"status": 503, "msg": WAL_FAILED_MSG,
+                                  "done": True}) + '\n'
+                return
+            for (seq, _), msg in zip(good, readings['msg']):
+                if msg == '':
+                    added += 1
+                else:
+                    yield json.dumps({"seq": seq, "status": 400,
+                                      "msg": msg + '\nFix and request '
+                                                   'again.'}) + '\n'
+        yield json.dumps({"rows": rows, "added": added,
+                          "rejected": rows - added,
+                          "rows_per_second": rows / max(clock() - start,
+                                                        1e-9)}) + '\n'
+    alerts = raise_import_alerts(updated, test_mode)
+    seconds = clock() - start
+    yield json.dumps({"rows": rows, "added": added, "rejected": rows - added,
+                      "rows_per_second": rows / max(seconds, 1e-9),
+                      "alerts": alerts, "seconds": seconds,
+                      "done": True}) + '\n'
+
+
+def import_heart_rates(readings, test_mode=False):
+    """Add the good heart rates of 1 chunk of an import, patient by patient
+
+    The caller holds the read side of the registry locks
+
+    Args:
+        readings (pd.DataFrame): the records from
+        heart_rate_records_validate()
+
+        test_mode (bool): default to be False. True only when used for unit
+        testing, so the heart rates are taken back out of the histories
+
+    Returns:
+        updated (list of int): the patient_ids whose latest heart rate is
+        now one of the readings
+    """
+    good = (readings['msg'] == '').to_numpy()
+    patient_ids = readings['patient_id'].to_numpy()[good]
+    heart_rates = readings['heart_rate'].to_numpy()[good]
+    timestamps = readings['timestamp'].to_numpy()[good]
+
+    updated = []
+    order = np.argsort(patient_ids, kind='stable')  # Stable keeps the order
+    # of the feed inside every patient, so the last of 2 heart rates with
+    # the same timestamp wins
+    firsts = np.flatnonzero(np.diff(patient_ids[order])) + 1
+    for rows in np.split(order, firsts):
+        if len(rows) == 0:
+            continue
+        patient_id = int(patient_ids[rows[0]])
+        record = patient_db.get(patient_id)
+        with patient_db.patient_locks.for_key(patient_id):
+            latest_before = record['latest']
+            if test_mode is True:
+                history_before = record['heart_rate_history']
+                if history_before is not None:
+                    history_before = history_before.copy()
+            patient_db.add_readings(record, timestamps[rows],
+                                    heart_rates[rows])
+            if latest_before is None or \
+                    record['latest']['timestamp'] > \
+                    latest_before['timestamp']:
+                updated.append(patient_id)
+            if test_mode is False:
+                wal.append({"op": 'heart_rates', "patient_id": patient_id,
+                            "heart_rates": heart_rates[rows].tolist(),
+                            "timestamps": timestamps[rows].tolist()})
+            else:  # Take the heart rates back out after unit testing
+                record['heart_rate_history'] = history_before
+                record['latest'] = latest_before
+                patient_db.index_tachycardia(record)
+    return updated
+
+
+def raise_import_alerts(patient_ids, test_mode=False):
+    """Raise the alerts an import deferred
+
+    Args:
+        patient_ids (iterable of int): the patients whose latest heart rate
+        was imported
+
+        test_mode (bool): default to be False. Passed on to raise_alert()
+
+    Returns:
+        count (int): the number of alerts raised
+    """
+    oldest = datetime_to_epoch(datetime.now()) - \
+        int(MAX_LATENESS * NS_PER_SECOND)
+    count = 0
+    deferred = []  # The alerts are queued after the locks
+    with physician_db.registry_lock.read(), patient_db.registry_lock.read():
+        for patient_id in sorted(patient_ids):
+            with patient_db.patient_locks.for_key(patient_id):
+                record = patient_db.get(patient_id)
+                latest = None if record is None else record['latest']
+            if latest is None or not latest['tachycardic'] or \
+                    latest['timestamp'] < oldest:
+                continue
+            raise_alert({"patient_id": patient_id,
+                         "heart_rate": latest['heart_rate'],
+                         "timestamp": latest['timestamp']}, record,
+                        test_mode, deferred)
+            count += 1
+    submit_alerts(deferred)
+    return count
+
+
 #  Test could be done by importing globs or pass globs as a parameter
 def tachycardia_process(in_admin, patient, physician, adminP):
     '''Detect and return the tachycardia timepoint of all the patients
@@ -2448,17 +3828,14 @@ def tachycardia_process(in_admin, patient, physician, adminP):
      "admin_password:": <password_as_str>
      "since_time": <datetime string>}
 
-    patient (DataFrame):
-    Patient information in the format of
-    patient_id, attending_username, patient_age, heart_rate_history
-    <int>, <attending_physician_str>, <int>, {"<datetime str>": <int>, ...}
-    ...
+    patient (PatientStore):
+    Patient records keyed by patient_id, whose tachycardia_log holds the
+    tachycardic readings of all the patients in time order
 
-    physician (DataFrame):
-    Physician information in the format of
-    attending_username, attending_email, attending_phone
-    <str>,             <email str>,      <xxx-xxx-xxxx str>
-    ...
+    physician (PhysicianStore):
+    Physician information keyed by attending_username in the format of
+    {<str>: {"attending_username": <str>, "attending_email": <email str>,
+             "attending_phone": <xxx-xxx-xxxx str>}, ...}
 
     adminP (DataFrame):
     Dataframe with administrator information with the format of
@@ -2511,28 +3888,30 @@ def tachycardia_process(in_admin, patient, physician, adminP):
             status = 400
             return info, status
 
-        if patient.size == 0:
+        if len(patient) == 0:
             info = "No patient information found"
             status = 400
             return info, status
-        if physician.size == 0:
+        if len(physician) == 0:
             info = "No physician information found"
             status = 400
             return info, status
+        since = datetime_to_epoch(time0)
         info = []
-        for _, row in patient.iterrows():
-            if type(row["heart_rate_history"]) == dict:
-                tmp_dict = row['heart_rate_history']
-                tmp = [x for x in tmp_dict if datetime.fromisoformat(x) > time0
-                       and is_tachycardia(row['patient_age'], tmp_dict[x])]
-                if len(tmp) != 0:
-                    patient_info = row.iloc[:2].to_dict()
-                    email = physician[physician["attending_username"] ==
-                                      patient_info["attending_username"]]. \
-                        iat[0, 1]
-                    patient_info["attending_email"] = email
-                    patient_info["tachycardia_datetime"] = tmp
-                    info.append(patient_info)
+        for patient_id, timestamps, _ in patient.tachycardia_log.since(
+                since):  # Seeks straight to the first event after since, so
+            # patients without any matching event are never touched
+            record = patient.get(patient_id)
+            patient_info = {
+                'patient_id': patient_id,
+                'attending_username': record['attending_username']}
+            email = physician.get(patient_info[
+                "attending_username"])["attending_email"]  # 1 hash
+            # lookup instead of a scan of all the physicians
+            patient_info["attending_email"] = email
+            patient_info["tachycardia_datetime"] = [
+                epoch_to_time_str(x) for x in timestamps]
+            info.append(patient_info)
         status = 200
     return info, status
 
@@ -2556,19 +3935,8 @@ def is_tachycardia(age, bpm):
     Reference:
         https://en.wikipedia.org/wiki/Tachycardia
     '''
-    age_cutoff = [2, 4, 7, 11, 15]
-    bpm_cutoff = [151, 137, 133, 130, 119]
-    for a, b in zip(age_cutoff, bpm_cutoff):
-        if age <= a:
-            if bpm > b:
-                return True
-            else:
-                return False
-    # Older than 15 years
-    if bpm > 100:
-        return True
-    else:
-        return False
+    # Same age-indexed threshold table as tachycardic_judge
+    return is_tachycardic(age, bpm)
 
 
 # **************************Ziwei He ends**************************
@@ -2612,5 +3980,12 @@ if __name__ == '__main__':
     # print(type(patient_db['heart_rate_history'][0]) == dict)
 
     main()
-    app.run(host="0.0.0.0")  # Remote server
-    # app.run()  # Local server
+    recover_database()  # Before the first request, so nothing is missing
+    start_checkpoints()
+    alert_queue.start()  # Sends the alerts a restart left in the outbox
+    try:
+        app.run(host="0.0.0.0")  # Remote server
+        # app.run()  # Local server
+    finally:  # The next start only loads the snapshot
+        checkpoint_database()
+        wal.close()
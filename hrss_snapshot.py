@@ -0,0 +1,180 @@
+import glob
+import os
+import shutil
+import uuid
+import numpy as np
+import pandas as pd
+from hrss_segments import read_segment
+from hrss_store import PatientStore, PhysicianStore
+
+SNAPSHOT_VERSION = 2  # Version 2 keeps the segment histories in files of
+# their own, version 1 snapshots (which have none) are still read
+PATIENT_ARRAYS = ['patient_id', 'patient_age', 'attending_username',
+                  'has_history', 'offsets', 'timestamps', 'heart_rates']
+
+
+def segment_path(path, snapshot_id):
+    """The directory holding the segment histories of a snapshot
+
+    Args:
+        path (str): the snapshot file
+        snapshot_id (str): the ID of the snapshot
+
+    Returns:
+        (str): the directory, next to the snapshot file
+    """
+    return '{}.{}.segments'.format(path, snapshot_id)
+
+
+def pack_snapshot(patient_db, physician_db, admin_db):
+    """Copy the 3 databases into flat arrays
+
+    The caller holds the locks of the databases, so the arrays are 1
+    consistent state of the server. Writing them to disk happens later
+    without the locks. The histories in segment files are not copied, only
+    their patients are listed in "patients.segment_ids", for
+    write_snapshot() to copy the files
+
+    Args:
+        patient_db (PatientStore): the patients and their histories
+        physician_db (PhysicianStore): the physicians
+        admin_db (df): the administrators
+
+    Returns:
+        arrays (dict of np.ndarray): the arrays of the snapshot, keyed by
+        "<database>.<field>"
+    """
+    arrays = {'patients.' + key: value
+              for key, value in patient_db.to_arrays(
+                  skip_segments=True).items()}
+    physicians = list(physician_db.records())
+    for column in PhysicianStore.columns:
+        arrays['physicians.' + column] = np.array(
+            [record[column] for record in physicians], dtype=str)
+    for column in ['admin_username', 'admin_password']:
+        arrays['admins.' + column] = np.array(admin_db[column].tolist(),
+                                              dtype=str)
+    return arrays
+
+
+def write_snapshot(path, arrays, wal_offset=0, patient_db=None):
+    """Write a snapshot file atomically
+
+    The arrays go into 1 uncompressed .npz file, so loading it is a copy
+    of every array with no parsing per reading. It is written next to path,
+    synced to disk and then renamed over path, so a crash keeps either the
+    old or the new snapshot.
+
+    The histories in patients.segment_ids are first copied file to file
+    into segment_path(), each under the lock of its patient only. A copy
+    can then hold readings newer than wal_offset, which is fine: replaying
+    the log from wal_offset adds them again, and a reading only replaces
+    the one with the same timestamp. The directories of older snapshots
+    are removed once the new snapshot is in place
+
+    Args:
+        path (str): the snapshot file
+        arrays (dict of np.ndarray): the arrays of pack_snapshot()
+        wal_offset (int): the size of the write-ahead log when the arrays
+        were packed, every change before it is in the snapshot
+        patient_db (PatientStore): the store the arrays were packed from,
+        needed when it has segment histories
+
+    Returns:
+        snapshot_id (str): 32 hex digits that identify the snapshot
+    """
+    snapshot_id = uuid.uuid4().hex
+    directory = segment_path(path, snapshot_id)
+    segment_ids = np.asarray(arrays.get('patients.segment_ids', []),
+                             dtype=np.int64)
+    if len(segment_ids):
+        if patient_db is None:
+            raise ValueError('The patient_db is needed to copy the segment '
+                             'histories')
+        os.makedirs(directory)
+        for patient_id in segment_ids.tolist():
+            with patient_db.locked(patient_id) as record:
+                record['heart_rate_history'].save(
+                    os.path.join(directory, str(patient_id)))
+    meta = {'meta.version': np.array(SNAPSHOT_VERSION),
+            'meta.snapshot_id': np.array(snapshot_id),
+            'meta.wal_offset': np.array(wal_offset, dtype=np.int64)}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **meta, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    for old in glob.glob(glob.escape(path) + '.*.segments'):
+        if old != directory:
+            shutil.rmtree(old, ignore_errors=True)
+    return snapshot_id
+
+
+def read_accounts(path):
+    """Load only the physicians and administrators of a snapshot file
+
+    Args:
+        path (str): the snapshot file
+
+    Returns:
+        physician_db (PhysicianStore): the physicians
+        admin_db (df): the administrators
+    """
+    with np.load(path, allow_pickle=False) as npz:
+        physicians = {column: npz['physicians.' + column].tolist()
+                      for column in PhysicianStore.columns}
+        admins = {column: npz['admins.' + column].tolist()
+                  for column in ['admin_username', 'admin_password']}
+    return PhysicianStore.from_frame(pd.DataFrame(
+        physicians, columns=PhysicianStore.columns)), \
+        pd.DataFrame(admins, columns=['admin_username', 'admin_password'])
+
+
+def read_snapshot(path, segments=None):
+    """Load the 3 databases from a snapshot file
+
+    The arrays are read 1 key at a time. The segment histories are not read
+    at all with segments: their files are copied into segments and mapped
+
+    Args:
+        path (str): the snapshot file
+        segments (SegmentDirectory): where the long histories go, or None
+        to keep every history in memory
+
+    Returns:
+        patient_db (PatientStore): the patients and their histories
+        physician_db (PhysicianStore): the physicians
+        admin_db (df): the administrators
+        snapshot_id (str): the ID of the snapshot
+        wal_offset (int): the size of the write-ahead log it covers
+    """
+    with np.load(path, allow_pickle=False) as npz:
+        version = int(npz['meta.version'])
+        if version not in (1, SNAPSHOT_VERSION):
+            raise ValueError('Snapshot {} has version {}, expected {}'.format(
+                path, version, SNAPSHOT_VERSION))
+        snapshot_id = str(npz['meta.snapshot_id'])
+        wal_offset = int(npz['meta.wal_offset'])
+        patients = {key: npz['patients.' + key] for key in PATIENT_ARRAYS}
+        if version > 1:
+            patients['segment_ids'] = npz['patients.segment_ids']
+        physicians = {column: npz['physicians.' + column].tolist()
+                      for column in PhysicianStore.columns}
+        admins = {column: npz['admins.' + column].tolist()
+                  for column in ['admin_username', 'admin_password']}
+
+    histories = {}
+    for patient_id in np.asarray(patients.get('segment_ids', []),
+                                 dtype=np.int64).tolist():
+        files = os.path.join(segment_path(path, snapshot_id),
+                             str(patient_id))
+        histories[patient_id] = read_segment(files) if segments is None \
+            else segments.adopt(patient_id, files)
+    patient_db = PatientStore.from_arrays(patients, segments=segments,
+                                          histories=histories)
+    physician_db = PhysicianStore.from_frame(pd.DataFrame(
+        physicians, columns=PhysicianStore.columns))
+    admin_db = pd.DataFrame(admins,
+                            columns=['admin_username', 'admin_password'])
+    return patient_db, physician_db, admin_db, snapshot_id, wal_offset
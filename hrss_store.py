@@ -0,0 +1,1544 @@
+import calendar
+import gc
+import math
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from hrss_tachycardia import tachycardic_mask
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'  # The format of every datetime str the
+# routes receive or send back
+TIME_PATTERN = r'^[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}' \
+    r'(\.[0-9]{1,9})?$'  # TIME_FORMAT with an optional fraction of a second
+EPOCH = datetime(1970, 1, 1)
+NS_PER_SECOND = 10 ** 9
+TIMESTAMP_DTYPE = np.int64  # Nanoseconds since EPOCH, enough until 2262
+HEART_RATE_DTYPE = np.int16  # bpm fits easily in 2 bytes
+MAX_HEART_RATE = int(np.iinfo(HEART_RATE_DTYPE).max)
+
+
+def datetime_to_epoch(date_time):
+    """Convert a naive datetime object into int nanoseconds since EPOCH
+
+    The datetime is treated as wall-clock time without any timezone, the
+    same way the '%Y-%m-%d %H:%M:%S' strings were always compared, so the
+    conversion back by epoch_to_time_str() gives the same str
+
+    Args:
+        date_time (datetime): a naive datetime object
+
+    Returns:
+        (int): nanoseconds since EPOCH
+    """
+    return calendar.timegm(date_time.timetuple()) * NS_PER_SECOND + \
+        date_time.microsecond * 1000
+
+
+def time_str_to_epoch(time_str):
+    """Convert a '%Y-%m-%d %H:%M:%S' str into int nanoseconds since EPOCH
+
+    The str may end with a fraction of a second of up to 9 digits
+
+    Args:
+        time_str (str): a datetime str such as '2019-07-25 12:35:24' or
+        '2019-07-25 12:35:24.25'
+
+    Returns:
+        (int): nanoseconds since EPOCH
+    """
+    whole, dot, fraction = time_str.partition('.')
+    if dot and not (fraction.isascii() and fraction.isdigit()
+                    and len(fraction) <= 9):
+        raise ValueError('{} does not match the format {}[.fraction]'
+                         .format(time_str, TIME_FORMAT))
+    seconds = calendar.timegm(datetime.strptime(whole,
+                                                TIME_FORMAT).timetuple())
+    return seconds * NS_PER_SECOND + int(fraction.ljust(9, '0') or 0)
+
+
+def epoch_to_time_str(epoch):
+    """Convert int nanoseconds since EPOCH into a '%Y-%m-%d %H:%M:%S' str
+
+    A timestamp that isn't a whole second gets its fraction of a second
+    behind a '.', without trailing zeros, so time_str_to_epoch() gives the
+    same timestamp back
+
+    Args:
+        epoch (int): nanoseconds since EPOCH
+
+    Returns:
+        (str): a datetime str such as '2019-07-25 12:35:24' or
+        '2019-07-25 12:35:24.25'
+    """
+    seconds, fraction = divmod(int(epoch), NS_PER_SECOND)
+    time_str = (EPOCH + timedelta(seconds=seconds)).strftime(TIME_FORMAT)
+    if fraction != 0:
+        time_str += '.' + '{:09d}'.format(fraction).rstrip('0')
+    return time_str
+
+
+class TimestampClock:
+    """Hands out strictly increasing nanosecond timestamps
+
+    A timestamp is the wall-clock time of datetime.now() in nanoseconds
+    since EPOCH, bumped by 1 nanosecond when it isn't later than the last
+    one handed out, so 2 readings never share a timestamp and never
+    overwrite each other however fast they come
+    """
+
+    def __init__(self, now=datetime.now):
+        self.now = now
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        """The next timestamp
+
+        Returns:
+            (int): nanoseconds since EPOCH, later than every timestamp
+            handed out before
+        """
+        timestamp = datetime_to_epoch(self.now())
+        with self._lock:
+            timestamp = max(timestamp, self._last + 1)
+            self._last = timestamp
+        return timestamp
+
+
+class RWLock:
+    """Reader-writer lock: many readers at once or 1 writer alone
+
+    A waiting writer stops new readers from coming in, so a stream of
+    readers can't starve a registration
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        """Hold the lock shared with the other readers"""
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        """Hold the lock alone"""
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class StripedLock:
+    """A fixed set of locks shared by keys hashed onto them
+
+    Keys on different stripes never wait for each other, while the number
+    of locks stays fixed however many keys there are
+    """
+
+    def __init__(self, stripes=64):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __len__(self):
+        return len(self._locks)
+
+    def for_key(self, key):
+        """The lock of the stripe of key
+
+        Args:
+            key (hashable): e.g. a patient_id
+
+        Returns:
+            (threading.Lock): the same lock for the same key every time
+        """
+        return self._locks[hash(key) % len(self._locks)]
+
+
+class HeartRateSeries:
+    """Heart rate time series of 1 patient backed by growable arrays
+
+    The timestamps are kept as int64 nanoseconds since EPOCH and the heart
+    rates as int16 bpm inside 2 NumPy arrays that double their capacity
+    when they are full, so appending is amortized O(1) and every reading
+    costs 10 bytes instead of a str key plus an int value inside a dict.
+    Readings are kept in time order as they are added, so the latest reading
+    is the last element and the read methods are views that need no sorting.
+    The series also keeps running aggregates (sum, sum of squares, min and
+    max) updated on every append, so the average and the other statistics
+    of the whole history are O(1), and a prefix-sum array next to the heart
+    rates, so the average of any time window is 2 binary searches and 1
+    subtraction
+    """
+
+    def __init__(self, capacity=16):
+        self._timestamps, self._heart_rates, self._prefix = \
+            self._allocate(capacity)  # _prefix[i] is the sum of the first i
+        # heart rates
+        self._size = 0
+        self._sum = 0  # Python int so the running sums never overflow
+        self._sum_sq = 0
+        self._min = None
+        self._max = None
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, timestamp):
+        i = int(np.searchsorted(self._timestamps[:self._size], timestamp))
+        return i < self._size and self._timestamps[i] == timestamp
+
+    def isin(self, timestamps):
+        """Check many timestamps against the series at once
+
+        Args:
+            timestamps (array-like of int): nanoseconds since EPOCH
+
+        Returns:
+            (np.ndarray of bool): True where the series has a reading with
+            the timestamp
+        """
+        timestamps = np.asarray(timestamps, dtype=TIMESTAMP_DTYPE)
+        i = np.searchsorted(self._timestamps[:self._size], timestamps)
+        found = i < self._size
+        found[found] = self._timestamps[i[found]] == timestamps[found]
+        return found
+
+    @property
+    def nbytes(self):
+        """Memory held by the 3 arrays, including the unused capacity"""
+        return (self._timestamps.nbytes + self._heart_rates.nbytes
+                + self._prefix.nbytes)
+
+    def _allocate(self, capacity):
+        # The 3 arrays for capacity readings, with every prefix sum at 0
+        return (np.empty(capacity, dtype=TIMESTAMP_DTYPE),
+                np.empty(capacity, dtype=HEART_RATE_DTYPE),
+                np.zeros(capacity + 1, dtype=np.int64))
+
+    def _grow(self):
+        timestamps, heart_rates, prefix = self._allocate(
+            max(2 * len(self._timestamps), 16))
+        timestamps[:self._size] = self._timestamps[:self._size]
+        heart_rates[:self._size] = self._heart_rates[:self._size]
+        prefix[:self._size + 1] = self._prefix[:self._size + 1]
+        self._timestamps = timestamps
+        self._heart_rates = heart_rates
+        self._prefix = prefix
+
+    def append(self, timestamp, heart_rate):
+        """Add 1 heart rate reading into the series in time order
+
+        A reading newer than the latest one is simply put at the end. An
+        out-of-order reading is put in place by a binary search and a
+        shift of the newer readings, so the series never needs a re-sort.
+        A reading with the same timestamp as an existing one replaces it,
+        the same way the datetime str key of the old history dict was
+        overwritten
+
+        Args:
+            timestamp (int): nanoseconds since EPOCH
+            heart_rate (int): heart rate in bpm
+
+        Returns:
+            i (int): the index of the reading inside the series
+        """
+        n = self._size
+        if n == 0 or timestamp > self._timestamps[n - 1]:
+            i = n  # The common case: the newest reading goes at the end
+        else:
+            i = int(np.searchsorted(self._timestamps[:n], timestamp))
+            if self._timestamps[i] == timestamp:
+                self._replace(i, heart_rate)
+                return i
+        if n == len(self._timestamps):
+            self._grow()
+        if i < n:  # Shift the newer readings by 1 to open a slot at i
+            self._timestamps[i + 1:n + 1] = self._timestamps[i:n]
+            self._heart_rates[i + 1:n + 1] = self._heart_rates[i:n]
+        self._timestamps[i] = timestamp
+        self._heart_rates[i] = heart_rate
+        self._size += 1
+        if i == n:
+            self._prefix[n + 1] = self._prefix[n] + heart_rate
+        else:  # Every prefix sum after the inserted reading changes
+            self._prefix[i + 1:n + 2] = self._prefix[i] + np.cumsum(
+                self._heart_rates[i:n + 1], dtype=np.int64)
+        heart_rate = int(heart_rate)
+        self._sum += heart_rate
+        self._sum_sq += heart_rate * heart_rate
+        if self._min is None or heart_rate < self._min:
+            self._min = heart_rate
+        if self._max is None or heart_rate > self._max:
+            self._max = heart_rate
+        return i
+
+    def extend(self, timestamps, heart_rates):
+        """Add many heart rate readings into the series at once
+
+        Readings all newer than the latest one, in strictly increasing time,
+        are copied to the end in 1 slice. Otherwise only the new readings
+        are sorted and merged into the old readings from the oldest new one
+        on, so late readings cost as much as the readings newer than them
+        rather than a re-sort of the whole history. A new reading replaces
+        an old (or earlier new) one with the same timestamp, the same way
+        append() does
+
+        Args:
+            timestamps (array-like of int): nanoseconds since EPOCH
+            heart_rates (array-like of int): heart rates in bpm
+
+        Returns:
+            (bool): True if every reading was appended at the end, False if
+            the series had to be merged
+        """
+        timestamps = np.asarray(timestamps, dtype=TIMESTAMP_DTYPE)
+        heart_rates = np.asarray(heart_rates, dtype=HEART_RATE_DTYPE)
+        m = len(timestamps)
+        if m == 0:
+            return True
+        n = self._size
+        if (n == 0 or timestamps[0] > self._timestamps[n - 1]) and \
+                bool(np.all(timestamps[1:] > timestamps[:-1])):
+            while n + m > len(self._timestamps):
+                self._grow()
+            self._timestamps[n:n + m] = timestamps
+            self._heart_rates[n:n + m] = heart_rates
+            self._prefix[n + 1:n + m + 1] = self._prefix[n] + np.cumsum(
+                heart_rates, dtype=np.int64)
+            self._size += m
+            values = heart_rates.astype(np.int64)
+            self._sum += int(values.sum())
+            self._sum_sq += int((values * values).sum())
+            low, high = int(values.min()), int(values.max())
+            self._min = low if self._min is None else min(self._min, low)
+            self._max = high if self._max is None else max(self._max, high)
+            return True
+        if n == 0:
+            self._load(timestamps, heart_rates)
+        else:
+            self._merge(timestamps, heart_rates)
+        return False
+
+    def _merge(self, timestamps, heart_rates):
+        # Merge readings in any order into the tail of the series that is
+        # newer than the oldest of them, with the last of every timestamp
+        # kept
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, heart_rates = timestamps[order], heart_rates[order]
+        last = np.append(timestamps[1:] != timestamps[:-1], True)
+        timestamps, heart_rates = timestamps[last], heart_rates[last]
+        n = self._size
+        start = int(np.searchsorted(self._timestamps[:n], timestamps[0]))
+        old_timestamps = self._timestamps[start:n]
+        old_heart_rates = self._heart_rates[start:n].copy()
+        at = np.searchsorted(old_timestamps, timestamps)
+        same = at < len(old_timestamps)
+        same[same] = old_timestamps[at[same]] == timestamps[same]
+        replaced = old_heart_rates[at[same]].astype(np.int64)
+        tail_heart_rates = old_heart_rates.copy()
+        tail_heart_rates[at[same]] = heart_rates[same]
+        tail_heart_rates = np.insert(tail_heart_rates, at[~same],
+                                     heart_rates[~same])
+        tail_timestamps = np.insert(old_timestamps, at[~same],
+                                    timestamps[~same])
+        size = start + len(tail_timestamps)
+        while size > len(self._timestamps):
+            self._grow()
+        self._timestamps[start:size] = tail_timestamps
+        self._heart_rates[start:size] = tail_heart_rates
+        self._prefix[start + 1:size + 1] = self._prefix[start] + np.cumsum(
+            tail_heart_rates, dtype=np.int64)
+        self._size = size
+        removed = old_heart_rates.astype(np.int64)
+        added = tail_heart_rates.astype(np.int64)
+        self._sum += int(added.sum()) - int(removed.sum())
+        self._sum_sq += int((added * added).sum()) - \
+            int((removed * removed).sum())
+        if np.isin(replaced, [self._min, self._max]).any():  # A replaced
+            # reading may have been the extreme one
+            self._min = int(self._heart_rates[:size].min())
+            self._max = int(self._heart_rates[:size].max())
+        else:
+            self._min = min(self._min, int(heart_rates.min()))
+            self._max = max(self._max, int(heart_rates.max()))
+
+    def _load(self, timestamps, heart_rates):
+        # Replace the whole series by the readings, sorted and with the last
+        # of every timestamp kept
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, heart_rates = timestamps[order], heart_rates[order]
+        last = np.append(timestamps[1:] != timestamps[:-1], True)
+        last = last[:len(timestamps)]  # No reading has no last one
+        timestamps, heart_rates = timestamps[last], heart_rates[last]
+        n = len(timestamps)
+        self._timestamps, self._heart_rates, self._prefix = \
+            self._allocate(max(len(self._timestamps), n, 16))
+        self._timestamps[:n] = timestamps
+        self._heart_rates[:n] = heart_rates
+        self._prefix[1:n + 1] = np.cumsum(heart_rates, dtype=np.int64)
+        self._size = n
+        values = heart_rates.astype(np.int64)
+        self._sum = int(values.sum())
+        self._sum_sq = int((values * values).sum())
+        self._min = int(values.min()) if n else None
+        self._max = int(values.max()) if n else None
+
+    @classmethod
+    def from_arrays(cls, timestamps, heart_rates):
+        """Build a series from 2 arrays of readings in any order
+
+        Args:
+            timestamps (array-like of int): nanoseconds since EPOCH
+            heart_rates (array-like of int): heart rates in bpm
+
+        Returns:
+            (HeartRateSeries): a series with the same readings, where the
+            last reading of a repeated timestamp wins
+        """
+        series = cls()
+        series._load(np.asarray(timestamps, dtype=TIMESTAMP_DTYPE),
+                     np.asarray(heart_rates, dtype=HEART_RATE_DTYPE))
+        return series
+
+    @classmethod
+    def _from_parts(cls, timestamps, heart_rates, prefix, sum_, sum_sq,
+                    min_, max_):
+        # Wrap arrays that are already sorted, deduplicated and summed up,
+        # without any copy. The capacity is the size, so the next append
+        # grows into new arrays and never writes past the slices
+        series = cls.__new__(cls)
+        series._timestamps = timestamps
+        series._heart_rates = heart_rates
+        series._prefix = prefix
+        series._size = len(timestamps)
+        series._sum = sum_
+        series._sum_sq = sum_sq
+        series._min = min_
+        series._max = max_
+        return series
+
+    def _replace(self, i, heart_rate):
+        old = int(self._heart_rates[i])
+        heart_rate = int(heart_rate)
+        self._heart_rates[i] = heart_rate
+        self._prefix[i + 1:self._size + 1] += heart_rate - old
+        self._sum += heart_rate - old
+        self._sum_sq += heart_rate * heart_rate - old * old
+        if old in (self._min, self._max):  # The replaced reading may have
+            # been the extreme one, so only then look at the whole array
+            self._min = int(self._heart_rates[:self._size].min())
+            self._max = int(self._heart_rates[:self._size].max())
+        else:
+            self._min = min(self._min, heart_rate)
+            self._max = max(self._max, heart_rate)
+
+    def remove(self, timestamps):
+        """Drop the readings with the given timestamps from the series
+
+        Only the readings newer than the oldest dropped one are moved and
+        summed up again, so dropping recent readings is as cheap as
+        extending the series with them
+
+        Args:
+            timestamps (array-like of int): nanoseconds since EPOCH, those
+            the series doesn't have are ignored
+
+        Returns:
+            (int): the number of readings dropped
+        """
+        timestamps = np.asarray(timestamps, dtype=TIMESTAMP_DTYPE)
+        timestamps = timestamps[self.isin(timestamps)]
+        if len(timestamps) == 0:
+            return 0
+        n = self._size
+        at = np.unique(np.searchsorted(self._timestamps[:n], timestamps))
+        start = int(at[0])
+        keep = np.ones(n - start, dtype=bool)
+        keep[at - start] = False
+        removed = self._heart_rates[at].astype(np.int64)
+        tail_timestamps = self._timestamps[start:n][keep]
+        tail_heart_rates = self._heart_rates[start:n][keep]
+        size = start + len(tail_timestamps)
+        self._timestamps[start:size] = tail_timestamps
+        self._heart_rates[start:size] = tail_heart_rates
+        self._prefix[start + 1:size + 1] = self._prefix[start] + np.cumsum(
+            tail_heart_rates, dtype=np.int64)
+        self._size = size
+        self._sum -= int(removed.sum())
+        self._sum_sq -= int((removed * removed).sum())
+        if size == 0:
+            self._min = self._max = None
+        elif np.isin(removed, [self._min, self._max]).any():  # A dropped
+            # reading may have been the extreme one
+            self._min = int(self._heart_rates[:size].min())
+            self._max = int(self._heart_rates[:size].max())
+        return len(at)
+
+    def mean(self):
+        """The average heart rate of the whole series in O(1)
+
+        Returns:
+            (float): the average heart rate in bpm
+        """
+        return self._sum / self._size
+
+    def stats(self):
+        """The statistics of the whole series from the running aggregates
+
+        Returns:
+            (dict): {"count": <int>, "mean": <float>, "std": <float>,
+            "min": <int>, "max": <int>} where std is the population standard
+            deviation of the heart rates
+        """
+        mean = self.mean()
+        variance = max(self._sum_sq / self._size - mean * mean, 0.0)  # max()
+        # guards against a tiny negative value from float rounding
+        return {'count': self._size, 'mean': mean,
+                'std': math.sqrt(variance), 'min': self._min,
+                'max': self._max}
+
+    def timestamps(self):
+        """All the timestamps in time order
+
+        Returns:
+            (np.ndarray of int64): a read-only view of nanoseconds since EPOCH
+        """
+        view = self._timestamps[:self._size]
+        view.flags.writeable = False
+        return view
+
+    def heart_rates(self):
+        """All the heart rates in time order
+
+        Returns:
+            (np.ndarray of int16): a read-only view of heart rates in bpm
+        """
+        view = self._heart_rates[:self._size]
+        view.flags.writeable = False
+        return view
+
+    def _window(self, since, until=None):
+        timestamps = self._timestamps[:self._size]
+        i = int(np.searchsorted(timestamps, since, side='right'))
+        if until is None:
+            return i, self._size
+        j = int(np.searchsorted(timestamps, until, side='left'))
+        return i, max(i, j)  # An until before since is an empty window
+
+    def since(self, timestamp, until=None):
+        """The heart rates measured after a given time
+
+        Args:
+            timestamp (int): nanoseconds since EPOCH, exclusive
+            until (int): nanoseconds since EPOCH, exclusive, or None for no
+            upper bound
+
+        Returns:
+            (np.ndarray of int16): a read-only view of the heart rates in
+            time order whose timestamp is later than timestamp and earlier
+            than until
+        """
+        i, j = self._window(timestamp, until)
+        return self.heart_rates()[i:j]
+
+    def timestamps_since(self, timestamp, until=None):
+        """The timestamps of the heart rates measured after a given time
+
+        Args:
+            timestamp (int): nanoseconds since EPOCH, exclusive
+            until (int): nanoseconds since EPOCH, exclusive, or None for no
+            upper bound
+
+        Returns:
+            (np.ndarray of int64): a read-only view of the timestamps in
+            time order that are later than timestamp and earlier than until
+        """
+        i, j = self._window(timestamp, until)
+        return self.timestamps()[i:j]
+
+    def window_mean(self, since, until=None):
+        """The average heart rate of a time window in O(log n)
+
+        The window is found by 2 binary searches on the timestamps and its
+        sum is the difference of 2 prefix sums, so no heart rate is read
+
+        Args:
+            since (int): nanoseconds since EPOCH, exclusive
+            until (int): nanoseconds since EPOCH, exclusive, or None for no
+            upper bound
+
+        Returns:
+            (float): the average heart rate in bpm, or None if there is no
+            reading inside the window
+        """
+        i, j = self._window(since, until)
+        if i == j:
+            return None
+        return int(self._prefix[j] - self._prefix[i]) / (j - i)
+
+    def latest(self):
+        """The most recent reading of the series
+
+        Returns:
+            timestamp (int): nanoseconds since EPOCH
+            heart_rate (int): heart rate in bpm
+        """
+        i = self._size - 1
+        return int(self._timestamps[i]), int(self._heart_rates[i])
+
+    def copy(self):
+        """A deep copy of the series
+
+        Returns:
+            (HeartRateSeries): a series with the same readings
+        """
+        out = HeartRateSeries(capacity=max(self._size, 16))
+        out._timestamps[:self._size] = self._timestamps[:self._size]
+        out._heart_rates[:self._size] = self._heart_rates[:self._size]
+        out._prefix[:self._size + 1] = self._prefix[:self._size + 1]
+        out._size = self._size
+        out._sum = self._sum
+        out._sum_sq = self._sum_sq
+        out._min = self._min
+        out._max = self._max
+        return out
+
+    def to_dict(self):
+        """The series as a history dict in time order
+
+        Returns:
+            (dict): datetime_str:heart_rate_int data pairs, the format that
+            heart_rate_history used to be stored in
+        """
+        return {epoch_to_time_str(t): int(h)
+                for t, h in zip(self.timestamps(), self.heart_rates())}
+
+    @classmethod
+    def from_dict(cls, heart_rate_history_dict):
+        """Build a series from a datetime_str:heart_rate_int history dict
+
+        Args:
+            heart_rate_history_dict (dict): datetime_str:heart_rate_int data
+            pairs
+
+        Returns:
+            (HeartRateSeries): a series with the same readings
+        """
+        series = cls(capacity=max(len(heart_rate_history_dict), 16))
+        for time_str, heart_rate in heart_rate_history_dict.items():
+            series.append(time_str_to_epoch(time_str), heart_rate)
+        return series
+
+
+def _group_aggregates(heart_rates, offsets):
+    # The aggregates of the groups of heart_rates between consecutive
+    # offsets, each in 1 pass over all the groups. Group i gets its own
+    # prefix sums, starting from 0, at prefixes[offsets[i] + i:offsets[i +
+    # 1] + i + 1], and its sum, sum of squares, minimum and maximum in lists.
+    # The extremes of an empty group are None
+    values = heart_rates.astype(np.int64)
+    prefix = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(values, out=prefix[1:])
+    squares = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(values * values, out=squares[1:])
+    lengths = np.diff(offsets) + 1  # 1 more prefix sum than heart rates
+    groups = np.repeat(np.arange(len(lengths)), lengths)
+    prefixes = prefix[np.arange(len(groups)) - groups] - \
+        prefix[offsets[:-1]][groups]
+    sums = np.diff(prefix[offsets]).tolist()
+    sums_sq = np.diff(squares[offsets]).tolist()
+    mins = [None] * (len(offsets) - 1)
+    maxs = [None] * (len(offsets) - 1)
+    filled = np.flatnonzero(np.diff(offsets))
+    if len(filled) != 0:  # reduceat only sees the non-empty groups, whose
+        # starts are strictly increasing
+        starts = offsets[filled]
+        for i, low, high in zip(filled.tolist(),
+                                np.minimum.reduceat(values, starts).tolist(),
+                                np.maximum.reduceat(values, starts).tolist()):
+            mins[i], maxs[i] = low, high
+    return prefixes, sums, sums_sq, mins, maxs
+
+
+class TachycardiaEventLog:
+    """Time-ordered log of the tachycardic readings of all the patients
+
+    Every event is 1 tachycardic reading kept as (timestamp, patient_id,
+    heart_rate) inside 3 growable NumPy arrays sorted by timestamp. New
+    readings are the newest, so logging them is an append at the end, and
+    the events since a given time are 1 binary search away, so a query
+    costs as much as the events it returns rather than every patient
+    """
+
+    def __init__(self, capacity=16):
+        self._timestamps = np.empty(capacity, dtype=TIMESTAMP_DTYPE)
+        self._patient_ids = np.empty(capacity, dtype=np.int64)
+        self._heart_rates = np.empty(capacity, dtype=HEART_RATE_DTYPE)
+        self._size = 0
+        self._lock = threading.Lock()  # The ingest threads of different
+        # patients all append here
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self):
+        capacity = max(2 * len(self._timestamps), 16)
+        for name in ('_timestamps', '_patient_ids', '_heart_rates'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def append(self, timestamp, patient_id, heart_rate):
+        """Log 1 tachycardic reading in time order
+
+        Args:
+            timestamp (int): nanoseconds since EPOCH
+            patient_id (int): the ID that identifies the patient
+            heart_rate (int): heart rate in bpm
+        """
+        with self._lock:
+            n = self._size
+            if n == len(self._timestamps):
+                self._grow()
+            i = n
+            if n != 0 and timestamp < self._timestamps[n - 1]:  # A late
+                # reading is put in place behind the ones with the same time
+                i = int(np.searchsorted(self._timestamps[:n], timestamp,
+                                        side='right'))
+                for array in (self._timestamps, self._patient_ids,
+                              self._heart_rates):
+                    array[i + 1:n + 1] = array[i:n]
+            self._timestamps[i] = timestamp
+            self._patient_ids[i] = patient_id
+            self._heart_rates[i] = heart_rate
+            self._size += 1
+
+    def extend(self, patient_id, timestamps, heart_rates):
+        """Log many tachycardic readings of 1 patient in time order
+
+        Args:
+            patient_id (int): the ID that identifies the patient
+            timestamps (np.ndarray of int64): nanoseconds since EPOCH in time
+            order
+            heart_rates (np.ndarray of int16): heart rates in bpm
+        """
+        m = len(timestamps)
+        if m == 0:
+            return
+        with self._lock:
+            n = self._size
+            if n == 0 or timestamps[0] >= self._timestamps[n - 1]:
+                while n + m > len(self._timestamps):
+                    self._grow()
+                self._timestamps[n:n + m] = timestamps
+                self._patient_ids[n:n + m] = patient_id
+                self._heart_rates[n:n + m] = heart_rates
+                self._size += m
+            else:  # Late readings, so merge them into the events newer
+                # than the oldest of them, behind the ones with the same time
+                i = int(np.searchsorted(self._timestamps[:n], timestamps[0],
+                                        side='right'))
+                at = np.searchsorted(self._timestamps[i:n], timestamps,
+                                     side='right')
+                tails = [np.insert(getattr(self, name)[i:n], at, values)
+                         for name, values in (
+                             ('_timestamps', timestamps),
+                             ('_patient_ids', np.full(m, patient_id)),
+                             ('_heart_rates', heart_rates))]
+                while n + m > len(self._timestamps):
+                    self._grow()
+                for name, tail in zip(('_timestamps', '_patient_ids',
+                                       '_heart_rates'), tails):
+                    getattr(self, name)[i:n + m] = tail
+                self._size += m
+
+    def remove(self, patient_id, timestamps):
+        """Drop the events of 1 patient at the given timestamps
+
+        Only the events newer than the oldest of the timestamps are looked
+        at and moved up, so dropping recent events doesn't touch the rest
+        of the log
+
+        Args:
+            patient_id (int): the ID that identifies the patient
+            timestamps (np.ndarray of int64): nanoseconds since EPOCH
+        """
+        if len(timestamps) == 0:
+            return
+        with self._lock:
+            n = self._size
+            i = int(np.searchsorted(self._timestamps[:n], timestamps.min()))
+            keep = (self._patient_ids[i:n] != patient_id) | \
+                ~np.isin(self._timestamps[i:n], timestamps)
+            if keep.all():
+                return
+            for name in ('_timestamps', '_patient_ids', '_heart_rates'):
+                tail = getattr(self, name)[i:n][keep]
+                getattr(self, name)[i:i + len(tail)] = tail
+            self._size = i + int(keep.sum())
+
+    def _assign(self, timestamps, patient_ids, heart_rates):
+        order = np.argsort(timestamps, kind='stable')
+        self._size = len(order)
+        self._timestamps = np.asarray(timestamps,
+                                      dtype=TIMESTAMP_DTYPE)[order]
+        self._patient_ids = np.asarray(patient_ids, dtype=np.int64)[order]
+        self._heart_rates = np.asarray(heart_rates,
+                                       dtype=HEART_RATE_DTYPE)[order]
+
+    def replace_patient(self, patient_id, events=None):
+        """Replace all the events of 1 patient
+
+        This drops every event of the patient and merges in the readings of
+        events, which is used when a whole history is (re)indexed
+
+        Args:
+            patient_id (int): the ID that identifies the patient
+            events (HeartRateSeries or None): the tachycardic readings of
+            the patient, None to only drop them
+        """
+        with self._lock:
+            n = self._size
+            keep = self._patient_ids[:n] != patient_id
+            timestamps = [self._timestamps[:n][keep]]
+            patient_ids = [self._patient_ids[:n][keep]]
+            heart_rates = [self._heart_rates[:n][keep]]
+            if events is not None and len(events) != 0:
+                timestamps.append(events.timestamps())
+                patient_ids.append(np.full(len(events), patient_id))
+                heart_rates.append(events.heart_rates())
+            self._assign(np.concatenate(timestamps),
+                         np.concatenate(patient_ids),
+                         np.concatenate(heart_rates))
+
+    @classmethod
+    def from_records(cls, records):
+        """Build the log from the tachycardia_events of patient records
+
+        All the events are concatenated and sorted once, so loading many
+        patients doesn't insert them one by one
+
+        Args:
+            records (iterable of dict): patient records of a PatientStore
+
+        Returns:
+            (TachycardiaEventLog): the log holding all their events
+        """
+        log = cls()
+        timestamps, patient_ids, heart_rates = [], [], []
+        for record in records:
+            events = record['tachycardia_events']
+            if events is not None and len(events) != 0:
+                timestamps.append(events.timestamps())
+                patient_ids.append(np.full(len(events),
+                                           record['patient_id']))
+                heart_rates.append(events.heart_rates())
+        if len(timestamps) != 0:
+            log._assign(np.concatenate(timestamps),
+                        np.concatenate(patient_ids),
+                        np.concatenate(heart_rates))
+        return log
+
+    def since(self, timestamp):
+        """The events that happened after a given time, grouped by patient
+
+        Args:
+            timestamp (int): nanoseconds since EPOCH, exclusive
+
+        Returns:
+            groups (list of tuple): (patient_id, timestamps, heart_rates)
+            per patient in patient_id order, where timestamps
+            (np.ndarray of int64) and heart_rates (np.ndarray of int16) are
+            the events of that patient in time order
+        """
+        with self._lock:
+            n = self._size
+            i = int(np.searchsorted(self._timestamps[:n], timestamp,
+                                    side='right'))
+            patient_ids = self._patient_ids[i:n]
+            order = np.argsort(patient_ids, kind='stable')  # Stable keeps
+            # the time order inside every patient
+            patient_ids = patient_ids[order]
+            timestamps = self._timestamps[i:n][order]
+            heart_rates = self._heart_rates[i:n][order]
+            firsts = np.flatnonzero(np.diff(patient_ids)) + 1
+            return [(int(p[0]), t, h) for p, t, h in
+                    zip(np.split(patient_ids, firsts),
+                        np.split(timestamps, firsts),
+                        np.split(heart_rates, firsts)) if len(p) != 0]
+
+
+class PatientStore:
+    """In-memory patient store keyed by patient_id
+
+    Every patient is kept as 1 record dict in the format of {
+    "patient_id": <int>, "attending_username": <str>, "patient_age": <int>,
+    "heart_rate_history": <HeartRateSeries or None>} inside a dict keyed by
+    the int patient_id, so finding a patient is a hash lookup instead of a
+    boolean mask over all the patients. The records are the same objects
+    the routes mutate, so the store stays consistent without any copying.
+
+    Each record also has a "latest" field that caches the latest reading
+    as {"timestamp": <int>, "heart_rate": <int>, "tachycardic": <bool>} (or
+    None before the first heart rate), and the store keeps a secondary
+    index from attending_username to the records of that physician's
+    patients, so a physician's dashboard only touches their own patients.
+
+    The "tachycardia_events" field of a record is a HeartRateSeries that
+    holds only the tachycardic readings of the patient, so it flags every
+    tachycardic reading by its timestamp and the readings since a given
+    time are 1 binary search away. It is None while the patient has no
+    heart rate history. The same readings of all the patients are also in
+    the tachycardia_log of the store, ordered by time across patients.
+
+    The store is shared by the request threads. Adding or removing a
+    patient changes the dicts, so it must hold registry_lock.write(), and
+    everything else holds registry_lock.read(). The readings of 1 patient
+    are guarded by the stripe of its patient_id in patient_locks, so
+    ingest for patients on different stripes runs in parallel; locked()
+    takes both locks for 1 patient.
+
+    With segments set (see hrss_segments.SegmentDirectory), a history that
+    grows past segments.max_readings is moved into a memory-mapped segment
+    file, so the long histories live on disk instead of in memory
+    """
+
+    columns = ['patient_id', 'attending_username', 'patient_age',
+               'heart_rate_history']
+
+    def __init__(self, segments=None):
+        self.segments = segments
+        self.patients = {}
+        self.by_attending = {}  # attending_username: {patient_id: record}
+        self.tachycardia_log = TachycardiaEventLog()
+        self.registry_lock = RWLock()
+        self.patient_locks = StripedLock()
+
+    def __len__(self):
+        return len(self.patients)
+
+    def __contains__(self, patient_id):
+        return patient_id in self.patients
+
+    def get(self, patient_id):
+        """Get the record of a patient
+
+        Args:
+            patient_id (int): the ID that identifies a patient
+
+        Returns:
+            record (dict or None): the record of that patient, or None if
+            the patient_id is not registered
+        """
+        return self.patients.get(patient_id)
+
+    def add(self, in_data):
+        """Add a new patient record into the store
+
+        Args:
+            in_data (dict): the patient data in the format of {
+            "patient_id": <int>, "attending_username": <str>,
+            "patient_age": <int>} with an optional "heart_rate_history"
+
+        Returns:
+            record (dict): the newly added record
+        """
+        record = self._insert(in_data)
+        if record['tachycardia_events'] is not None and \
+                len(record['tachycardia_events']) != 0:  # A patient without
+            # events has nothing to merge into the log
+            self.tachycardia_log.replace_patient(record['patient_id'],
+                                                 record['tachycardia_events'])
+        return record
+
+    def _insert(self, in_data):
+        record = {'patient_id': in_data['patient_id'],
+                  'attending_username': in_data['attending_username'],
+                  'patient_age': in_data['patient_age'],
+                  'heart_rate_history': in_data.get('heart_rate_history'),
+                  'latest': None,
+                  'tachycardia_events': None}
+        self._build_events(record)
+        self.patients[record['patient_id']] = record
+        self.by_attending.setdefault(record['attending_username'], {})[
+            record['patient_id']] = record
+        return record
+
+    def remove(self, patient_id):
+        """Remove a patient record from the store
+
+        Args:
+            patient_id (int): the ID that identifies a patient
+
+        Returns:
+            record (dict or None): the removed record, or None if the
+            patient_id was not registered
+        """
+        record = self.patients.pop(patient_id, None)
+        if record is not None:
+            del self.by_attending[record['attending_username']][patient_id]
+            if record['tachycardia_events'] is not None:
+                self.tachycardia_log.replace_patient(patient_id)
+        return record
+
+    @contextmanager
+    def locked(self, patient_id):
+        """Hold the locks to read or change the readings of 1 patient
+
+        Args:
+            patient_id (int): the ID that identifies a patient
+
+        Returns:
+            record (dict or None): the record of that patient, or None if
+            the patient_id is not registered
+        """
+        with self.registry_lock.read():
+            with self.patient_locks.for_key(patient_id):
+                yield self.patients.get(patient_id)
+
+    def add_reading(self, record, timestamp, heart_rate, tachycardic):
+        """Add 1 heart rate reading to a patient and to every index
+
+        The caller holds locked() for the patient
+
+        Args:
+            record (dict): the record of the patient
+            timestamp (int): nanoseconds since EPOCH of the reading
+            heart_rate (int): heart rate of the reading in bpm
+            tachycardic (bool): whether the reading is tachycardic
+
+        Returns:
+            i (int): the index of the reading inside the history
+        """
+        if record['heart_rate_history'] is None:
+            record['heart_rate_history'] = HeartRateSeries()
+        history = record['heart_rate_history']
+        i = history.append(timestamp, heart_rate)
+        self._spill(record)
+        self.add_tachycardia_event(record, timestamp, heart_rate,
+                                   tachycardic)
+        if i == len(history) - 1:  # Only a reading newer than all the
+            # others changes the cached latest reading
+            self.set_latest(record, timestamp, heart_rate, tachycardic)
+        return i
+
+    def add_readings(self, record, timestamps, heart_rates):
+        """Add many heart rate readings to a patient and to every index
+
+        The readings are judged for tachycardia in 1 vectorized pass and
+        extended into the history, the tachycardia_events and the
+        tachycardia_log, which only merge the late readings into the newer
+        ones. When a reading replaces one with the same timestamp, only the
+        events at the repeated timestamps are dropped and judged again from
+        the history, so neither the events of the patient nor the log of
+        all the patients is rebuilt. The caller holds locked() for the
+        patient
+
+        Args:
+            record (dict): the record of the patient
+            timestamps (np.ndarray of int64): nanoseconds since EPOCH
+            heart_rates (np.ndarray of int16): heart rates in bpm
+
+        Returns:
+            flags (np.ndarray of bool): True where the reading is
+            tachycardic
+        """
+        timestamps = np.asarray(timestamps, dtype=TIMESTAMP_DTYPE)
+        heart_rates = np.asarray(heart_rates, dtype=HEART_RATE_DTYPE)
+        flags = tachycardic_mask(record['patient_age'], heart_rates)
+        if len(timestamps) == 0:
+            return flags
+        if record['heart_rate_history'] is None:
+            record['heart_rate_history'] = HeartRateSeries()
+        history = record['heart_rate_history']
+        events = record['tachycardia_events']
+        if events is None:  # The first readings of the patient
+            events = record['tachycardia_events'] = HeartRateSeries()
+        ordered = np.sort(timestamps)
+        replacing = bool((ordered[1:] == ordered[:-1]).any()) or \
+            bool(history.isin(ordered).any())
+        history.extend(timestamps, heart_rates)
+        history = self._spill(record)
+        if replacing:  # The heart rate that won every timestamp is in the
+            # history now, so the old events there make way for its verdict
+            ordered = np.unique(ordered)
+            stale = ordered[events.isin(ordered)]
+            events.remove(stale)
+            self.tachycardia_log.remove(record['patient_id'], stale)
+            rates = history.heart_rates()[np.searchsorted(
+                history.timestamps(), ordered)]
+            hits = tachycardic_mask(record['patient_age'], rates)
+            new_timestamps, new_heart_rates = ordered[hits], rates[hits]
+        else:
+            order = np.argsort(timestamps[flags], kind='stable')
+            new_timestamps = timestamps[flags][order]
+            new_heart_rates = heart_rates[flags][order]
+        events.extend(new_timestamps, new_heart_rates)
+        self.tachycardia_log.extend(record['patient_id'], new_timestamps,
+                                    new_heart_rates)
+        timestamp, heart_rate = history.latest()
+        self.set_latest(record, timestamp, heart_rate,
+                        tachycardic_mask(record['patient_age'], heart_rate))
+        return flags
+
+    def _spill(self, record):
+        # Move the history of the record into a segment file once it is too
+        # long to stay in memory
+        if self.segments is not None:
+            record['heart_rate_history'] = self.segments.spill(
+                record['patient_id'], record['heart_rate_history'])
+        return record['heart_rate_history']
+
+    def patients_of(self, attending_username):
+        """Get the records of all the patients of 1 attending physician
+
+        Args:
+            attending_username (str): the username of the physician
+
+        Returns:
+            (list of dict): the records in registration order, empty if the
+            physician has no patient
+        """
+        return list(self.by_attending.get(attending_username, {}).values())
+
+    @staticmethod
+    def late_mask(record, timestamps, max_lateness, now=None):
+        """Find the readings that came too late for the reorder window
+
+        A reading older than the latest one of the patient is still merged
+        into its place in the history, as long as it is at most
+        max_lateness older. Anything later than that is left out. A latest
+        reading ahead of now counts as if it were taken now, so a device
+        with a wrong clock can't push the window past the present
+
+        Args:
+            record (dict): the record of the patient
+            timestamps (array-like of int): nanoseconds since EPOCH
+            max_lateness (int or None): nanoseconds a reading may be older
+            than the latest one, None for no bound
+            now (int or None): nanoseconds since EPOCH of the server clock,
+            None for no bound on the latest reading
+
+        Returns:
+            (np.ndarray of bool): True where the reading is too late
+        """
+        timestamps = np.asarray(timestamps, dtype=TIMESTAMP_DTYPE)
+        latest = record['latest']
+        if latest is None or max_lateness is None:
+            return np.zeros(len(timestamps), dtype=bool)
+        newest = latest['timestamp'] if now is None else \
+            min(latest['timestamp'], now)
+        return timestamps < newest - max_lateness
+
+    @staticmethod
+    def set_latest(record, timestamp, heart_rate, tachycardic):
+        """Cache the latest reading of a patient inside its record
+
+        Args:
+            record (dict): the record of the patient
+            timestamp (int): nanoseconds since EPOCH of the latest reading
+            heart_rate (int): heart rate of the latest reading in bpm
+            tachycardic (bool): whether the latest reading is tachycardic
+        """
+        record['latest'] = {'timestamp': int(timestamp),
+                            'heart_rate': int(heart_rate),
+                            'tachycardic': bool(tachycardic)}
+
+    def index_tachycardia(self, record):
+        """Build the tachycardia event index of a record from its history
+
+        All the heart rates are judged in 1 vectorized pass, so this is
+        used when a whole history is (re)loaded or a reading is
+        overwritten. The events of the patient in tachycardia_log are
+        replaced by the new ones
+
+        Args:
+            record (dict): the record of the patient
+        """
+        self._build_events(record)
+        self.tachycardia_log.replace_patient(record['patient_id'],
+                                             record['tachycardia_events'])
+
+    @staticmethod
+    def _build_events(record):
+        history = record['heart_rate_history']
+        if history is None:
+            record['tachycardia_events'] = None
+            return
+        flags = tachycardic_mask(record['patient_age'],
+                                 history.heart_rates())
+        record['tachycardia_events'] = HeartRateSeries.from_arrays(
+            history.timestamps()[flags], history.heart_rates()[flags])
+
+    def add_tachycardia_event(self, record, timestamp, heart_rate,
+                              tachycardic):
+        """Record the verdict on 1 new reading in the event indexes
+
+        A tachycardic reading is appended to the tachycardia_events of the
+        record and to the tachycardia_log of the store
+
+        Args:
+            record (dict): the record of the patient, whose history already
+            holds the reading
+            timestamp (int): nanoseconds since EPOCH of the reading
+            heart_rate (int): heart rate of the reading in bpm
+            tachycardic (bool): whether the reading is tachycardic
+        """
+        events = record['tachycardia_events']
+        if events is None:
+            events = record['tachycardia_events'] = HeartRateSeries()
+        if timestamp in events:  # The reading replaced a tachycardic one
+            # with the same timestamp, so that event goes first
+            stale = np.array([timestamp], dtype=TIMESTAMP_DTYPE)
+            events.remove(stale)
+            self.tachycardia_log.remove(record['patient_id'], stale)
+        if tachycardic:
+            events.append(timestamp, heart_rate)
+            self.tachycardia_log.append(timestamp, record['patient_id'],
+                                        heart_rate)
+
+    def records(self):
+        """Iterate over all the patient records in registration order
+
+        Returns:
+            (iterator of dict): every patient record in the store
+        """
+        return iter(self.patients.values())
+
+    def to_frame(self):
+        """Build a DataFrame view of the store for the admin reports
+
+        Returns:
+            frame (df): a pandas dataframe with the columns patient_id,
+            attending_username, patient_age and heart_rate_history where the
+            heart_rate_history cells are dicts (or None for no history)
+        """
+        rows = []
+        for record in self.patients.values():
+            row = {column: record[column] for column in self.columns}
+            if row['heart_rate_history'] is not None:
+                row['heart_rate_history'] = \
+                    row['heart_rate_history'].to_dict()
+            rows.append(row)
+        return pd.DataFrame(rows, columns=self.columns)
+
+    def to_arrays(self, skip_segments=False):
+        """Pack the whole store into flat arrays for a snapshot
+
+        The histories of all the patients are concatenated in registration
+        order, so the readings of patient i are
+        timestamps[offsets[i]:offsets[i + 1]]. With skip_segments, the
+        histories in segment files are left out of the concatenation, so
+        they never go through memory: they get no readings in the arrays
+        and their patients are listed in "segment_ids" instead
+
+        Args:
+            skip_segments (bool): whether to leave out the histories in
+            segment files
+
+        Returns:
+            arrays (dict of np.ndarray): "patient_id" and "patient_age"
+            (int64), "attending_username" (str), "has_history" (bool, False
+            for a history of None), "offsets" (int64, 1 more than the
+            patients), "timestamps" (int64), "heart_rates" (int16) and
+            "segment_ids" (int64, the patients whose history was left out)
+        """
+        records = list(self.patients.values())
+        histories = [record['heart_rate_history'] for record in records]
+        skipped = [skip_segments and h is not None and
+                   type(h) is not HeartRateSeries for h in histories]
+        lengths = [0 if h is None or skip else len(h)
+                   for h, skip in zip(histories, skipped)]
+        offsets = np.zeros(len(records) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        timestamps = np.empty(offsets[-1], dtype=TIMESTAMP_DTYPE)
+        heart_rates = np.empty(offsets[-1], dtype=HEART_RATE_DTYPE)
+        for history, start, end in zip(histories, offsets[:-1].tolist(),
+                                       offsets[1:].tolist()):
+            if end != start:
+                timestamps[start:end] = history.timestamps()
+                heart_rates[start:end] = history.heart_rates()
+        return {'patient_id': np.array([r['patient_id'] for r in records],
+                                       dtype=np.int64),
+                'patient_age': np.array([r['patient_age'] for r in records],
+                                        dtype=np.int64),
+                'attending_username': np.array(
+                    [r['attending_username'] for r in records], dtype=str),
+                'has_history': np.array([h is not None for h in histories],
+                                        dtype=bool),
+                'offsets': offsets, 'timestamps': timestamps,
+                'heart_rates': heart_rates,
+                'segment_ids': np.array(
+                    [r['patient_id'] for r, skip in zip(records, skipped)
+                     if skip], dtype=np.int64)}
+
+    @classmethod
+    def from_arrays(cls, arrays, segments=None, histories=None):
+        """Build a store from the flat arrays of to_arrays()
+
+        Everything per reading is done by NumPy over all the patients at
+        once: the tachycardia verdicts, the prefix sums and the running
+        aggregates. Every history and event index is a slice of the
+        arrays, so the Python work is a few objects per patient. With
+        segments, the histories longer than segments.max_readings are
+        written into segment files and the others are copied out of the
+        arrays, so the long ones don't stay in memory through the slices
+
+        Args:
+            arrays (dict of np.ndarray): the arrays of to_arrays(), with the
+            histories of every patient in time order
+            segments (SegmentDirectory): where the long histories go, or
+            None to keep every history in memory
+            histories (dict): patient_id: HeartRateSeries, the histories of
+            the patients in arrays["segment_ids"], which the arrays left out
+
+        Returns:
+            store (PatientStore): a store holding 1 record per patient
+        """
+        histories = {} if histories is None else histories
+        missing = set(np.asarray(arrays.get('segment_ids', []),
+                                 dtype=np.int64).tolist()) - set(histories)
+        if missing:
+            raise ValueError('No history given for the patients {}'.format(
+                sorted(missing)))
+        store = cls(segments=segments)
+        offsets = np.asarray(arrays['offsets'], dtype=np.int64)
+        timestamps = np.asarray(arrays['timestamps'], dtype=TIMESTAMP_DTYPE)
+        heart_rates = np.asarray(arrays['heart_rates'],
+                                 dtype=HEART_RATE_DTYPE)
+        ages = np.asarray(arrays['patient_age'], dtype=np.int64)
+        flags = tachycardic_mask(np.repeat(ages, np.diff(offsets)),
+                                 heart_rates)
+        event_offsets = np.concatenate([[0], np.cumsum(flags)])[offsets]
+        event_timestamps = timestamps[flags]
+        event_heart_rates = heart_rates[flags]
+        counts = np.diff(offsets)
+        last = np.maximum(offsets[1:] - 1, 0)  # The latest reading of every
+        # patient, only used for the patients with readings
+        latest = zip(timestamps[last].tolist(), heart_rates[last].tolist(),
+                     flags[last].tolist()) if len(timestamps) else \
+            iter([None] * len(ages))
+
+        mapped = {}  # Index of the patient: its history in a segment file
+        if segments is not None:
+            spilled = counts > segments.max_readings
+            for i in np.flatnonzero(spilled).tolist():
+                mapped[i] = segments.create(
+                    int(arrays['patient_id'][i]),
+                    timestamps[offsets[i]:offsets[i + 1]],
+                    heart_rates[offsets[i]:offsets[i + 1]])
+            if mapped:  # Only the other histories are kept in memory
+                keep = np.repeat(~spilled, counts)
+                timestamps, heart_rates = timestamps[keep], heart_rates[keep]
+                offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+                np.cumsum(np.where(spilled, 0, counts), out=offsets[1:])
+        prefixes, sums, sums_sq, mins, maxs = _group_aggregates(heart_rates,
+                                                                offsets)
+        event_prefixes, event_sums, event_sums_sq, event_mins, event_maxs = \
+            _group_aggregates(event_heart_rates, event_offsets)
+
+        restored = []  # The records that got a history of histories
+        collecting = gc.isenabled()
+        gc.disable()  # The loop only makes objects that stay alive, so the
+        # collector would scan all of them again and again for nothing
+        try:
+            for i, (patient_id, age, attending_username, has_history, count,
+                    start, end, event_start, event_end, latest_reading) in \
+                    enumerate(zip(arrays['patient_id'].tolist(),
+                                  ages.tolist(),
+                                  arrays['attending_username'].tolist(),
+                                  arrays['has_history'].tolist(),
+                                  counts.tolist(), offsets[:-1].tolist(),
+                                  offsets[1:].tolist(),
+                                  event_offsets[:-1].tolist(),
+                                  event_offsets[1:].tolist(), latest)):
+                record = {'patient_id': patient_id,
+                          'attending_username': attending_username,
+                          'patient_age': age, 'heart_rate_history': None,
+                          'latest': None, 'tachycardia_events': None}
+                if has_history and patient_id in histories:  # The
+                    # arrays hold none of its readings
+                    record['heart_rate_history'] = histories[patient_id]
+                    cls._build_events(record)
+                    restored.append(record)
+                    if len(histories[patient_id]) != 0:
+                        timestamp, heart_rate = histories[patient_id].latest()
+                        cls.set_latest(record, timestamp, heart_rate,
+                                       tachycardic_mask(age, [heart_rate])[0])
+                elif has_history:
+                    record['heart_rate_history'] = mapped[i] if \
+                        i in mapped else HeartRateSeries._from_parts(
+                            timestamps[start:end], heart_rates[start:end],
+                            prefixes[start + i:end + i + 1], sums[i],
+                            sums_sq[i], mins[i], maxs[i])
+                    record['tachycardia_events'] = \
+                        HeartRateSeries._from_parts(
+                            event_timestamps[event_start:event_end],
+                            event_heart_rates[event_start:event_end],
+                            event_prefixes[event_start + i:
+                                           event_end + i + 1],
+                            event_sums[i], event_sums_sq[i], event_mins[i],
+                            event_maxs[i])
+                    if count != 0:
+                        cls.set_latest(record, *latest_reading)
+                store.patients[patient_id] = record
+                store.by_attending.setdefault(attending_username, {})[
+                    patient_id] = record
+        finally:
+            if collecting:
+                gc.enable()
+
+        event_patient_ids = np.repeat(
+            np.asarray(arrays['patient_id'], dtype=np.int64),
+            np.diff(event_offsets))
+        if restored:
+            events = [r['tachycardia_events'] for r in restored]
+            event_timestamps = np.concatenate(
+                [event_timestamps] + [e.timestamps() for e in events])
+            event_heart_rates = np.concatenate(
+                [event_heart_rates] + [e.heart_rates() for e in events])
+            event_patient_ids = np.concatenate(
+                [event_patient_ids] + [np.full(len(e), r['patient_id'])
+                                       for r, e in zip(restored, events)])
+        store.tachycardia_log._assign(
+            event_timestamps, event_patient_ids,
+            event_heart_rates)  # Sorted once for all the patients
+        return store
+
+    @classmethod
+    def from_frame(cls, frame, segments=None):
+        """Build a store from a dataframe with the patient_db columns
+
+        Args:
+            frame (df): a pandas dataframe with the columns patient_id,
+            attending_username, patient_age and heart_rate_history where the
+            heart_rate_history cells are dicts (or nan for no history)
+            segments (SegmentDirectory): where the histories go once they
+            grow too long, or None to keep every history in memory
+
+        Returns:
+            store (PatientStore): a store holding 1 record per row
+        """
+        store = cls(segments=segments)
+        for row in frame.to_dict('records'):
+            if type(row.get('heart_rate_history')) is dict:
+                row['heart_rate_history'] = HeartRateSeries.from_dict(
+                    row['heart_rate_history'])
+            else:
+                row['heart_rate_history'] = None  # nan means no history yet
+            row['patient_id'] = int(row['patient_id'])
+            row['patient_age'] = int(row['patient_age'])
+            store._insert(row)
+        store.tachycardia_log = TachycardiaEventLog.from_records(
+            store.records())  # Sorted once for all the patients
+        return store
+
+
+class PhysicianStore:
+    """In-memory physician store keyed by attending_username
+
+    Every physician is kept as 1 record dict in the format of {
+    "attending_username": <str>, "attending_email": <str>,
+    "attending_phone": <str>} inside a dict keyed by the attending_username,
+    so resolving a physician for an alert or checking a duplicate username
+    is a hash lookup that doesn't scale with the physician roster.
+    Registering a physician holds registry_lock.write() and looking one up
+    holds registry_lock.read()
+    """
+
+    columns = ['attending_username', 'attending_email', 'attending_phone']
+
+    def __init__(self):
+        self.physicians = {}
+        self.registry_lock = RWLock()
+
+    def __len__(self):
+        return len(self.physicians)
+
+    def __contains__(self, attending_username):
+        return attending_username in self.physicians
+
+    def get(self, attending_username):
+        """Get the record of a physician
+
+        Args:
+            attending_username (str): the username of the physician
+
+        Returns:
+            record (dict or None): the record of that physician, or None if
+            the username is not registered
+        """
+        return self.physicians.get(attending_username)
+
+    def add(self, in_data):
+        """Add a new physician record into the store
+
+        Args:
+            in_data (dict): the physician data in the format of {
+            "attending_username": <str>, "attending_email": <str>,
+            "attending_phone": <str>}
+
+        Returns:
+            record (dict): the newly added record
+        """
+        record = {column: in_data[column] for column in self.columns}
+        self.physicians[record['attending_username']] = record
+        return record
+
+    def records(self):
+        """Iterate over all the physician records in registration order
+
+        Returns:
+            (iterator of dict): every physician record in the store
+        """
+        return iter(self.physicians.values())
+
+    def to_frame(self):
+        """Build a DataFrame view of the store for the admin reports
+
+        Returns:
+            frame (df): a pandas dataframe with the columns
+            attending_username, attending_email and attending_phone
+        """
+        return pd.DataFrame(list(self.physicians.values()),
+                            columns=self.columns)
+
+    @classmethod
+    def from_frame(cls, frame):
+        """Build a store from a dataframe with the physician_db columns
+
+        Args:
+            frame (df): a pandas dataframe with the columns
+            attending_username, attending_email and attending_phone
+
+        Returns:
+            store (PhysicianStore): a store holding 1 record per row
+        """
+        store = cls()
+        for row in frame.to_dict('records'):
+            store.add(row)
+        return store
@@ -0,0 +1,78 @@
+import numpy as np
+
+# The tachycardia threshold in bpm for every age in years, see
+# https://www.wikiwand.com/en/Tachycardic#Diagnosis
+# A heart rate higher than the threshold of the age is tachycardic
+AGE_THRESHOLDS = [
+    (2, 151),  # Ages up to 2-yr-old, inclusive. Belows are the same
+    (4, 137),  # Ages 3 and 4
+    (7, 133),  # Ages 5, 6 and 7
+    (11, 130),  # Ages 8 to 11
+    (15, 119)  # Ages 12 to 15
+]
+ADULT_THRESHOLD = 100  # Older than 15-yr-old, the threshold is 100 bpm
+
+
+def build_threshold_table():
+    """Build the age-to-threshold lookup array from AGE_THRESHOLDS
+
+    Returns:
+        table (np.ndarray of int16): table[age] is the threshold in bpm for
+        the age, for every age from 0 up to the last age of AGE_THRESHOLDS
+        plus 1, which holds ADULT_THRESHOLD for every older age
+    """
+    last_age = AGE_THRESHOLDS[-1][0]
+    table = np.full(last_age + 2, ADULT_THRESHOLD, dtype=np.int16)
+    first_age = 0
+    for age, threshold in AGE_THRESHOLDS:
+        table[first_age:age + 1] = threshold
+        first_age = age + 1
+    table.flags.writeable = False
+    return table
+
+
+THRESHOLD_TABLE = build_threshold_table()  # Built once at import
+OLDEST_AGE_INDEX = len(THRESHOLD_TABLE) - 1
+
+
+def tachycardia_threshold(age):
+    """The tachycardia threshold for 1 age by 1 lookup
+
+    Args:
+        age (int): patient age in years
+
+    Returns:
+        (int): the threshold in bpm
+    """
+    return int(THRESHOLD_TABLE[min(max(int(age), 0), OLDEST_AGE_INDEX)])
+
+
+def is_tachycardic(age, heart_rate):
+    """Judge whether 1 heart rate is tachycardic based on the age
+
+    Args:
+        age (int): patient age in years
+        heart_rate (int): heart rate in bpm
+
+    Returns:
+        (bool): True if heart_rate is higher than the threshold of the age
+    """
+    return heart_rate > tachycardia_threshold(age)
+
+
+def tachycardic_mask(ages, heart_rates):
+    """Judge many heart rates at once based on the ages
+
+    This is the vectorized form of is_tachycardic(). ages and heart_rates
+    are broadcast against each other, so 1 age can be given for all the
+    heart rates of a patient
+
+    Args:
+        ages (np.ndarray or int): patient ages in years
+        heart_rates (np.ndarray or int): heart rates in bpm
+
+    Returns:
+        (np.ndarray of bool): True where the heart rate is tachycardic
+    """
+    index = np.clip(np.asarray(ages), 0, OLDEST_AGE_INDEX)
+    return np.asarray(heart_rates) > THRESHOLD_TABLE[index]
@@ -0,0 +1,291 @@
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+FRAME_HEADER = struct.Struct('<II')  # Length and CRC-32 of the payload
+
+
+def encode_frame(entry):
+    """Encode 1 log entry as a checksummed frame
+
+    Args:
+        entry (dict): a json-serializable entry
+
+    Returns:
+        (bytes): the length and the CRC-32 of the payload as 2 little-endian
+        uint32, followed by the payload, the compact json of entry
+    """
+    payload = json.dumps(entry, separators=(',', ':')).encode()
+    return FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_frames(f):
+    """Decode the frames of a log file until the first bad one
+
+    Args:
+        f (file): a binary file open for reading at the first frame
+
+    Returns:
+        (generator of tuple): (entry, end) of every good frame, where end is
+        the offset right after it. A frame cut short by a crash or with a
+        wrong checksum ends the log
+    """
+    end = f.tell()
+    while True:
+        header = f.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            return
+        length, crc = FRAME_HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        try:
+            entry = json.loads(payload)
+        except ValueError:
+            return
+        end += FRAME_HEADER.size + length
+        yield entry, end
+
+
+class WriteAheadLog:
+    """Append-only, checksummed log of the changes to the stores
+
+    Every change is 1 frame (see encode_frame()) written to the file
+    before the request that made it is answered. Writing a frame only
+    copies it into the file buffer, and a flusher thread makes the frames
+    durable with 1 fsync per group: it waits sync_interval seconds for more
+    frames to come and then syncs all of them at once, so many requests
+    share 1 fsync and a frame costs microseconds instead of a disk write.
+    A request calls sync() after it released its locks to wait for the
+    group its frames are in.
+
+    If a flush or an fsync fails, e.g. the disk is full, the error is kept
+    in error and the flusher stops: after a failed fsync the kernel may
+    have dropped the dirty pages, so syncing again could report frames as
+    durable that never reached the disk. From then on nothing is written
+    and sync() returns False at once, so the requests can answer 503
+    instead of waiting forever.
+
+    At start-up replay() hands every good frame to the stores again and
+    cuts off a torn frame left at the end by a crash. Once the stores are
+    in a snapshot, checkpoint() drops the frames it covers and starts the
+    log with a "checkpoint" frame naming the snapshot
+    """
+
+    def __init__(self, path, sync_interval=0.002):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.counters = {'entries': 0, 'bytes': 0, 'syncs': 0}
+        self._file = None
+        self.error = None  # The OSError that stopped the flusher
+        self._written = 0  # Sequence number of the last frame written
+        self._synced = 0  # Sequence number of the last durable frame
+        self._cond = threading.Condition()
+        self._sync_lock = threading.Lock()  # Held by the flusher during
+        # fsync, so checkpoint() never swaps the file under it
+        self._thread = None
+        self._local = threading.local()  # The last frame of every thread
+
+    def replay(self, apply, start=0):
+        """Apply every entry of the log file in order
+
+        Args:
+            apply (callable): called with every entry (dict)
+            start (int): the offset of the first frame to apply
+
+        Returns:
+            count (int): the number of entries applied
+        """
+        if not os.path.exists(self.path):
+            return 0
+        count, end = 0, start
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            for entry, end in read_frames(f):
+                apply(entry)
+                count += 1
+            size = f.seek(0, os.SEEK_END)
+        if end < size:  # Drop the torn tail so new frames follow good ones
+            logging.warning('Write-ahead log {} has {} bad bytes after {} '
+                            'entries, dropped.'.format(self.path,
+                                                       size - end, count))
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+        return count
+
+    def open(self):
+        """Open the log file for appending and start the flusher thread"""
+        with self._cond:
+            if self._file is not None:
+                return
+            self._file = open(self.path, 'ab')
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name='hrss-wal-flusher')
+            self._thread.start()
+
+    def close(self):
+        """Sync what is written, stop the flusher and close the file"""
+        with self._cond:
+            f, self._file = self._file, None
+            thread, self._thread = self._thread, None
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join()
+        if f is not None:
+            try:
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+            except OSError as e:
+                self._fail(e)
+        with self._cond:
+            if self.error is None:
+                self._synced = self._written
+            self._cond.notify_all()
+
+    def checkpoint_id(self):
+        """The snapshot named by the first frame of the log file
+
+        Returns:
+            (str or None): the snapshot_id of the "checkpoint" frame the log
+            starts with, or None if it doesn't start with one
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            for entry, _ in read_frames(f):
+                if entry.get('op') == 'checkpoint':
+                    return entry.get('snapshot_id')
+                return None
+        return None
+
+    def tell(self):
+        """The size of the log with every frame appended so far
+
+        Returns:
+            (int): the offset right after the last frame, 0 if the log is
+            not open
+        """
+        with self._cond:
+            if self._file is None:
+                return 0
+            self._file.flush()
+            return self._file.tell()
+
+    def checkpoint(self, offset, snapshot_id):
+        """Drop the frames before offset once a snapshot holds them
+
+        The frames after offset are copied behind a "checkpoint" frame into
+        a new file, which is synced and renamed over the log, so a crash
+        keeps either the old or the new log. Appending waits meanwhile
+
+        Args:
+            offset (int): the tell() when the snapshot was packed
+            snapshot_id (str): the ID of the snapshot
+        """
+        with self._sync_lock, self._cond:
+            if self._file is None or self.error is not None:
+                return
+            self._file.flush()
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                tail = f.read()
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(encode_frame({'op': 'checkpoint',
+                                      'snapshot_id': snapshot_id}))
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._file.close()
+            self._file = open(self.path, 'ab')
+            self._synced = self._written  # The tail was synced with it
+            self._cond.notify_all()
+
+    def append(self, entry):
+        """Write 1 entry into the log without waiting for the disk
+
+        Nothing is written while the log isn't open, e.g. during replay()
+        or in the unit tests, and once it has failed, in which case the
+        next sync() of the thread returns False
+
+        Args:
+            entry (dict): a json-serializable entry with an "op" field
+
+        Returns:
+            seq (int or None): the sequence number of the frame, None if the
+            log is not open
+        """
+        frame = encode_frame(entry)
+        with self._cond:
+            if self.error is not None:  # Never durable, so sync() fails
+                self._local.seq = self._written + 1
+                return None
+            if self._file is None:
+                return None
+            self._file.write(frame)
+            self._written += 1
+            seq = self._written
+            self.counters['entries'] += 1
+            self.counters['bytes'] += len(frame)
+            if self._written == self._synced + 1:  # Wake up the flusher
+                self._cond.notify_all()
+        self._local.seq = seq
+        return seq
+
+    def sync(self, timeout=None):
+        """Wait until the frames this thread appended are durable
+
+        Args:
+            timeout (float or None): seconds to wait, None waits forever
+
+        Returns:
+            (bool): True if they are on disk, False if the timeout passed
+            or the log failed before they were synced
+        """
+        seq = getattr(self._local, 'seq', 0)
+        with self._cond:
+            self._cond.wait_for(lambda: self._synced >= seq or
+                                self.error is not None, timeout)
+            return self._synced >= seq
+
+    def _fail(self, error):
+        # Keep the first error and wake up every thread waiting in sync()
+        with self._cond:
+            if self.error is None:
+                self.error = error
+                logging.error('Write-ahead log {} failed, no change is '
+                              'durable from now on: {}'.format(self.path,
+                                                               error))
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._file is None or
+                                    self._written > self._synced)
+                if self._file is None:
+                    return
+            time.sleep(self.sync_interval)  # Let more frames join the group
+            with self._sync_lock:
+                try:
+                    with self._cond:
+                        if self._file is None:
+                            return
+                        seq = self._written
+                        self._file.flush()
+                        fd = self._file.fileno()
+                    os.fsync(fd)  # Without the lock, so requests keep
+                    # appending
+                except OSError as e:
+                    self._fail(e)
+                    return
+                with self._cond:
+                    self._synced = max(self._synced, seq)
+                    self.counters['syncs'] += 1
+                    self._cond.notify_all()
@@ -0,0 +1,342 @@
+import threading
+import time
+import pytest
+import requests
+
+
+def test_alert_queue_with_stub_server():
+    from hrss_alert import AlertQueue, new_alert_id
+    from hrss_email_stub import start_stub_server, sent_emails
+    server, url = start_stub_server()
+    emails_before = len(sent_emails)
+
+    def sender(payload):
+        r = requests.post(url, json=payload)
+        return r.text, r.status_code
+
+    alert_queue = AlertQueue(sender, workers=2)
+    alert_ids = [new_alert_id() for _ in range(5)]
+    for i, alert_id in enumerate(alert_ids):
+        assert alert_queue.submit(alert_id, {
+            "from_email": 'tachycardic_heart_rate@BLH_hospital.com',
+            "to_email": 'DrBanksJohn@BLH_hospital.com',
+            "subject": 'Alert {}'.format(i), "content": ''})
+    assert alert_queue.submit('bad', {"to_email": 'Dr@BLH_hospital.com'})
+    alert_queue.join()
+    alert_queue.stop()
+    server.shutdown()
+
+    assert len(sent_emails) - emails_before == 5
+    assert alert_queue.result(alert_ids[0]) == {
+        'status': 'sent',
+        'msg': 'E-mail sent to DrBanksJohn@BLH_hospital.com from '
+               'tachycardic_heart_rate@BLH_hospital.com'}
+    assert alert_queue.result('bad') == {'status': 'failed',
+                                         'msg': 'Missing field'}
+    assert alert_queue.result('unknown') is None
+
+
+def test_alert_queue_bounded_depth():
+    from hrss_alert import AlertQueue
+    release = threading.Event()
+    started = threading.Event()
+
+    def sender(payload):
+        started.set()
+        release.wait()
+        return 'ok', 200
+
+    alert_queue = AlertQueue(sender, workers=1, max_depth=2)
+    assert alert_queue.submit('a', {})
+    started.wait()  # 'a' is being sent, so 'b' and 'c' fill the queue
+    assert alert_queue.submit('b', {})
+    assert alert_queue.submit('c', {})
+    assert alert_queue.submit('d', {}) is False
+    assert alert_queue.result('d')['status'] == 'failed'
+    release.set()
+    alert_queue.join()
+    alert_queue.stop()
+    assert [alert_queue.result(a)['status'] for a in 'abc'] == ['sent'] * 3
+
+
+@pytest.mark.parametrize('alert_id, expect_status', [
+    ('known', 200),
+    ('unknown', 400)
+])
+def test_get_alert_status(alert_id, expect_status):
+    from hrss_server import app, alert_queue
+    alert_queue._set_result('known', 'sent', 'E-mail sent')
+
+    r = app.test_client().get('/api/alerts/{}'.format(alert_id))
+
+    assert r.status_code == expect_status
+
+
+def test_circuit_breaker():
+    from hrss_alert import CircuitBreaker
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10,
+                             clock=lambda: now[0])
+    breaker.record_failure()
+    assert breaker.allow() and breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert breaker.allow() is False
+    now[0] = 10.0
+    assert breaker.allow()  # The 1 trial call of half-open
+    assert breaker.allow() is False
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    now[0] = 20.0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+
+
+def test_email_client():
+    import socket
+    from hrss_alert import EmailClient, CircuitBreaker
+    from hrss_email_stub import start_stub_server
+    server, url = start_stub_server()
+    client = EmailClient(url, pool_size=2)
+    msg, status = client.send({"from_email": 'a@BLH_hospital.com',
+                               "to_email": 'b@BLH_hospital.com',
+                               "subject": '', "content": ''})
+    server.shutdown()
+    assert (msg, status) == ('E-mail sent to b@BLH_hospital.com from '
+                             'a@BLH_hospital.com', 200)
+
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()  # Nothing listens on port, so every connection is refused
+    down = EmailClient('http://127.0.0.1:{}/hrss/send_email'.format(port),
+                       connect_timeout=0.5,
+                       breaker=CircuitBreaker(failure_threshold=2))
+    statuses = [down.send({})[1] for _ in range(4)]
+    assert statuses == [503] * 4
+    assert down.metrics() == {'in_flight': 0, 'sent': 0, 'failed': 2,
+                              'short_circuited': 2, 'circuit': 'open'}
+
+
+def test_get_alert_metrics():
+    from hrss_server import app
+
+    r = app.test_client().get('/api/alerts/metrics')
+
+    assert r.status_code == 200
+    assert set(r.get_json()) == {'in_flight', 'sent', 'failed',
+                                 'short_circuited', 'circuit', 'queued',
+                                 'alerted', 'merged', 'summaries'}
+
+
+def test_token_bucket():
+    from hrss_alert import TokenBucket
+    now = [0.0]
+    bucket = TokenBucket(rate=0.5, capacity=2, clock=lambda: now[0])
+    assert [bucket.take() for _ in range(3)] == [True, True, False]
+    now[0] = 2.0  # 1 token refilled
+    assert [bucket.take() for _ in range(2)] == [True, False]
+    now[0] = 100.0  # Never more than capacity
+    assert [bucket.take() for _ in range(3)] == [True, True, False]
+
+
+def test_alert_coalescer():
+    from hrss_alert import AlertCoalescer
+    now = [0.0]
+    coalescer = AlertCoalescer(window=60, rate=0, capacity=3,
+                               clock=lambda: now[0])
+    decisions = [coalescer.offer(1, 'Banks.J', t, 120 + t)
+                 for t in range(100)]  # 1 reading per second
+    assert decisions == [True] + [False] * 99
+    assert coalescer.flush() == []  # The window is still open
+    now[0] = 60.0
+    assert coalescer.flush() == [
+        {'patient_id': 1, 'attending_username': 'Banks.J', 'count': 99,
+         'max_heart_rate': 219, 'first_timestamp': 1,
+         'last_timestamp': 99}]
+    assert coalescer.offer(2, 'Banks.J', 100, 150)  # The last token
+    assert coalescer.offer(1, 'Banks.J', 101, 150) is False  # No token
+    # left, so it waits in the summary
+    now[0] = 120.0
+    assert coalescer.flush() == []  # No token for the summaries either
+    assert coalescer.counters == {'alerted': 2, 'merged': 100,
+                                  'summaries': 1}
+
+
+def test_alert_coalescer_late_reading():
+    from hrss_alert import AlertCoalescer
+    now = [0.0]
+    coalescer = AlertCoalescer(window=60, rate=0, capacity=3,
+                               clock=lambda: now[0])
+    for timestamp in [50, 30, 70, 10, 60]:  # Out of order after retries
+        coalescer.offer(1, 'Banks.J', timestamp, 150)
+    now[0] = 60.0
+    summary, = coalescer.flush()
+    assert (summary['first_timestamp'], summary['last_timestamp']) == \
+        (10, 70)
+
+
+def test_raise_alert_merged():
+    from hrss_server import raise_alert, alert_coalescer
+    record = {"patient_id": 9082, "attending_username": 'Dixon.K'}
+    alert_coalescer.offer(9082, 'Dixon.K', 0, 200)  # Opens the window
+
+    msg = raise_alert({"patient_id": 9082, "heart_rate": 200,
+                       "timestamp": 1667296800000000000}, record)
+    alert_coalescer.open.pop(9082)
+
+    assert msg == 'Tachycardic heart rate merged into the next alert ' \
+                  'summary of patient 9082.'
+
+
+def test_outbox_retry_and_restart(tmp_path):
+    from hrss_alert import Outbox
+    now = [0.0]
+    path, dead_path = str(tmp_path / 'outbox'), str(tmp_path / 'dead')
+    outbox = Outbox(path, dead_path, max_attempts=3, base_delay=1,
+                    clock=lambda: now[0], rng=lambda: 1.0)
+    outbox.open()
+    outbox.add('a', {"n": 1})
+    outbox.add('b', {"n": 2})
+    assert [a for a, _ in outbox.due()] == ['a', 'b']
+    assert outbox.due() == []  # Already handed out
+    assert outbox.record('a', 'E-mail sent', 200) == 'sent'
+    assert outbox.record('b', 'down', 503) == 'retrying'
+    assert outbox.due() == []  # Backoff of 2 ** 1 seconds
+    now[0] = 2.0
+    assert outbox.due() == [('b', {"n": 2})]
+    outbox.release('b')
+
+    restarted = Outbox(path, dead_path, max_attempts=3,
+                       clock=lambda: now[0])
+    restarted.open()
+    assert restarted.list_pending() == [
+        {'alert_id': 'b', 'payload': {"n": 2}, 'attempts': 1}]
+    assert restarted.due() == [('b', {"n": 2})]
+    assert restarted.record('b', 'down', 503) == 'retrying'
+    assert restarted.record('b', 'down', 503) == 'dead'
+    assert len(restarted) == 0
+    assert restarted.dead_letters() == [
+        {'alert_id': 'b', 'payload': {"n": 2}, 'attempts': 3,
+         'msg': 'down', 'status': 503}]
+
+
+def test_outbox_dead_letter_replay(tmp_path):
+    from hrss_alert import Outbox
+    path, dead_path = str(tmp_path / 'outbox'), str(tmp_path / 'dead')
+    outbox = Outbox(path, dead_path)
+    outbox.open()
+    outbox.add('a', {"n": 1})
+    outbox.add('b', {"n": 2})
+    assert outbox.record('a', 'Missing field', 400) == 'dead'  # 4xx won't
+    # be fixed by retrying
+    assert outbox.record('b', 'Missing field', 400) == 'dead'
+    assert outbox.replay(['b']) == ['b']
+    assert [d['alert_id'] for d in outbox.dead_letters()] == ['a']
+    restarted = Outbox(path, dead_path)
+    restarted.open()
+    assert restarted.list_pending() == [
+        {'alert_id': 'b', 'payload': {"n": 2}, 'attempts': 0}]
+    assert outbox.replay() == ['a']
+    assert outbox.dead_letters() == []
+
+
+def test_alert_queue_with_outbox(tmp_path):
+    from hrss_alert import AlertQueue, Outbox
+    answers = [('down', 503), ('down', 503), ('E-mail sent', 200)]
+
+    def sender(payload):
+        return answers.pop(0)
+
+    outbox = Outbox(str(tmp_path / 'outbox'), str(tmp_path / 'dead'),
+                    base_delay=0.01, max_delay=0.01)
+    alert_queue = AlertQueue(sender, workers=1, max_depth=1, outbox=outbox,
+                             retry_interval=0.01)
+    assert alert_queue.submit('a', {"n": 1})
+    deadline = time.monotonic() + 5
+    while alert_queue.result('a')['status'] != 'sent' and \
+            time.monotonic() < deadline:
+        time.sleep(0.01)
+    alert_queue.stop()
+
+    assert alert_queue.result('a') == {'status': 'sent',
+                                       'msg': 'E-mail sent'}
+    assert len(outbox) == 0
+
+
+@pytest.mark.parametrize('in_admin, expect_status', [
+    ({'admin_username': "DavidH", "admin_password": 'davidhe1998'}, 200),
+    ({'admin_username': "DavidH", "admin_password": 'wrong'}, 401),
+    ({'admin_username': "DavidH"}, 400),
+    (['DavidH'], 400)
+])
+def test_alerts_process(tmp_path, in_admin, expect_status):
+    import pandas as pd
+    from hrss_server import alerts_process
+    from hrss_alert import Outbox
+    admin = pd.read_csv('dummy_data/admin_data.csv')
+    outbox = Outbox(str(tmp_path / 'outbox'), str(tmp_path / 'dead'))
+    outbox.open()
+    outbox.add('a', {"n": 1})
+
+    info, status = alerts_process(in_admin, outbox, admin)
+
+    assert status == expect_status
+    if status == 200:
+        assert info == {'pending': [{'alert_id': 'a', 'payload': {"n": 1},
+                                     'attempts': 0}],
+                        'dead': []}
+
+
+@pytest.mark.parametrize('alert_ids, expect_info, expect_status', [
+    (None, ['a', 'b'], 200),
+    (['b'], ['b'], 200),
+    ('b', 'alert_ids must be a list of strings', 400)
+])
+def test_alerts_replay_process(tmp_path, alert_ids, expect_info,
+                               expect_status):
+    import pandas as pd
+    from hrss_server import alerts_replay_process
+    from hrss_alert import Outbox
+    admin = pd.read_csv('dummy_data/admin_data.csv')
+    outbox = Outbox(str(tmp_path / 'outbox'), str(tmp_path / 'dead'))
+    outbox.open()
+    for alert_id in ['a', 'b']:
+        outbox.add(alert_id, {})
+        outbox.record(alert_id, 'Missing field', 400)
+    in_admin = {'admin_username': "DavidH", "admin_password": 'davidhe1998'}
+    if alert_ids is not None:
+        in_admin['alert_ids'] = alert_ids
+
+    info, status = alerts_replay_process(in_admin, outbox, admin)
+
+    assert info == expect_info
+    assert status == expect_status
+
+
+def test_outbox_compact(tmp_path):
+    import json
+    import os
+    from hrss_alert import Outbox
+    path, dead_path = str(tmp_path / 'outbox'), str(tmp_path / 'dead')
+    outbox = Outbox(path, dead_path)
+    assert not os.path.exists(path)  # Nothing on disk before open()
+    outbox.open()
+    for i in range(5):
+        outbox.add(str(i), {"n": i})
+    f = outbox._file
+    for i in range(2):
+        outbox.record(str(i), 'E-mail sent', 200)
+    assert outbox.compact() is False  # 2 sent, 3 pending
+    assert outbox._file is f  # Never reopened to append
+    outbox.record('2', 'Missing field', 400)
+    assert outbox.compact() is True
+    outbox.add('5', {"n": 5})
+    outbox.close()
+
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line['alert_id'] for line in lines] == ['3', '4', '5']
+    outbox.open()  # Reads the compacted file back
+    assert [a['alert_id'] for a in outbox.list_pending()] == ['3', '4', '5']
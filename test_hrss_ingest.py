@@ -0,0 +1,104 @@
+import threading
+
+
+def test_ingest_ring_batches_by_size():
+    from hrss_ingest import IngestRing
+    release = threading.Event()
+    batches = []
+
+    def apply_batch(items):
+        release.wait()  # Holds the writer so the ring fills up
+        batches.append(items)
+        return [item * 2 for item in items]
+
+    ring = IngestRing(apply_batch, capacity=8, max_batch=3, max_delay=60)
+    tickets = [ring.submit(i) for i in range(7)]
+    release.set()
+    ring.stop()  # Commits the last item without waiting for max_delay
+    assert [ticket.wait(5) for ticket in tickets] == \
+        [i * 2 for i in range(7)]
+
+    assert sum(len(batch) for batch in batches) == 7
+    assert max(len(batch) for batch in batches) == 3
+    metrics = ring.metrics()
+    assert metrics['readings'] == 7
+    assert metrics['max_batch_size'] == 3
+    assert metrics['depth'] == 0
+    assert metrics['latency_p99'] >= metrics['latency_p50'] >= 0
+
+
+def test_ingest_ring_batches_by_deadline():
+    from hrss_ingest import IngestRing
+    ring = IngestRing(lambda items: items, max_batch=100, max_delay=0.01)
+    ticket = ring.submit('a')  # Never fills the batch, the deadline
+    # commits it
+    assert ticket.wait(5) == 'a'
+    ring.stop()
+    assert ring.metrics()['batches'] == 1
+
+
+def test_ingest_ring_full():
+    from hrss_ingest import IngestRing
+    release = threading.Event()
+    started = threading.Event()
+
+    def apply_batch(items):
+        started.set()
+        release.wait()
+        return items
+
+    ring = IngestRing(apply_batch, capacity=2, max_batch=1, max_delay=0)
+    first = ring.submit(0)
+    started.wait()  # 0 is being committed, so 1 and 2 fill the ring
+    assert ring.submit(1) is not None
+    assert ring.submit(2) is not None
+    assert ring.submit(3) is None
+    release.set()
+    assert first.wait(5) == 0
+    ring.stop()
+    assert ring.metrics()['rejected'] == 1
+
+
+def test_ingest_ring_failed_batch():
+    from hrss_ingest import IngestRing
+
+    def apply_batch(items):
+        raise ValueError('bad batch')
+
+    ring = IngestRing(apply_batch, max_delay=0)
+    assert ring.submit(1).wait(5) == ('The reading could not be '
+                                      'committed.', 500)
+    ring.stop()
+
+
+def test_iter_ndjson():
+    import io
+    from hrss_ingest import iter_ndjson
+    stream = io.BytesIO(b'{"a": 1}\n\n' + b'x' * 50 + b'\n{bad\n[2]\n' +
+                        b'[' + b' ' * 18 + b']\n{"b": 2}')
+
+    lines = list(iter_ndjson(stream, max_line=20))
+
+    assert lines == [(1, {'a': 1}, None),
+                     (2, None, 'The line is longer than 20 bytes.'),
+                     (3, None, 'The line is not valid JSON.'),
+                     (4, [2], None),
+                     (5, [], None),  # Exactly 20 bytes
+                     (6, {'b': 2}, None)]
+
+
+def test_iter_csv():
+    import io
+    from hrss_ingest import iter_csv
+    stream = io.BytesIO(b'patient_id, heart_rate,timestamp\n'
+                        b'1,70,2020-01-01 00:00:00\n\n'
+                        b'2,"80",\n'
+                        b'3,90\n' + b'x' * 50 + b'\n')
+
+    lines = list(iter_csv(stream, max_line=40))
+
+    assert lines == [(1, {'patient_id': '1', 'heart_rate': '70',
+                          'timestamp': '2020-01-01 00:00:00'}, None),
+                     (2, {'patient_id': '2', 'heart_rate': '80'}, None),
+                     (3, None, 'The row has 2 fields, the header has 3.'),
+                     (4, None, 'The line is longer than 40 bytes.')]
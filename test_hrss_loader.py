@@ -0,0 +1,127 @@
+import pandas as pd
+
+
+def test_load_patients_mix_data(tmp_path):
+    from ast import literal_eval
+    from hrss_loader import load_patients
+    quarantine_path = str(tmp_path / 'quarantine.csv')
+    store, report = load_patients('unit_test_data/patients_mix_data.csv',
+                                  quarantine_path=quarantine_path,
+                                  workers=1, chunksize=7)
+    assert report['rows'] == 50
+    assert report['loaded'] == 25
+    assert report['quarantined'] == 25
+    assert len(store) == 25
+
+    quarantine = pd.read_csv(quarantine_path, dtype=str)
+    assert len(quarantine) == 25
+    row = quarantine[quarantine['patient_id'] == '7'].iloc[0]
+    assert row['row'] == '2'
+    assert row['reason'] == 'patient_age must be an int; heart_rate_history ' \
+                            'has a heart rate that is not an int'
+    assert '28j' in quarantine['patient_id'].tolist()
+    assert 19 not in store  # '76' is fine but 'F110' is not
+
+    frame = pd.read_csv('unit_test_data/patients_mix_data.csv', dtype=str)
+    expected = literal_eval(frame.loc[0, 'heart_rate_history'])
+    assert store.get(2)['heart_rate_history'].to_dict() == expected
+
+
+def test_load_patients_clean_data():
+    from ast import literal_eval
+    from hrss_loader import load_patients
+    from hrss_store import PatientStore, PhysicianStore
+    physicians = PhysicianStore.from_frame(
+        pd.read_csv('dummy_data/physicians_data.csv'))
+    store, report = load_patients('dummy_data/patients_clean_data.csv',
+                                  physicians=physicians, workers=1)
+    assert report['quarantined'] == 0
+
+    frame = pd.read_csv('dummy_data/patients_clean_data.csv')
+    frame['heart_rate_history'] = frame['heart_rate_history'].apply(
+        literal_eval)
+    expected = PatientStore.from_frame(frame)
+    assert len(store) == len(expected)
+    for record in expected.records():
+        loaded = store.get(record['patient_id'])
+        assert loaded['attending_username'] == record['attending_username']
+        assert loaded['patient_age'] == record['patient_age']
+        assert loaded['heart_rate_history'].to_dict() == \
+            record['heart_rate_history'].to_dict()
+        assert loaded['latest']['timestamp'] == \
+            record['heart_rate_history'].latest()[0]
+    assert len(store.tachycardia_log) == len(expected.tachycardia_log)
+
+
+def test_load_patients_pool(tmp_path):
+    from hrss_loader import load_patients
+    from hrss_store import PhysicianStore
+    path = str(tmp_path / 'patients.csv')
+    with open(path, 'w') as f:
+        f.write('patient_id,attending_username,patient_age,'
+                'heart_rate_history\n'
+                '1,Smith.J,40,"{\'2020-01-01 00:00:02\': 90, '
+                '\'2020-01-01 00:00:01\': \'80\'}"\n'
+                '2,Smith.J,40,\n'
+                '1,Smith.J,41,{}\n'
+                '3,Nobody.N,40,{}\n'
+                '4,Smith.J,0,{}\n'
+                '5,Smith.J,40,"{\'2020-13-01 00:00:00\': 90}"\n'
+                '6,Smith.J,40,"{\'2020-01-01 00:00:00\': 99999}"\n'
+                '7,Smith.J,40,[1 2]\n')
+    physicians = PhysicianStore()
+    physicians.add({'attending_username': 'Smith.J',
+                    'attending_email': 'smith@gmail.com',
+                    'attending_phone': '919-000-0000'})
+    store, report = load_patients(path, physicians=physicians,
+                                  quarantine_path=str(tmp_path / 'q.csv'),
+                                  workers=2, chunksize=2)
+    assert sorted(store.patients) == [1, 2]
+    assert store.get(1)['heart_rate_history'].heart_rates().tolist() == \
+        [80, 90]  # Sorted by time
+    assert store.get(2)['heart_rate_history'] is None
+    assert report['readings'] == 2
+
+    reasons = pd.read_csv(str(tmp_path / 'q.csv')).set_index('row')['reason']
+    assert reasons[3] == 'patient_id is already in use'
+    assert reasons[4] == 'attending_username does not exist'
+    assert reasons[5] == 'patient_age must be at least 1'
+    assert reasons[6] == 'heart_rate_history has a time str that is not ' \
+                         'yyyy-mm-dd hh:mm:ss'
+    assert reasons[7] == 'heart_rate_history has a heart rate out of range'
+    assert reasons[8] == 'heart_rate_history must be a dict of time strs ' \
+                         'to heart rates'
+
+
+def test_main_replace(tmp_path):
+    import os
+    import pytest
+    from hrss_loader import main
+    from hrss_snapshot import read_snapshot
+    admins = str(tmp_path / 'admins.csv')
+    pd.DataFrame([['DavidH', 'davidhe1998']],
+                 columns=['admin_username', 'admin_password']).to_csv(
+        admins, index=False)
+    snapshot = str(tmp_path / 'snapshot.npz')
+    wal = str(tmp_path / 'wal.log')
+    args = ['unit_test_data/patients_mix_data.csv', '--snapshot', snapshot,
+            '--wal', wal, '--quarantine', str(tmp_path / 'q.csv'),
+            '--workers', '1']
+
+    assert main(args + ['--admins', admins]) == 0
+    with pytest.raises(SystemExit):  # The snapshot holds data
+        main(args)
+    with open(wal, 'wb') as f:
+        f.write(b'changes')
+    assert main(args + ['--replace']) == 0
+
+    assert not os.path.exists(wal)
+    patients, _, admin_db, _, wal_offset = read_snapshot(snapshot)
+    assert len(patients) == 25
+    assert wal_offset == 0
+    assert admin_db.values.tolist() == [['DavidH', 'davidhe1998']]
+    os.remove(snapshot)
+    with open(wal, 'wb') as f:
+        f.write(b'changes')
+    with pytest.raises(SystemExit):  # The log holds data
+        main(args)
@@ -0,0 +1,80 @@
+import numpy as np
+
+
+def test_mapped_series_append_and_views(tmp_path):
+    from hrss_segments import MappedHeartRateSeries
+    path = str(tmp_path / '1')
+    series = MappedHeartRateSeries(path, capacity=4)
+    for t, h in [(10, 80), (30, 100), (20, 90), (40, 70), (50, 110)]:
+        series.append(t, h)  # 1 late reading and 1 growth of the file
+    assert series.timestamps().tolist() == [10, 20, 30, 40, 50]
+    assert series.heart_rates().tolist() == [80, 90, 100, 70, 110]
+    assert series.window_mean(10, 40) == 95
+    assert series.stats()['max'] == 110
+    assert isinstance(series.timestamps().base, np.memmap)  # A view over
+    # the file, not a copy
+
+    assert np.fromfile(path + '.ts', dtype='<i8')[:5].tolist() == \
+        [10, 20, 30, 40, 50]
+    assert np.fromfile(path + '.sum', dtype='<i8')[:6].tolist() == \
+        [0, 80, 170, 270, 340, 450]
+
+
+def test_mapped_series_extend_and_copy(tmp_path):
+    from hrss_segments import MappedHeartRateSeries
+    from hrss_store import HeartRateSeries
+    series = MappedHeartRateSeries(str(tmp_path / '1'), capacity=2)
+    series.extend(np.arange(100, 200, 10), np.arange(60, 70))
+    series.extend([105, 130], [120, 50])  # Merged, and 130 replaced
+    assert len(series) == 11
+    assert series.since(120, 150).tolist() == [50, 64]
+    copied = series.copy()
+    assert type(copied) is HeartRateSeries
+    assert copied.to_dict() == series.to_dict()
+
+
+def test_segment_directory_spill(tmp_path):
+    import os
+    from hrss_segments import SegmentDirectory, MappedHeartRateSeries
+    from hrss_store import HeartRateSeries
+    segments = SegmentDirectory(str(tmp_path / 'segments'), max_readings=3)
+    history = HeartRateSeries.from_arrays([1, 2, 3], [60, 70, 80])
+    assert segments.spill(5, history) is history
+    history.append(4, 90)
+    mapped = segments.spill(5, history)
+    assert type(mapped) is MappedHeartRateSeries
+    assert os.path.exists(str(tmp_path / 'segments' / '5.ts'))
+    assert not os.path.exists(str(tmp_path / 'segments' / '5.tmp.ts'))
+    assert mapped.stats() == history.stats()
+    assert segments.spill(5, mapped) is mapped
+
+
+def test_patient_store_spill(tmp_path):
+    from hrss_segments import SegmentDirectory, MappedHeartRateSeries
+    from hrss_store import PatientStore
+    store = PatientStore(
+        segments=SegmentDirectory(str(tmp_path), max_readings=4))
+    for patient_id in [1, 2]:
+        store.add({'patient_id': patient_id, 'attending_username': 'Tom',
+                   'patient_age': 50})
+    record = store.get(1)
+    store.add_readings(record, [1, 2, 3], [60, 170, 80])
+    assert type(record['heart_rate_history']) is not MappedHeartRateSeries
+    store.add_reading(record, 4, 90, False)
+    store.add_reading(record, 5, 180, True)
+    assert type(record['heart_rate_history']) is MappedHeartRateSeries
+    assert record['latest']['timestamp'] == 5
+    assert record['tachycardia_events'].timestamps().tolist() == [2, 5]
+    store.add_readings(store.get(2), [1, 2, 3, 4, 5], [60] * 5)
+    assert type(store.get(2)['heart_rate_history']) is MappedHeartRateSeries
+
+    loaded = PatientStore.from_arrays(
+        store.to_arrays(),
+        segments=SegmentDirectory(str(tmp_path / 'loaded'), max_readings=4))
+    store.add_readings(store.get(2), [6], [60])
+    for patient_id in [1, 2]:
+        history = loaded.get(patient_id)['heart_rate_history']
+        assert type(history) is MappedHeartRateSeries
+        assert len(history) == 5
+    assert loaded.get(1)['latest'] == store.get(1)['latest']
+    assert [g[0] for g in loaded.tachycardia_log.since(0)] == [1]
@@ -3,6 +3,7 @@ import pandas as pd
 from testfixtures import LogCapture
 import numpy as np
 import logging
+import re
 from ast import literal_eval
 
 # **************************Junqi Lu starts**************************
@@ -727,29 +728,28 @@ def test_new_patient_value_validate(in_data, expect_judgement,
 @pytest.mark.parametrize('in_data, expect_new_row_list', [
     ({"patient_id": 39, "attending_username": 'Hernandez.O',
       "patient_age": 25},
-     [39, 'Hernandez.O', 25, np.nan]),
+     [39, 'Hernandez.O', 25, None]),
     ({"patient_id": '39', "attending_username": 'Hernandez.O',
-      "patient_age": 25}, [39, 'Hernandez.O', 25, np.nan]),
+      "patient_age": 25}, [39, 'Hernandez.O', 25, None]),
     ({"patient_id": 39, "attending_username": 'Hernandez.O',
       "patient_age": '25'},
-     [39, 'Hernandez.O', 25, np.nan]),
+     [39, 'Hernandez.O', 25, None]),
     ({"patient_id": '39', "attending_username": 'Hernandez.O',
       "patient_age": '25'},
-     [39, 'Hernandez.O', 25, np.nan])
+     [39, 'Hernandez.O', 25, None])
 ])
 def test_add_new_patient(in_data, expect_new_row_list):
-    from hrss_server import add_new_patient, patient_db
+    from hrss_server import add_new_patient
 
-    patient_db = add_new_patient(in_data)  # I have to keep the return
-    # patient_db inside add_new_patient() and that's why I have the
-    # "patient_db =" at the beginning of this line
+    patient_db = add_new_patient(in_data)
 
-    answer = patient_db.tail(1).values.flatten().tolist()  # This returns
-    # the values in the last row as a list
+    record = patient_db.get(39)
+    answer = [record['patient_id'], record['attending_username'],
+              record['patient_age'], record['heart_rate_history']]  # The
+    # values in the newly added record as a list
 
-    patient_db.drop(patient_db.tail(1).index, inplace=True)  # Drop the last
-    # row, aka the newly added row so this test function doesn't modify the
-    # patient_db when it's finished
+    patient_db.remove(39)  # Drop the newly added record so this test
+    # function doesn't modify the patient_db when it's finished
 
     assert answer == expect_new_row_list
 
@@ -954,8 +954,24 @@ def test_new_heart_rate_type_validate(in_data, expect_judgement,
     ({"patient_id": '820', "heart_rate": 60}, False, ['This patient_id does '
                                                       'not exist.']),
     ({"patient_id": '820', "heart_rate": '60'}, False, ['This patient_id does '
-                                                        'not exist.'])
-
+                                                        'not exist.']),
+    ({"patient_id": 82, "heart_rate": '40000'}, False, ['This heart_rate is '
+                                                        'out of range.']),
+    ({"patient_id": 82, "heart_rate": 60,
+      "timestamp": '2022-11-01 10:00:00.123456789'}, True, []),
+    ({"patient_id": 82, "heart_rate": 60,
+      "timestamp": '2022-13-01 10:00:00'}, False, ['This timestamp is not a '
+                                                   'valid time.']),
+    ({"patient_id": 82, "heart_rate": 60,
+      "timestamp": '2019-07-25 11:35:24'}, True, []),  # Just in the
+    # reorder window
+    ({"patient_id": 82, "heart_rate": 60,
+      "timestamp": '2019-07-25 11:35:23'}, False, [
+        'This heart rate is more than 3600 seconds older than the latest '
+        'heart rate of the patient.']),
+    ({"patient_id": 82, "heart_rate": 60,
+      "timestamp": '2099-01-01 00:00:00'}, False, [
+        'This timestamp is more than 5 seconds ahead of the server clock.'])
 ])
 def test_new_heart_rate_value_validate(in_data, expect_judgement,
                                        expect_msg_list):
@@ -966,28 +982,6 @@ def test_new_heart_rate_value_validate(in_data, expect_judgement,
     assert msg_list == expect_msg_list
 
 
-@pytest.mark.parametrize('heart_rate_history_dict, expect', [
-    ({'2016-07-10 13:12:48': 88, '2017-08-27 14:52:38': 74, '2017-10-07 '
-                                                            '06:29:22': 114,
-      '2019-07-25 12:35:24': 111}, {'2016-07-10 13:12:48': 88,
-                                    '2017-08-27 14:52:38': 74,
-                                    '2017-10-07 06:29:22': 114,
-                                    '2019-07-25 12:35:24': 111}),
-    ({'2019-07-25 12:35:24': 111, '2017-10-07 06:29:22': 114, '2017-08-27 '
-                                                              '14:52:38': 74,
-      '2016-07-10 13:12:48': 88}, {'2016-07-10 13:12:48': 88,
-                                   '2017-08-27 14:52:38': 74,
-                                   '2017-10-07 06:29:22': 114,
-                                   '2019-07-25 12:35:24': 111}),
-    ({'2019-07-25 12:35:24': 111}, {'2019-07-25 12:35:24': 111})
-])
-def test_sort_heart_rate_history_dict(heart_rate_history_dict, expect):
-    from hrss_server import sort_heart_rate_history_dict
-    answer = sort_heart_rate_history_dict(heart_rate_history_dict)
-
-    assert answer == expect
-
-
 @pytest.mark.parametrize('in_data, history_dict_exist, '
                          'expected_new_heart_rate', [
                              ({"patient_id": 62, "heart_rate": 72}, True, 72),
@@ -1008,59 +1002,58 @@ def test_sort_heart_rate_history_dict(heart_rate_history_dict, expect):
                          ])
 def test_add_new_heart_rate(in_data, history_dict_exist,
                             expected_new_heart_rate):
-    from hrss_server import add_new_heart_rate, \
-        sort_heart_rate_history_dict, patient_db, current_time_str
+    from hrss_server import add_new_heart_rate, patient_db
 
     # Need the data type conversion below since these are already inside the
     # add_new_heart_rate() but I need these values
     patient_id = int(in_data['patient_id'])
 
-    heart_rate_history_before = patient_db[patient_db['patient_id'] ==
-                                           patient_id][
-        'heart_rate_history'].values[0].copy()  # Using [0] is fine here since
-    # each patient_id has only 1 dict that records all the heart rates. Make
+    record = patient_db.get(patient_id)
+    latest_before = record['latest']
+    heart_rate_history_before = record['heart_rate_history'].copy()  # Make
     # a copy of it so heart_rate_history_before doesn't change after
     # patient_db = add_new_heart_rate(in_data)
 
     add_new_heart_rate(in_data, history_dict_exist)
-    heart_rate_history = patient_db[patient_db['patient_id'] ==
-                                    patient_id][
-        'heart_rate_history'].values[0]  # Using [0] is fine here since each
-    # patient_id has only 1 dict that records all the heart rates
-    sorted_heart_rate_history = sort_heart_rate_history_dict(
-        heart_rate_history)
-
-    sorted_heart_rate_history_list = list(sorted_heart_rate_history)
-    latest_date_time = sorted_heart_rate_history_list[-1]
+    heart_rate_history = record['heart_rate_history']
 
-    answer = sorted_heart_rate_history[latest_date_time]
+    _, answer = heart_rate_history.latest()
 
     # Codes below basically revers the adding of the new heart rate so this
     # test function doesn't change the global database
-    row_index = \
-        patient_db.index[
-            patient_db['patient_id'] == patient_id].values[
-            0]  # Can use this method because all patient_id are unique
-
-    # patient_db.loc[
-    #     row_index, 'heart_rate_history'] = heart_rate_history_before  #
-    # df.loc[] is the correct method to change the value of a cell in a df,
-    # but it will give a ValueError: Incompatible indexer with Series when
-    # the new value is a dict. pd development team is currently working on
-    # this: https://github.com/pandas-dev/pandas/issues/17777
-
-    # A less elegant way of restore the value in that cell
-    patient_db.loc[row_index, 'heart_rate_history'] = [
-        heart_rate_history_before]  # Add in a list of dict
-
-    patient_db['heart_rate_history'] = patient_db['heart_rate_history'].apply(
-        lambda x: x[0] if type(x) == list else x)  # For cells in column
-    # "heart_rate_history", if the value of a cell is a list, convert it
-    # into a dict; otherwise, keep it as it is
+    record['heart_rate_history'] = heart_rate_history_before
+    record['latest'] = latest_before
+    patient_db.index_tachycardia(record)
 
     assert answer == expected_new_heart_rate
 
 
+@pytest.mark.parametrize('heart_rate, expect_new_event', [
+    (200, True),
+    (60, False)
+])
+def test_add_new_heart_rate_tachycardia_event(heart_rate, expect_new_event):
+    from hrss_server import add_new_heart_rate, patient_db
+
+    record = patient_db.get(62)
+    latest_before = record['latest']
+    heart_rate_history_before = record['heart_rate_history'].copy()
+    events_before = len(record['tachycardia_events'])
+
+    add_new_heart_rate({"patient_id": 62, "heart_rate": heart_rate}, True)
+    events = record['tachycardia_events']
+    new_event = len(events) == events_before + 1
+    latest_event = events.latest() if len(events) else None
+
+    record['heart_rate_history'] = heart_rate_history_before
+    record['latest'] = latest_before
+    patient_db.index_tachycardia(record)
+
+    assert new_event == expect_new_event
+    if expect_new_event:
+        assert latest_event[1] == heart_rate
+
+
 @pytest.mark.parametrize('age, heart_rate, expect', [
     (2, 151, False),
     (2, 152, True),
@@ -1103,9 +1096,8 @@ def test_tachycardic_judge(age, heart_rate, expect):
                               'rate history.',
                               200),
                              ([], True, {"patient_id": 82, "heart_rate": 800},
-                              'E-mail sent to '
-                              'DrDixonKathleen@BLH_hospital.com from '
-                              'tachycardic_heart_rate@BLH_hospital.com'
+                              'Alert <alert_id> queued to e-mail '
+                              'DrDixonKathleen@BLH_hospital.com.'
                               '\nPatient with id 82 had a new heart rate '
                               'measurement successfully added into the heart '
                               'rate history.',
@@ -1113,28 +1105,25 @@ def test_tachycardic_judge(age, heart_rate, expect):
                              (
                                      [], True,
                                      {"patient_id": 82, "heart_rate": '900'},
-                                     'E-mail sent to '
-                                     'DrDixonKathleen@BLH_hospital.com from '
-                                     'tachycardic_heart_rate@BLH_hospital'
-                                     '.com\nPatient with id 82 had a new '
+                                     'Alert <alert_id> queued to e-mail '
+                                     'DrDixonKathleen@BLH_hospital.com.'
+                                     '\nPatient with id 82 had a new '
                                      'heart rate measurement successfully '
                                      'added into the heart rate history.',
                                      200),
                              (
                                      [], True,
                                      {"patient_id": '82', "heart_rate": 1000},
-                                     'E-mail sent to '
-                                     'DrDixonKathleen@BLH_hospital.com from '
-                                     'tachycardic_heart_rate@BLH_hospital'
-                                     '.com\nPatient with id 82 had a new '
+                                     'Alert <alert_id> queued to e-mail '
+                                     'DrDixonKathleen@BLH_hospital.com.'
+                                     '\nPatient with id 82 had a new '
                                      'heart rate measurement successfully '
                                      'added into the heart rate history.',
                                      200),
                              ([], True,
                               {"patient_id": '82', "heart_rate": '1100'},
-                              'E-mail sent to '
-                              'DrDixonKathleen@BLH_hospital.com from '
-                              'tachycardic_heart_rate@BLH_hospital.com'
+                              'Alert <alert_id> queued to e-mail '
+                              'DrDixonKathleen@BLH_hospital.com.'
                               '\nPatient with id 82 had a new heart rate '
                               'measurement successfully added into the heart '
                               'rate history.',
@@ -1182,6 +1171,8 @@ def test_post_heart_rate_worker(value_msg_list, value_judgement, in_data,
     out_msg, status = post_heart_rate_worker(value_msg_list,
                                              value_judgement, in_data,
                                              test_mode=True)
+    out_msg = re.sub('[0-9a-f]{32}', '<alert_id>', out_msg)  # The alert ID
+    # is random
 
     assert out_msg == expect_out_msg
     assert status == expect_status
@@ -1192,8 +1183,8 @@ def test_post_heart_rate_worker(value_msg_list, value_judgement, in_data,
                              ([], True, {"patient_id": 82, "heart_rate": 151},
                               ('root', 'WARNING',
                                'Patient with id 82 has a tachycardic heart '
-                               'rate as 151 bpm. An email has been sent to '
-                               'corresponding physician at '
+                               'rate as 151 bpm. An email has been queued '
+                               'to corresponding physician at '
                                'DrDixonKathleen@BLH_hospital.com')),
                              (
                                      [], True,
@@ -1202,7 +1193,7 @@ def test_post_heart_rate_worker(value_msg_list, value_judgement, in_data,
                                       'Patient with id 82 has a tachycardic '
                                       'heart '
                                       'rate as 151 bpm. An email has been '
-                                      'sent to '
+                                      'queued to '
                                       'corresponding physician at '
                                       'DrDixonKathleen@BLH_hospital.com')),
                              (
@@ -1212,15 +1203,15 @@ def test_post_heart_rate_worker(value_msg_list, value_judgement, in_data,
                                       'Patient with id 82 has a tachycardic '
                                       'heart '
                                       'rate as 151 bpm. An email has been '
-                                      'sent to '
+                                      'queued to '
                                       'corresponding physician at '
                                       'DrDixonKathleen@BLH_hospital.com')),
                              ([], True,
                               {"patient_id": '82', "heart_rate": '151'},
                               ('root', 'WARNING',
                                'Patient with id 82 has a tachycardic heart '
-                               'rate as 151 bpm. An email has been sent to '
-                               'corresponding physician at '
+                               'rate as 151 bpm. An email has been queued '
+                               'to corresponding physician at '
                                'DrDixonKathleen@BLH_hospital.com'))
 
                          ])
@@ -1583,17 +1574,6 @@ def test_new_attending_type_validate(in_data, expect_judgement,
     assert type_msg_list == expect_msg_list
 
 
-@pytest.mark.parametrize('hr_list, exp_avg', [
-    ([11, 12, 13, 1999], 508.75),
-    ([110, 111, 1231, 231], 420.75)
-])
-def test_avg_hr_since(hr_list, exp_avg):
-    from hrss_server import avg_hr_since
-    avg = avg_hr_since(hr_list)
-
-    assert avg == exp_avg
-
-
 @pytest.mark.parametrize('in_data, exp_jud, exp_list', [
     ({"patient_id": 1233,
       "heart_rate_average_since": '2016-12-31 11:11:11'},
@@ -1607,7 +1587,11 @@ def test_avg_hr_since(hr_list, exp_avg):
              'field \'heart_rate_average_since\' cannot'
              ' be coerced: time data \'2016:12-31 11:11:11\' '
              'does not match '
-             'format \'%Y-%m-%d %H:%M:%S\'.'])
+             'format \'%Y-%m-%d %H:%M:%S\'.']),
+    ({"patient_id": 1233,
+      "heart_rate_average_since": '2016-12-31 11:11:11',
+      "heart_rate_average_until": '2017-12-31 11:11:11'},
+     True, [])
 ])
 def test_hr_interval_type_validate(in_data, exp_jud, exp_list):
     from hrss_server import hr_interval_type_validate
@@ -1616,12 +1600,76 @@ def test_hr_interval_type_validate(in_data, exp_jud, exp_list):
 
     assert jud == exp_jud
     assert list == exp_list
-    from hrss_server import hr_interval_type_validate
 
-    jud, list = hr_interval_type_validate(in_data)
 
-    assert jud == exp_jud
-    assert list == exp_list
+@pytest.mark.parametrize('in_data, exp_avg, exp_msg', [
+    ({"patient_id": 3,
+      "heart_rate_average_since": '2016-12-31 11:11:11'}, None, ''),
+    ({"patient_id": 3,
+      "heart_rate_average_since": '2016-12-31 11:11:11',
+      "heart_rate_average_until": '2019-12-31 11:11:11'}, None, ''),
+    ({"patient_id": 3,
+      "heart_rate_average_since": '2030-12-31 11:11:11'}, 0,
+     'No heart rates since given time'),
+    ({"patient_id": 3,
+      "heart_rate_average_since": '2019-12-31 11:11:11',
+      "heart_rate_average_until": '2016-12-31 11:11:11'}, 0,
+     'No heart rates since given time')
+])
+def test_hr_interval_worker(in_data, exp_avg, exp_msg):
+    from hrss_server import hr_interval_worker, hr_dict_retriever
+    from hrss_store import time_str_to_epoch
+
+    hr_avg, out_msg, status = hr_interval_worker(True, [], in_data)
+
+    if exp_avg is None:  # Compare with a plain scan of the history
+        since = time_str_to_epoch(in_data['heart_rate_average_since'])
+        until = in_data.get('heart_rate_average_until', '2100-01-01 00:00:00')
+        series = hr_dict_retriever(3)
+        window = [hr for t, hr in zip(series.timestamps(),
+                                      series.heart_rates())
+                  if since < t < time_str_to_epoch(until)]
+        exp_avg = pytest.approx(sum(window) / len(window))
+    assert hr_avg == exp_avg
+    assert out_msg == exp_msg
+    assert status == 200
+
+
+@pytest.mark.parametrize('usr_name, exp_data', [
+    ('Bowen.K', [{'patient_id': 3, 'last_heart_rate': 119,
+                  'last_time': '2020-08-11 17:27:57',
+                  'status': 'tachycardic'},
+                 {'patient_id': 87, 'last_heart_rate': 86,
+                  'last_time': '2019-09-12 06:46:13',
+                  'status': 'not tachycardic'}]),
+    ('Banks.J', [])
+])
+def test_pat_list_att_worker(usr_name, exp_data):
+    from hrss_server import pat_list_att_worker
+
+    pat_data, out_msg, status = pat_list_att_worker([], True, usr_name)
+
+    assert pat_data == exp_data
+    assert status == 200
+
+
+@pytest.mark.parametrize('value_judgement, patient_id, exp_keys, exp_status',
+                         [(True, 3, ['count', 'mean', 'std', 'min', 'max'],
+                           200),
+                          (False, 3, [], 400)])
+def test_stats_hr_worker(value_judgement, patient_id, exp_keys, exp_status):
+    from hrss_server import stats_hr_worker, patient_db
+
+    hr_stats, out_msg, status = stats_hr_worker([], value_judgement,
+                                                patient_id)
+
+    assert list(hr_stats) == exp_keys
+    assert status == exp_status
+    if status == 200:
+        series = patient_db.get(patient_id)['heart_rate_history']
+        assert hr_stats['mean'] == pytest.approx(
+            float(np.mean(series.heart_rates())))
+        assert hr_stats['max'] == int(series.heart_rates().max())
 
 
 # **************************Ramana Balla ends**************************
@@ -1907,6 +1955,7 @@ def test_tachycardia_process_exception(in_admin, expect_info, expect_code):
 
 def test_tachycardia_process_normal():
     from hrss_server import tachycardia_process
+    from hrss_store import PatientStore, PhysicianStore
     test_db = pd.read_csv('dummy_data/patients_clean_data.csv', nrows=2)
     extra = pd.DataFrame(
         {"patient_id": [4, 5, 6],
@@ -1947,7 +1996,8 @@ def test_tachycardia_process_normal():
     test_db1['heart_rate_history'] = test_db1['heart_rate_history'].apply(
         literal_eval)
     test_db1 = pd.concat([test_db1, extra1, empty], ignore_index=True)
-    physician = pd.read_csv('dummy_data/physicians_data.csv')
+    physician = PhysicianStore.from_frame(
+        pd.read_csv('dummy_data/physicians_data.csv'))
     admin = pd.read_csv('dummy_data/admin_data.csv')
 
     in_admin1 = {'admin_username': "DavidH", "admin_password": 'davidhe1998',
@@ -1955,8 +2005,10 @@ def test_tachycardia_process_normal():
     in_admin2 = {'admin_username': "DavidH", "admin_password": 'davidhe1998',
                  "since_time": '2019-03-25 23:30:29'}
 
-    info1, status1 = tachycardia_process(in_admin1, test_db, physician, admin)
-    info2, status2 = tachycardia_process(in_admin2, test_db1, physician, admin)
+    info1, status1 = tachycardia_process(
+        in_admin1, PatientStore.from_frame(test_db), physician, admin)
+    info2, status2 = tachycardia_process(
+        in_admin2, PatientStore.from_frame(test_db1), physician, admin)
     assert info1 == [
         {'patient_id': 2, 'attending_username': 'Dixon.K',
          'attending_email': 'DrDixonKathleen@BLH_hospital.com',
@@ -1977,14 +2029,15 @@ def test_tachycardia_process_normal():
 
 def test_tachycardia_process_empty():
     from hrss_server import tachycardia_process
+    from hrss_store import PatientStore, PhysicianStore
     admin = pd.read_csv('dummy_data/admin_data.csv')
     admin_empty = pd.DataFrame(columns=['admin_username', 'admin_password'])
     patient = pd.read_csv('dummy_data/patients_clean_data.csv', nrows=2)
-    patient_empty = pd.DataFrame(
-        columns=['patient_id', 'attending_username', 'patient_age',
-                 'heart_rate_history'])
-    physician = pd.DataFrame(
-        columns=['attending_username', 'attending_email', 'attending_phone'])
+    patient['heart_rate_history'] = patient['heart_rate_history'].apply(
+        literal_eval)
+    patient = PatientStore.from_frame(patient)
+    patient_empty = PatientStore()
+    physician = PhysicianStore()
     in_admin = {'admin_username': "DavidH", "admin_password": 'davidhe1998',
                 "since_time": "2016-01-01"}
     info1, status1 = tachycardia_process(in_admin, patient_empty, physician,
@@ -2009,3 +2062,332 @@ def test_is_tachycardia(age, bpm, expect):
     result = is_tachycardia(age, bpm)
     assert result == expect
 # **************************Ziwei He ends**************************
+
+
+@pytest.mark.parametrize('in_data, value_judgement, expect_status', [
+    ({"patient_id": 62, "heart_rate": 60}, True, 200),
+    ({"patient_id": 62, "heart_rate": 'sixty'}, False, 400)
+])
+def test_enqueue_heart_rate_worker(in_data, value_judgement, expect_status):
+    from hrss_server import enqueue_heart_rate_worker, patient_db
+    record = patient_db.get(62)
+    latest_before = record['latest']
+    heart_rate_history_before = record['heart_rate_history'].copy()
+
+    out_msg, status = enqueue_heart_rate_worker([], value_judgement,
+                                                in_data)
+    added = len(record['heart_rate_history']) - \
+        len(heart_rate_history_before)
+
+    record['heart_rate_history'] = heart_rate_history_before
+    record['latest'] = latest_before
+    patient_db.index_tachycardia(record)
+
+    assert status == expect_status
+    assert added == (1 if status == 200 else 0)
+
+
+def test_commit_heart_rates_late():
+    from hrss_server import commit_heart_rates, patient_db
+    from hrss_store import time_str_to_epoch
+    record = patient_db.get(62)
+    latest_before = record['latest']
+    heart_rate_history_before = record['heart_rate_history'].copy()
+
+    results = commit_heart_rates([
+        (62, 60, time_str_to_epoch('2020-06-15 11:06:14'), True),
+        (62, 61, time_str_to_epoch('2020-06-15 11:06:15'), True),
+        (62, 62, time_str_to_epoch('2020-06-15 11:06:13'), False)])  # The
+    # server stamped the last one, so it isn't late
+    added = record['heart_rate_history'].to_dict()
+
+    record['heart_rate_history'] = heart_rate_history_before
+    record['latest'] = latest_before
+    patient_db.index_tachycardia(record)
+
+    assert [status for _, status in results] == [400, 200, 200]
+    assert '2020-06-15 11:06:14' not in added
+    assert added['2020-06-15 11:06:15'] == 61
+    assert added['2020-06-15 11:06:13'] == 62
+
+
+def test_heart_rate_records_validate_future():
+    from datetime import datetime, timedelta
+    from hrss_server import heart_rate_records_validate, is_late
+    from hrss_store import datetime_to_epoch
+    soon = (datetime.now() + timedelta(seconds=1)).strftime(
+        '%Y-%m-%d %H:%M:%S')
+    readings = heart_rate_records_validate([
+        {"patient_id": 62, "heart_rate": 80, "timestamp": soon},
+        {"patient_id": 62, "heart_rate": 80,
+         "timestamp": '2099-01-01 00:00:00'}])
+    assert readings['msg'].tolist() == [
+        '', 'This timestamp is more than 5 seconds ahead of the server '
+            'clock.']
+
+    record = {"latest": {"timestamp": datetime_to_epoch(datetime(2099, 1, 1)),
+                         "heart_rate": 60, "tachycardic": False}}
+    assert not is_late(record, datetime_to_epoch(datetime.now()))  # A
+    # future heart rate already in the history doesn't block the present
+
+
+def test_heart_rate_batch_validate():
+    from hrss_server import heart_rate_batch_validate
+    judgement, msg_list, readings = heart_rate_batch_validate([
+        {"patient_id": 62, "heart_rate": 80,
+         "timestamp": '2022-11-01 10:00:00'},
+        {"patient_id": '62', "heart_rate": '70',
+         "timestamp": '2022-11-01 10:00:01'},
+        {"patient_id": 62, "heart_rate": True,
+         "timestamp": '2022-11-01'},
+        {"heart_rate": 40000},
+        ['62', 80],
+        {"patient_id": 1, "heart_rate": 80,
+         "timestamp": '2022-11-01 10:00:00'}])
+
+    assert judgement is True
+    assert readings['msg'].tolist() == [
+        '', '',
+        'Field "heart_rate" must be an int or a str of an int.\n'
+        'Field "timestamp" must be a str in the format of '
+        '"yyyy-mm-dd hh:mm:ss".',
+        'Field "patient_id" is missing.\nField "timestamp" is missing.\n'
+        'This heart_rate is out of range.',
+        'The heart rate record must be a dict.',
+        'This patient_id does not exist.']
+    assert readings['timestamp'][1] == 1667296801000000000
+    assert heart_rate_batch_validate([])[0] is False
+    assert heart_rate_batch_validate({"patient_id": 62})[0] is False
+
+
+def test_post_heart_rate_batch_worker():
+    from hrss_server import heart_rate_batch_validate, \
+        post_heart_rate_batch_worker, patient_db
+    record = patient_db.get(62)
+    history_before = record['heart_rate_history'].to_dict()
+    batch = [{"patient_id": 62, "heart_rate": 60 + i % 100,
+              "timestamp": '2022-01-01 {:02d}:{:02d}:{:02d}'.format(
+                  i // 3600, i // 60 % 60, i % 60)} for i in range(10000)]
+    batch.append({"patient_id": 62, "heart_rate": 'fast',
+                  "timestamp": '2022-01-01 00:00:00'})
+
+    judgement, msg_list, readings = heart_rate_batch_validate(batch)
+
+    out, status = post_heart_rate_batch_worker(msg_list, judgement,
+                                               readings, test_mode=True)
+
+    assert status == 200
+    assert out['added'] == 10000 and out['rejected'] == 1
+    alerts = [r['msg'] for r in out['results'] if 'Alert' in r['msg']]
+    assert len(alerts) == 1  # 1 alert for the whole patient
+    assert out['results'][99]['msg'] == alerts[0]  # The highest one
+    assert record['heart_rate_history'].to_dict() == history_before
+
+
+def test_heart_rate_stream_worker():
+    import json
+    from hrss_server import heart_rate_stream_worker, patient_db
+    history_before = patient_db.get(62)['heart_rate_history'].to_dict()
+    records = [(1, {"patient_id": 62, "heart_rate": 70}, None),
+               (2, {"patient_id": 62}, None),
+               (3, None, 'The line is not valid JSON.'),
+               (4, {"patient_id": 62, "heart_rate": 80}, None)]
+
+    lines = [json.loads(line) for line in heart_rate_stream_worker(
+        records, ack_every=2, ack_interval=60, test_mode=True)]
+
+    assert lines == [
+        {"seq": 2, "status": 400,
+         "msg": 'Field "heart_rate" required field.\n'
+                'Fix and request again.'},
+        {"ack": 2},
+        {"seq": 3, "status": 400,
+         "msg": 'The line is not valid JSON.\nFix and request again.'},
+        {"ack": 4},
+        {"ack": 4, "added": 2, "rejected": 2, "done": True}]
+    assert patient_db.get(62)['heart_rate_history'].to_dict() == \
+        history_before
+
+
+def test_add_new_heart_rate_same_second():
+    from hrss_server import add_new_heart_rate, patient_db
+    record = patient_db.get(62)
+    latest_before = record['latest']
+    heart_rate_history_before = record['heart_rate_history'].copy()
+
+    for heart_rate in [70, 71, 72]:  # Well within 1 second
+        add_new_heart_rate({"patient_id": 62, "heart_rate": heart_rate},
+                           True)
+    add_new_heart_rate({"patient_id": 62, "heart_rate": 73,
+                        "timestamp": '2000-01-01 00:00:00.5'}, True)
+    added = record['heart_rate_history'].to_dict()
+
+    record['heart_rate_history'] = heart_rate_history_before
+    record['latest'] = latest_before
+    patient_db.index_tachycardia(record)
+
+    assert len(added) == len(heart_rate_history_before) + 4
+    assert list(added.values())[-3:] == [70, 71, 72]
+    assert added['2000-01-01 00:00:00.5'] == 73
+
+
+def test_apply_wal_entry(tmp_path):
+    from hrss_server import apply_wal_entry, patient_db, physician_db
+    from hrss_wal import WriteAheadLog
+    wal = WriteAheadLog(str(tmp_path / 'wal.log'))
+    wal.open()
+    wal.append({"op": 'attending', "attending_username": 'Wal.A',
+                "attending_email": 'wal@BLH_hospital.com',
+                "attending_phone": '919-555-0100'})
+    wal.append({"op": 'patient', "patient_id": 9001,
+                "attending_username": 'Wal.A', "patient_age": 20})
+    wal.append({"op": 'heart_rate', "patient_id": 9001, "heart_rate": 120,
+                "timestamp": 2000})
+    wal.append({"op": 'heart_rates', "patient_id": 9001,
+                "heart_rates": [80, 90], "timestamps": [1000, 3000]})
+    wal.close()
+
+    count = wal.replay(apply_wal_entry)
+    record = patient_db.remove(9001)
+    del physician_db.physicians['Wal.A']
+
+    assert count == 4
+    assert record['heart_rate_history'].to_dict() == {
+        '1970-01-01 00:00:00.000001': 80,
+        '1970-01-01 00:00:00.000002': 120,
+        '1970-01-01 00:00:00.000003': 90}
+    assert record['tachycardia_events'].timestamps().tolist() == [2000]
+
+
+@pytest.mark.parametrize("auth, expected", [
+    (None, ("Sign in as an administrator with HTTP basic auth", 401)),
+    ({"username": 'DavidH', "password": 'wrong123'}, ("Wrong password", 401)),
+    ({"username": 'Nobody', "password": 'davidhe1998'},
+     ("Invalid username", 401)),
+    ({"username": 'DavidH', "password": 'davidhe1998'}, ("pass", 200))])
+def test_import_admin_process(auth, expected):
+    from werkzeug.datastructures import Authorization
+    from hrss_server import import_admin_process, admin_db
+    if auth is not None:
+        auth = Authorization('basic', auth)
+    assert import_admin_process(auth, admin_db) == expected
+
+
+def test_heart_rate_import_worker():
+    import io
+    import json
+    from hrss_ingest import iter_csv
+    from hrss_server import heart_rate_import_worker, patient_db
+    history_before = patient_db.get(82)['heart_rate_history'].to_dict()
+    stream = io.BytesIO(b'patient_id,heart_rate,timestamp\n'
+                        b'82,70,2010-01-01 00:00:00\n'
+                        b'82,g85,2010-01-01 00:00:01\n'
+                        b'82\n'
+                        b'99999,70,2010-01-01 00:00:00\n'
+                        b'82,150,2010-01-01 00:00:02\n')
+    ticks = iter(range(100))
+
+    lines = [json.loads(line) for line in heart_rate_import_worker(
+        iter_csv(stream), chunk_rows=2, test_mode=True,
+        clock=lambda: next(ticks))]
+
+    assert lines == [
+        {"seq": 2, "status": 400,
+         "msg": 'Field "heart_rate" must be an int or a str of an int.\n'
+                'Fix and request again.'},
+        {"rows": 2, "added": 1, "rejected": 1, "rows_per_second": 2.0},
+        {"seq": 3, "status": 400,
+         "msg": 'The row has 1 fields, the header has 3.\n'
+                'Fix and request again.'},
+        {"seq": 4, "status": 400,
+         "msg": 'This patient_id does not exist.\nFix and request again.'},
+        {"rows": 4, "added": 1, "rejected": 3, "rows_per_second": 2.0},
+        {"rows": 5, "added": 2, "rejected": 3, "rows_per_second": 5 / 3},
+        {"rows": 5, "added": 2, "rejected": 3, "rows_per_second": 1.25,
+         "alerts": 0, "seconds": 4, "done": True}]
+    assert patient_db.get(82)['heart_rate_history'].to_dict() == \
+        history_before  # The 1 Hz history of 2010 went in before the
+    # latest heart rate, the lateness limit doesn't apply
+
+
+def test_import_heart_rates_new_patients():
+    import numpy as np
+    import pandas as pd
+    import hrss_server
+    from hrss_store import PatientStore, TachycardiaEventLog
+    store = PatientStore()
+    store.tachycardia_log.extend(0, np.arange(1000000),
+                                 np.full(1000000, 150))  # A populated log
+    patient_ids = np.arange(1, 2001)
+    for patient_id in patient_ids:
+        store.add({"patient_id": int(patient_id),
+                   "attending_username": 'Banks.J', "patient_age": 20})
+    readings = pd.DataFrame({
+        "patient_id": np.repeat(patient_ids, 5),
+        "heart_rate": np.tile([90, 150, 160, 80, 170], 2000),
+        "timestamp": np.tile(np.arange(1000000, 1000005), 2000),
+        "msg": ''})
+    patient_db_before = hrss_server.patient_db
+    hrss_server.patient_db = store
+    try:
+        updated = hrss_server.import_heart_rates(readings)  # New patients
+        hrss_server.import_heart_rates(readings.iloc[::2])  # Repeated
+        # timestamps
+    finally:
+        hrss_server.patient_db = patient_db_before
+    assert updated == patient_ids.tolist()
+    expect = TachycardiaEventLog.from_records(store.records())
+    assert len(store.tachycardia_log) == 1000000 + len(expect)
+    assert [(p, t.tolist()) for p, t, _ in store.tachycardia_log.since(
+        999999)] == [(p, t.tolist()) for p, t, _ in expect.since(999999)]
+
+
+def test_benchmark_import():
+    from hrss_benchmark import benchmark_import
+
+    result = benchmark_import(patients=10, readings=3, events=100)
+
+    assert result['readings'] == 30
+    assert result['seconds'] > 0
+
+
+def test_commit_heart_rates_wal_failed(tmp_path):
+    import hrss_server
+    from test_hrss_wal import failed_wal
+    record = hrss_server.patient_db.get(62)
+    latest_before = record['latest']
+    heart_rate_history_before = record['heart_rate_history'].copy()
+    wal_before = hrss_server.wal
+    hrss_server.wal = failed_wal(str(tmp_path / 'wal.log'))
+    try:
+        hrss_server.wal.append({"op": 'x'})
+        results = hrss_server.commit_heart_rates([
+            (62, 60, hrss_server.reading_clock(), False),
+            (99999, 60, hrss_server.reading_clock(), False)])
+    finally:
+        hrss_server.wal.close()
+        hrss_server.wal = wal_before
+        record['heart_rate_history'] = heart_rate_history_before
+        record['latest'] = latest_before
+        hrss_server.patient_db.index_tachycardia(record)
+
+    assert results == [(hrss_server.WAL_FAILED_MSG, 503),
+                       ('This patient_id does not exist.', 400)]
+
+
+def test_raise_alert_deferred():
+    from hrss_server import raise_alert, alert_coalescer, alert_queue, \
+        patient_db
+    record = patient_db.get(82)
+    deferred = []
+
+    msg = raise_alert({"patient_id": 82, "heart_rate": 200,
+                       "timestamp": 1667296800000000000}, record,
+                      deferred=deferred)
+    alert_coalescer.open.pop(82)
+
+    assert len(deferred) == 1  # Kept for submit_alerts(), not queued
+    alert_id, out_data = deferred[0]
+    assert alert_queue.result(alert_id) is None
+    assert msg == 'Alert {} queued to e-mail {}.'.format(
+        alert_id, out_data['to_email'])
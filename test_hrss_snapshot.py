@@ -0,0 +1,93 @@
+def test_snapshot_round_trip(tmp_path):
+    import pandas as pd
+    from hrss_snapshot import pack_snapshot, read_snapshot, write_snapshot
+    from hrss_store import PatientStore, PhysicianStore
+    patient_db = PatientStore()
+    record = patient_db.add({"patient_id": 1, "attending_username": 'Banks.J',
+                             "patient_age": 20})
+    patient_db.add_readings(record, [10, 20, 30], [90, 120, 80])
+    patient_db.add({"patient_id": 2, "attending_username": 'Banks.J',
+                    "patient_age": 5})  # No history
+    physician_db = PhysicianStore()
+    physician_db.add({"attending_username": 'Banks.J',
+                      "attending_email": 'DrBanksJohn@BLH_hospital.com',
+                      "attending_phone": '919-555-0100'})
+    admin_db = pd.DataFrame([['DavidH', 'davidhe1998']],
+                            columns=['admin_username', 'admin_password'])
+    path = str(tmp_path / 'snapshot.npz')
+
+    snapshot_id = write_snapshot(path, pack_snapshot(
+        patient_db, physician_db, admin_db), wal_offset=123)
+    patients, physicians, admins, loaded_id, wal_offset = \
+        read_snapshot(path)
+
+    assert (loaded_id, wal_offset) == (snapshot_id, 123)
+    loaded = patients.get(1)
+    assert loaded['heart_rate_history'].to_dict() == \
+        record['heart_rate_history'].to_dict()
+    assert loaded['heart_rate_history'].stats() == \
+        record['heart_rate_history'].stats()
+    assert loaded['tachycardia_events'].timestamps().tolist() == [20]
+    assert loaded['latest'] == record['latest']
+    assert patients.get(2)['heart_rate_history'] is None
+    assert [r['patient_id'] for r in patients.patients_of('Banks.J')] == \
+        [1, 2]
+    assert [(p, t.tolist()) for p, t, _ in
+            patients.tachycardia_log.since(0)] == [(1, [20])]
+    assert physicians.get('Banks.J') == physician_db.get('Banks.J')
+    assert admins.values.tolist() == [['DavidH', 'davidhe1998']]
+
+
+def test_benchmark_snapshot():
+    from hrss_benchmark import benchmark_snapshot
+
+    result = benchmark_snapshot(patients=1000, readings=3)
+
+    assert result['readings'] == 3000
+    assert result['load_seconds'] > 0
+
+
+def test_snapshot_segments(tmp_path):
+    import os
+    import pandas as pd
+    from hrss_segments import MappedHeartRateSeries, SegmentDirectory
+    from hrss_snapshot import pack_snapshot, read_snapshot, segment_path, \
+        write_snapshot
+    from hrss_store import PatientStore, PhysicianStore
+    patient_db = PatientStore(
+        segments=SegmentDirectory(str(tmp_path / 'live'), max_readings=4))
+    for patient_id in [1, 2]:
+        patient_db.add({'patient_id': patient_id, 'attending_username': 'Tom',
+                        'patient_age': 50})
+    patient_db.add_readings(patient_db.get(1), [1, 2, 3, 4, 5, 6],
+                            [60, 170, 80, 90, 180, 70])
+    patient_db.add_readings(patient_db.get(2), [1, 2], [60, 200])
+    admin_db = pd.DataFrame(columns=['admin_username', 'admin_password'])
+    path = str(tmp_path / 'snapshot.npz')
+
+    arrays = pack_snapshot(patient_db, PhysicianStore(), admin_db)
+    assert arrays['patients.segment_ids'].tolist() == [1]
+    assert len(arrays['patients.timestamps']) == 2  # Only patient 2
+    snapshot_id = write_snapshot(path, arrays, patient_db=patient_db)
+    segments = SegmentDirectory(str(tmp_path / 'loaded'), max_readings=4)
+    patients, _, _, _, _ = read_snapshot(path, segments=segments)
+    in_memory = read_snapshot(path)[0]
+
+    for loaded in [patients, in_memory]:
+        history = loaded.get(1)['heart_rate_history']
+        assert history.to_dict() == \
+            patient_db.get(1)['heart_rate_history'].to_dict()
+        assert history.stats() == \
+            patient_db.get(1)['heart_rate_history'].stats()
+        assert loaded.get(1)['latest'] == patient_db.get(1)['latest']
+        assert loaded.get(1)['tachycardia_events'].timestamps().tolist() == \
+            [2, 5]
+        assert [(p, t.tolist()) for p, t, _ in
+                loaded.tachycardia_log.since(0)] == [(1, [2, 5]), (2, [2])]
+    assert type(patients.get(1)['heart_rate_history']) is \
+        MappedHeartRateSeries
+    patients.add_reading(patients.get(1), 7, 75, False)  # The copy grows
+    assert len(patient_db.get(1)['heart_rate_history']) == 6
+    write_snapshot(path, pack_snapshot(patient_db, PhysicianStore(),
+                                       admin_db), patient_db=patient_db)
+    assert not os.path.exists(segment_path(path, snapshot_id))
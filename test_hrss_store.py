@@ -0,0 +1,452 @@
+import pytest
+import pandas as pd
+
+
+def test_patient_store_add_get_remove():
+    from hrss_store import PatientStore
+    store = PatientStore()
+    store.add({"patient_id": 1, "attending_username": 'Banks.J',
+               "patient_age": 25})
+    assert len(store) == 1
+    assert 1 in store
+    assert store.get(1) == {"patient_id": 1,
+                            "attending_username": 'Banks.J',
+                            "patient_age": 25,
+                            "heart_rate_history": None,
+                            "latest": None,
+                            "tachycardia_events": None}
+    assert store.get(2) is None
+    store.remove(1)
+    assert len(store) == 0
+    assert 1 not in store
+
+
+def test_patient_store_attending_index():
+    from hrss_store import PatientStore
+    store = PatientStore()
+    for patient_id, attending in [(1, 'Banks.J'), (2, 'Dixon.K'),
+                                  (3, 'Banks.J')]:
+        store.add({"patient_id": patient_id,
+                   "attending_username": attending, "patient_age": 25})
+    assert [r['patient_id'] for r in store.patients_of('Banks.J')] == [1, 3]
+    store.remove(1)
+    assert [r['patient_id'] for r in store.patients_of('Banks.J')] == [3]
+    assert store.patients_of('Cline.A') == []
+    PatientStore.set_latest(store.get(2), 10, 120, True)
+    assert store.get(2)['latest'] == {'timestamp': 10, 'heart_rate': 120,
+                                      'tachycardic': True}
+
+
+@pytest.mark.parametrize('histories, expect_size', [
+    ([{'2019-07-25 12:35:24': 111}, float('nan')], 8),
+    ([], 0)
+])
+def test_patient_store_frame_round_trip(histories, expect_size):
+    from hrss_store import PatientStore
+    frame = pd.DataFrame(
+        {"patient_id": list(range(1, len(histories) + 1)),
+         "attending_username": ['Banks.J'] * len(histories),
+         "patient_age": [25] * len(histories),
+         "heart_rate_history": histories})
+    store = PatientStore.from_frame(frame)
+    out = store.to_frame()
+    assert out.size == expect_size
+    assert list(out.columns) == PatientStore.columns
+    if len(histories) != 0:
+        assert store.get(2)['heart_rate_history'] is None
+
+
+@pytest.mark.parametrize('time_str, epoch', [
+    ('1970-01-01 00:00:00', 0),
+    ('2019-07-25 12:35:24', 1564058124000000000),
+    ('2019-07-25 12:35:24.25', 1564058124250000000),
+    ('1970-01-01 00:00:00.000000001', 1)
+])
+def test_epoch_conversion(time_str, epoch):
+    from hrss_store import time_str_to_epoch, epoch_to_time_str
+    assert time_str_to_epoch(time_str) == epoch
+    assert epoch_to_time_str(epoch) == time_str
+
+
+def test_timestamp_clock():
+    from datetime import datetime
+    from hrss_store import TimestampClock
+    clock = TimestampClock(now=lambda: datetime(2022, 11, 1, 10))
+
+    timestamps = [clock() for _ in range(3)]
+
+    assert timestamps == [1667296800000000000, 1667296800000000001,
+                          1667296800000000002]
+
+
+def test_heart_rate_series_append():
+    from hrss_store import HeartRateSeries
+    series = HeartRateSeries(capacity=2)
+    for timestamp, heart_rate in [(30, 70), (10, 90), (20, 80), (40, 60)]:
+        series.append(timestamp, heart_rate)
+    series.append(40, 65)  # Same timestamp as the latest one overwrites it
+    assert len(series) == 4
+    assert series.timestamps().tolist() == [10, 20, 30, 40]
+    assert series.heart_rates().tolist() == [90, 80, 70, 65]
+    assert series.latest() == (40, 65)
+
+
+def test_heart_rate_series_ordered_insert():
+    from hrss_store import HeartRateSeries
+    series = HeartRateSeries(capacity=2)
+    for timestamp, heart_rate in [(10, 90), (40, 60), (20, 80), (30, 70),
+                                  (5, 100), (20, 85)]:
+        series.append(timestamp, heart_rate)
+    assert series.timestamps().tolist() == [5, 10, 20, 30, 40]
+    assert series.heart_rates().tolist() == [100, 90, 85, 70, 60]
+    assert series.since(20).tolist() == [70, 60]
+    assert series.since(40).tolist() == []
+    assert series.latest() == (40, 60)
+
+
+def test_heart_rate_series_dict_round_trip():
+    from hrss_store import HeartRateSeries
+    history = {'2019-07-25 12:35:24': 111, '2016-07-10 13:12:48': 88}
+    series = HeartRateSeries.from_dict(history)
+    copy = series.copy()
+    series.append(2000000000, 70)
+    assert copy.to_dict() == {'2016-07-10 13:12:48': 88,
+                              '2019-07-25 12:35:24': 111}
+
+
+def test_heart_rate_series_memory():
+    from hrss_store import HeartRateSeries
+    series = HeartRateSeries()
+    for i in range(100000):
+        series.append(i, 60 + i % 100)
+    assert series.nbytes / len(series) < 32  # A dict entry costs > 100 bytes
+
+
+def test_physician_store():
+    from hrss_store import PhysicianStore
+    store = PhysicianStore.from_frame(
+        pd.read_csv('dummy_data/physicians_data.csv'))
+    assert 'Banks.J' in store
+    assert store.get('Banks.J')['attending_email'] == \
+        'DrBanksJohn@BLH_hospital.com'
+    store.add({"attending_username": 'Apple.A',
+               "attending_email": 'DrAppleAnn@BLH_hospital.com',
+               "attending_phone": '111-111-1111'})
+    assert len(store) == 21
+    assert store.to_frame().tail(1).values.tolist() == [
+        ['Apple.A', 'DrAppleAnn@BLH_hospital.com', '111-111-1111']]
+    assert store.get('Apple.B') is None
+
+
+def test_heart_rate_series_running_stats():
+    import numpy as np
+    from hrss_store import HeartRateSeries
+    series = HeartRateSeries(capacity=2)
+    for timestamp, heart_rate in [(10, 90), (40, 60), (20, 80), (30, 70)]:
+        series.append(timestamp, heart_rate)
+    series.append(40, 100)  # Overwriting the min reading moves the min
+    expect = np.array([90, 80, 70, 100])
+    stats = series.stats()
+    assert series.mean() == 85
+    assert stats == {'count': 4, 'mean': 85.0,
+                     'std': pytest.approx(float(expect.std())),
+                     'min': 70, 'max': 100}
+    assert series.copy().stats() == stats
+
+
+def test_heart_rate_series_window_mean():
+    from hrss_store import HeartRateSeries
+    series = HeartRateSeries(capacity=2)
+    for timestamp, heart_rate in [(10, 90), (40, 60), (20, 80), (30, 70),
+                                  (5, 100), (20, 85)]:
+        series.append(timestamp, heart_rate)
+    assert series.window_mean(0) == 81
+    assert series.window_mean(5) == (90 + 85 + 70 + 60) / 4
+    assert series.window_mean(5, 30) == (90 + 85) / 2
+    assert series.since(5, 30).tolist() == [90, 85]
+    assert series.window_mean(40) is None
+    assert series.window_mean(30, 10) is None
+    assert series.copy().window_mean(5, 30) == (90 + 85) / 2
+
+
+def test_patient_store_tachycardia_events():
+    from hrss_store import PatientStore, HeartRateSeries
+    store = PatientStore()
+    record = store.add({"patient_id": 1, "attending_username": 'Banks.J',
+                        "patient_age": 3,
+                        "heart_rate_history": HeartRateSeries.from_dict(
+                            {'2019-07-25 12:35:24': 140,
+                             '2019-07-26 12:35:24': 90,
+                             '2019-07-27 12:35:24': 150})})
+    events = record['tachycardia_events']
+    assert events.heart_rates().tolist() == [140, 150]
+    assert 1564058124000000000 in events
+    record['heart_rate_history'].append(1564058124000000000, 80)
+    store.add_tachycardia_event(record, 1564058124000000000, 80, False)
+    assert record['tachycardia_events'].heart_rates().tolist() == [150]
+    assert len(store.tachycardia_log) == 1
+    store.add_tachycardia_event(record, 1564400000000000000, 160, True)
+    assert len(record['tachycardia_events']) == 2
+    assert len(store.tachycardia_log) == 2
+    assert store.add({"patient_id": 2, "attending_username": 'Banks.J',
+                      "patient_age": 3})['tachycardia_events'] is None
+
+
+def test_tachycardia_event_log():
+    from hrss_store import TachycardiaEventLog, HeartRateSeries
+    log = TachycardiaEventLog(capacity=2)
+    for timestamp, patient_id, heart_rate in [(10, 2, 150), (20, 1, 120),
+                                              (30, 2, 160), (15, 1, 130)]:
+        log.append(timestamp, patient_id, heart_rate)
+    groups = [(p, t.tolist(), h.tolist()) for p, t, h in log.since(10)]
+    assert groups == [(1, [15, 20], [130, 120]), (2, [30], [160])]
+    log.replace_patient(1, HeartRateSeries.from_dict(
+        {'1970-01-01 00:00:00.000000025': 140}))
+    groups = [(p, t.tolist()) for p, t, _ in log.since(0)]
+    assert groups == [(1, [25]), (2, [10, 30])]
+    log.replace_patient(2)
+    assert len(log) == 1
+    assert log.since(25) == []
+
+
+def test_rw_lock():
+    import threading
+    from hrss_store import RWLock
+    lock = RWLock()
+    with lock.read():
+        with lock.read():  # Readers share the lock
+            pass
+    writing = threading.Event()
+    done = threading.Event()
+
+    def writer():
+        with lock.write():
+            writing.set()
+            done.wait()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    writing.wait()
+    entered = []
+    reader = threading.Thread(target=lambda: entered.append(
+        lock.read().__enter__()))
+    reader.start()
+    reader.join(0.1)
+    assert entered == []  # Blocked while the writer holds the lock
+    done.set()
+    thread.join()
+    reader.join()
+    assert len(entered) == 1
+
+
+def test_striped_lock():
+    from hrss_store import StripedLock
+    locks = StripedLock(stripes=4)
+    assert len(locks) == 4
+    assert locks.for_key(1) is locks.for_key(1)
+    assert locks.for_key(1) is locks.for_key(5)
+    assert locks.for_key(1) is not locks.for_key(2)
+
+
+def test_patient_store_parallel_readings():
+    import threading
+    from hrss_store import PatientStore
+    store = PatientStore()
+    for patient_id in range(8):
+        store.add({"patient_id": patient_id,
+                   "attending_username": 'Banks.J', "patient_age": 20})
+
+    def ingest(patient_id, first):
+        for timestamp in range(first, 2000, 2):  # 2 threads per patient
+            heart_rate = 60 + timestamp % 100
+            with store.locked(patient_id) as record:
+                store.add_reading(record, timestamp, heart_rate,
+                                  heart_rate > 100)
+
+    threads = [threading.Thread(target=ingest, args=(p, f))
+               for p in range(8) for f in (0, 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for patient_id in range(8):
+        record = store.get(patient_id)
+        assert record['heart_rate_history'].timestamps().tolist() == \
+            list(range(2000))
+        assert len(record['tachycardia_events']) == 1180
+        assert record['latest']['timestamp'] == 1999
+    assert len(store.tachycardia_log) == 8 * 1180
+    with store.locked(99) as record:
+        assert record is None
+
+
+def test_heart_rate_series_extend():
+    from hrss_store import HeartRateSeries
+    series = HeartRateSeries.from_arrays([30, 10, 20, 10], [3, 1, 2, 9])
+    assert series.timestamps().tolist() == [10, 20, 30]
+    assert series.heart_rates().tolist() == [9, 2, 3]  # The last 10 wins
+    assert series.extend([40, 50], [4, 5]) is True
+    assert series.extend([35, 20, 60], [7, 8, 6]) is False
+    assert series.timestamps().tolist() == [10, 20, 30, 35, 40, 50, 60]
+    assert series.heart_rates().tolist() == [9, 8, 3, 7, 4, 5, 6]
+    expect = HeartRateSeries()
+    for t, h in zip(series.timestamps(), series.heart_rates()):
+        expect.append(int(t), int(h))
+    assert series.stats() == expect.stats()
+    assert series.window_mean(10, 50) == expect.window_mean(10, 50)
+    assert HeartRateSeries.from_arrays([], []).timestamps().tolist() == []
+
+
+def test_patient_store_add_readings():
+    from hrss_store import PatientStore
+    store = PatientStore()
+    record = store.add({"patient_id": 1, "attending_username": 'Banks.J',
+                        "patient_age": 20})
+    flags = store.add_readings(record, [10, 20, 30], [90, 120, 80])
+    assert flags.tolist() == [False, True, False]
+    assert record['tachycardia_events'].timestamps().tolist() == [20]
+    assert record['latest'] == {'timestamp': 30, 'heart_rate': 80,
+                                'tachycardic': False}
+    store.add_readings(record, [40, 50], [130, 140])
+    store.add_readings(record, [5, 20], [150, 70])  # Late and replacing
+    assert record['tachycardia_events'].timestamps().tolist() == \
+        [5, 40, 50]
+    assert [t.tolist() for _, t, _ in store.tachycardia_log.since(0)] == \
+        [[5, 40, 50]]
+    assert record['latest']['tachycardic'] is True
+
+
+def test_heart_rate_series_merge_late():
+    import numpy as np
+    from hrss_store import HeartRateSeries
+    rng = np.random.default_rng(7)
+    timestamps = np.arange(0, 2000, 2)
+    series = HeartRateSeries.from_arrays(timestamps, 60 + timestamps % 90)
+    late = rng.integers(1900, 2100, 50)  # Late, on time and repeated
+    heart_rates = rng.integers(40, 200, 50)
+    assert series.extend(late, heart_rates) is False
+    expect = HeartRateSeries.from_arrays(
+        np.concatenate([timestamps, late]),
+        np.concatenate([60 + timestamps % 90, heart_rates]))
+    assert series.to_dict() == expect.to_dict()
+    assert series.stats() == expect.stats()
+    assert series.window_mean(1950, 2050) == expect.window_mean(1950, 2050)
+    assert series.isin([0, 1, 1998]).tolist() == [True, False, True]
+
+
+def test_tachycardia_event_log_late_extend():
+    from hrss_store import TachycardiaEventLog
+    log = TachycardiaEventLog()
+    log.extend(1, [10, 20, 30, 40], [120, 121, 122, 123])
+    log.extend(2, [15, 30, 35], [130, 131, 132])  # Late for the log
+    assert log._timestamps[:len(log)].tolist() == [10, 15, 20, 30, 30, 35,
+                                                   40]
+    assert log._patient_ids[:len(log)].tolist() == [1, 2, 1, 1, 2, 2, 1]
+    assert [(p, t.tolist()) for p, t, _ in log.since(20)] == [
+        (1, [30, 40]), (2, [30, 35])]
+
+
+def test_heart_rate_series_remove():
+    from hrss_store import HeartRateSeries
+    series = HeartRateSeries.from_arrays([10, 20, 30, 40, 50],
+                                         [90, 200, 80, 70, 100])
+    assert series.remove([40, 20, 25]) == 2
+    assert series.timestamps().tolist() == [10, 30, 50]
+    expect = HeartRateSeries.from_arrays([10, 30, 50], [90, 80, 100])
+    assert series.stats() == expect.stats()  # The max was dropped
+    assert series.window_mean(10, 50) == expect.window_mean(10, 50)
+    assert series.remove([]) == 0
+    assert series.remove([10, 30, 50]) == 3
+    assert series.timestamps().tolist() == []
+
+
+def test_tachycardia_event_log_remove():
+    import numpy as np
+    from hrss_store import TachycardiaEventLog
+    log = TachycardiaEventLog()
+    log.extend(1, [10, 20, 30, 40], [120, 121, 122, 123])
+    log.extend(2, [15, 30, 35], [130, 131, 132])
+    log.remove(1, np.array([30, 40, 35]))
+    assert log._timestamps[:len(log)].tolist() == [10, 15, 20, 30, 35]
+    assert log._patient_ids[:len(log)].tolist() == [1, 2, 1, 2, 2]
+    log.remove(2, np.array([], dtype=np.int64))
+    assert len(log) == 5
+
+
+def test_patient_store_add_readings_keeps_log():
+    import numpy as np
+    from hrss_store import PatientStore, TachycardiaEventLog
+    rng = np.random.default_rng(11)
+    store = PatientStore()
+    store.tachycardia_log.replace_patient = None  # Rebuilding the log of
+    # all the patients would fail
+    for patient_id in range(1, 4):
+        store.add({"patient_id": patient_id, "attending_username": 'Banks.J',
+                   "patient_age": 20})
+    for _ in range(30):  # New, late and repeated timestamps
+        for record in store.records():
+            store.add_readings(record, rng.integers(0, 200, 8),
+                               rng.integers(60, 200, 8))
+    expect = TachycardiaEventLog.from_records(store.records())
+    assert [(p, t.tolist(), h.tolist()) for p, t, h in
+            store.tachycardia_log.since(-1)] == \
+        [(p, t.tolist(), h.tolist()) for p, t, h in expect.since(-1)]
+    for record in store.records():
+        history = record['heart_rate_history']
+        flags = history.heart_rates() > 100
+        assert record['tachycardia_events'].timestamps().tolist() == \
+            history.timestamps()[flags].tolist()
+        first = int(history.timestamps()[0])
+        history.append(first, 60)
+        store.add_tachycardia_event(record, first, 60, False)
+        assert first not in record['tachycardia_events']
+
+
+def test_patient_store_late_mask():
+    from hrss_store import PatientStore
+    store = PatientStore()
+    record = store.add({"patient_id": 1, "attending_username": 'Banks.J',
+                        "patient_age": 20})
+    assert store.late_mask(record, [0], 10).tolist() == [False]  # No
+    # history yet
+    store.add_readings(record, [100, 200], [80, 130])
+    assert store.late_mask(record, [189, 190, 250], 10).tolist() == \
+        [True, False, False]
+    assert store.late_mask(record, [0], None).tolist() == [False]
+    assert store.late_mask(record, [139, 140], 10, now=150).tolist() == \
+        [True, False]  # The latest reading is ahead of the clock
+    store.add_readings(record, [195, 150], [140, 90])  # Late, no rebuild
+    assert record['tachycardia_events'].timestamps().tolist() == [195, 200]
+    assert record['latest']['timestamp'] == 200
+
+
+def test_patient_store_arrays_round_trip():
+    from hrss_store import PatientStore
+    store = PatientStore()
+    for patient_id, age in [(1, 20), (2, 3), (3, 50)]:
+        store.add({"patient_id": patient_id, "attending_username": 'Banks.J',
+                   "patient_age": age})
+    store.add_readings(store.get(1), [10, 20], [90, 130])
+    store.add_readings(store.get(3), [15, 5, 25], [101, 60, 99])
+    store.get(2)['heart_rate_history'] = None
+
+    loaded = PatientStore.from_arrays(store.to_arrays())
+
+    for record in store.records():
+        other = loaded.get(record['patient_id'])
+        assert other['latest'] == record['latest']
+        if record['heart_rate_history'] is None:
+            assert other['heart_rate_history'] is None
+            continue
+        assert other['heart_rate_history'].to_dict() == \
+            record['heart_rate_history'].to_dict()
+        assert other['heart_rate_history'].window_mean(5, 20) == \
+            record['heart_rate_history'].window_mean(5, 20)
+        assert other['tachycardia_events'].to_dict() == \
+            record['tachycardia_events'].to_dict()
+    loaded.add_reading(loaded.get(3), 30, 150, True)  # Grows out of the
+    # loaded arrays
+    assert loaded.get(3)['heart_rate_history'].stats()['max'] == 150
+    assert [(p, t.tolist()) for p, t, _ in
+            loaded.tachycardia_log.since(0)] == [(1, [20]), (3, [15, 30])]
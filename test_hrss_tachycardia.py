@@ -0,0 +1,42 @@
+import pytest
+import numpy as np
+
+
+@pytest.mark.parametrize('age, expect', [
+    (0, 151),
+    (2, 151),
+    (3, 137),
+    (7, 133),
+    (11, 130),
+    (15, 119),
+    (16, 100),
+    (120, 100),
+    (-1, 151)
+])
+def test_tachycardia_threshold(age, expect):
+    from hrss_tachycardia import tachycardia_threshold
+
+    assert tachycardia_threshold(age) == expect
+
+
+def test_tachycardic_mask():
+    from hrss_tachycardia import tachycardic_mask, is_tachycardic
+    ages = np.array([2, 2, 5, 5, 15, 15, 16, 100])
+    heart_rates = np.array([151, 152, 133, 134, 119, 120, 101, 100])
+
+    flags = tachycardic_mask(ages, heart_rates)
+
+    assert flags.tolist() == [False, True, False, True, False, True, True,
+                              False]
+    assert flags.tolist() == [is_tachycardic(a, h)
+                              for a, h in zip(ages, heart_rates)]
+    assert tachycardic_mask(3, [137, 138]).tolist() == [False, True]
+
+
+def test_benchmark_tachycardia():
+    from hrss_benchmark import benchmark_tachycardia
+
+    result = benchmark_tachycardia(n=1000)
+
+    assert result['readings'] == 1000
+    assert result['speedup'] > 0
@@ -0,0 +1,123 @@
+import threading
+
+
+def test_wal_append_and_replay(tmp_path):
+    from hrss_wal import WriteAheadLog
+    path = str(tmp_path / 'wal.log')
+    wal = WriteAheadLog(path, sync_interval=0.001)
+    assert wal.append({"op": 'x'}) is None  # Not open yet
+    wal.open()
+    for i in range(3):
+        assert wal.append({"op": 'x', "i": i}) == i + 1
+    assert wal.sync(timeout=5)
+    wal.close()
+
+    entries = []
+    assert WriteAheadLog(path).replay(entries.append) == 3
+    assert entries == [{"op": 'x', "i": i} for i in range(3)]
+
+
+def test_wal_torn_tail(tmp_path):
+    import os
+    from hrss_wal import WriteAheadLog, encode_frame
+    path = str(tmp_path / 'wal.log')
+    good = encode_frame({"op": 'x', "i": 0})
+    bad = bytearray(encode_frame({"op": 'x', "i": 1}))
+    bad[-2] ^= 0xff  # A flipped bit fails the checksum
+    with open(path, 'wb') as f:
+        f.write(good + bytes(bad) + encode_frame({"op": 'x', "i": 2})[:5])
+
+    entries = []
+    wal = WriteAheadLog(path)
+    assert wal.replay(entries.append) == 1
+    assert os.path.getsize(path) == len(good)  # The torn tail is cut off
+    wal.open()
+    wal.append({"op": 'x', "i": 3})
+    wal.close()
+    entries = []
+    assert WriteAheadLog(path).replay(entries.append) == 2
+    assert [e['i'] for e in entries] == [0, 3]
+
+
+def test_wal_group_commit(tmp_path):
+    from hrss_wal import WriteAheadLog
+    wal = WriteAheadLog(str(tmp_path / 'wal.log'), sync_interval=0.01)
+    wal.open()
+
+    def writer(k):
+        for i in range(50):
+            wal.append({"op": 'x', "k": k, "i": i})
+            assert wal.sync(timeout=5)
+
+    threads = [threading.Thread(target=writer, args=(k,)) for k in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wal.close()
+
+    assert wal.counters['entries'] == 400
+    assert wal.counters['syncs'] < 400  # The writers shared their fsyncs
+
+
+def test_wal_checkpoint(tmp_path):
+    from hrss_wal import WriteAheadLog
+    path = str(tmp_path / 'wal.log')
+    wal = WriteAheadLog(path)
+    wal.open()
+    wal.append({"op": 'x', "i": 0})
+    offset = wal.tell()
+    wal.append({"op": 'x', "i": 1})
+    assert WriteAheadLog(path).checkpoint_id() is None
+    wal.checkpoint(offset, 'abc')
+    wal.append({"op": 'x', "i": 2})
+    wal.close()
+
+    entries = []
+    restarted = WriteAheadLog(path)
+    assert restarted.checkpoint_id() == 'abc'
+    assert restarted.replay(entries.append) == 3
+    assert entries == [{"op": 'checkpoint', "snapshot_id": 'abc'},
+                       {"op": 'x', "i": 1}, {"op": 'x', "i": 2}]
+
+
+class FullDisk:
+    # A log file whose flush fails like a full disk
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, data):
+        return self.f.write(data)
+
+    def flush(self):
+        import errno
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        self.f.close()
+
+
+def failed_wal(path):
+    from hrss_wal import WriteAheadLog
+    wal = WriteAheadLog(path, sync_interval=0.001)
+    wal.open()
+    wal._file = FullDisk(wal._file)
+    return wal
+
+
+def test_wal_flush_error(tmp_path):
+    wal = failed_wal(str(tmp_path / 'wal.log'))
+    assert wal.append({"op": 'x', "i": 0}) == 1
+    assert wal.sync(timeout=5) is False  # Woken up by the error
+    assert wal.error.strerror == 'No space left on device'
+    assert wal.append({"op": 'x', "i": 1}) is None
+    assert wal.sync() is False  # Returns at once, no timeout needed
+    done = []
+    thread = threading.Thread(target=lambda: done.append(wal.sync()))
+    thread.start()
+    thread.join(5)
+    assert done == [True]  # A thread that appended nothing isn't blocked
+    wal.close()